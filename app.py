@@ -6,6 +6,7 @@ from elasticapm import set_context
 from elasticapm.contrib.starlette import ElasticAPM
 from elasticapm.utils.disttracing import TraceParent
 
+from concurrent.futures import ThreadPoolExecutor
 import time, datetime
 
 from configs.logger import LoggerConfig
@@ -17,6 +18,12 @@ LoggerConfig.logger.info('\033[92mStart project chat bot Sentence Extractor\033[
 from configs.config import SettingsManager
 SettingsManager.initialize()
 
+# the model loads on its own thread while the database and APM connections are made
+from controllers.extractor import SentenceExtractor
+startup_start = time.perf_counter()
+startup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='load-model')
+model_loading = startup_executor.submit(SentenceExtractor.init_instance)
+
 from configs.es_model import ElasticsearchIndexConfigs
 ElasticsearchIndexConfigs()
 
@@ -27,14 +34,18 @@ from configs.db import (
 MongoDBConnection.connect_mongodb()
 MGCollection.init_collection()
 ElasticsearchConnection.connect_elasticsearch()
+ElasticsearchConnection.connect_async_elasticsearch()
 apm_client = ElasticsearchConnection.connect_apm_service()
 ESIndex.init_index()
 
 from controllers.elasticsearch_controller import ESFuncs
+from controllers.bulk_indexer import BulkIndexer
 ESFuncs.start_index_es()
+connections_seconds = time.perf_counter() - startup_start
 
-from controllers.extractor import SentenceExtractor
-SentenceExtractor.init_instance()
+model_loading.result()
+startup_executor.shutdown()
+LoggerConfig.logger.info(f"[Startup] connections={connections_seconds:.2f}s model_ready={time.perf_counter() - startup_start:.2f}s")
 
 ALLOWED_ORIGINS = ['*']
 
@@ -49,6 +60,12 @@ app = FastAPI(
 
 app.add_exception_handler(Exception, custom_exception_handler)
 
+@app.on_event("shutdown")
+async def close_connections():
+    # buffered sentences are flushed while the client is still open
+    await BulkIndexer.close_all()
+    await ElasticsearchConnection.close_async_elasticsearch()
+
 app.add_middleware(  
     CORSMiddleware,  
     allow_origins=ALLOWED_ORIGINS,
@@ -26,6 +26,16 @@ class Settings(BaseSettings):
     es_user: str
     es_password: str
     extracted_index_name: str
+    es_refresh_interval: str = '1s'
+    es_write_refresh: str = 'false'
+    es_max_connections: int = 10
+    es_bulk_enabled: bool = True
+    es_bulk_max_docs: int = 500
+    es_bulk_max_bytes: int = 5 * 1024 * 1024
+    es_bulk_flush_interval_ms: float = 200
+    es_bulk_queue_size: int = 10000
+    es_bulk_max_retries: int = 3
+    es_bulk_backoff_ms: float = 100
 
     apm_server_url: str
     apm_service_name: str
@@ -36,6 +46,33 @@ class Settings(BaseSettings):
     sentences_vector_size: int
     device: str
 
+    batch_max_size: int = 32
+    batch_max_wait_ms: float = 5
+    batch_queue_size: int = 1024
+    max_sentences_per_batch: int = 32
+    max_tokens_per_batch: int = 16384
+    inference_workers: int = 1
+    inference_processes: int = 0
+    inference_process_threads: int = 1
+    embedding_cache_max_bytes: int = 256 * 1024 * 1024
+    embedding_cache_dtype: str = 'float32'
+    vector_store_path: str = ''
+    vector_store_max_bytes: int = 4 * 1024 * 1024 * 1024
+    vector_store_compact_ratio: float = 0.75
+    ort_intra_op_threads: int = 0
+    ort_inter_op_threads: int = 0
+    ort_graph_optimization_level: str = 'all'
+    ort_execution_mode: str = 'sequential'
+    ort_enable_mem_pattern: bool = True
+    ort_enable_cpu_mem_arena: bool = True
+    ort_arena_shrinkage: bool = False
+    ort_optimized_model_path: str = ''
+    ort_disable_prepacking: bool = False
+    preload_app: bool = False
+    torch_cpu_precision: str = 'fp32'
+    pooler_heads_enabled: bool = True
+    model_revision: str = ''
+
     model_config = SettingsConfigDict(
         env_file=get_env_file(),
         env_file_encoding='utf-8',
@@ -2,7 +2,7 @@ import urllib.parse
 import requests
 
 from pymongo import MongoClient
-from elasticsearch import Elasticsearch
+from elasticsearch import Elasticsearch, AsyncElasticsearch
 from elasticapm import Client as ApmClient
 
 from configs.config import SettingsManager
@@ -29,6 +29,12 @@ class MongoDBConnection(SettingsManager):
             cls.check_mongo_connection()
         return cls.mongo_client
 
+    @classmethod
+    def reconnect(cls):
+        # MongoClient is not fork safe, a forked worker opens its own connection pool
+        cls.mongo_client = None
+        return cls.connect_mongodb()
+
     @classmethod
     def check_mongo_connection(cls):
         try:
@@ -61,34 +67,64 @@ class MGCollection(SettingsManager):
             cls.start_collection = True
         return cls.start_collection
 
+    @classmethod
+    def reconnect(cls):
+        cls.start_collection = None
+        return cls.init_collection()
+
 
 class ElasticsearchConnection(SettingsManager):
     apm_client = None
     es_client = None
+    async_es_client = None
 
     def __new__(cls):
         cls.connect_elasticsearch()
         cls.connect_apm_service()
         return super().__new__(cls)
 
+    @classmethod
+    def elasticsearch_config(cls):
+        es_config = {
+            "host": cls.settings.es_host,
+            "port": cls.settings.es_port,
+            "api_version": cls.settings.es_version,
+            "timeout": 60 * 60,
+            "use_ssl": False
+        }
+        use_authentication = cls.settings.es_user and cls.settings.es_password
+        if use_authentication:
+            es_config["http_auth"] = (cls.settings.es_user, cls.settings.es_password)
+        return es_config
+
     @classmethod
     def connect_elasticsearch(cls):
         if cls.es_client is None:
-            es_config = {
-                "host": cls.settings.es_host,
-                "port": cls.settings.es_port,
-                "api_version": cls.settings.es_version,
-                "timeout": 60 * 60,
-                "use_ssl": False
-            }
-            use_authentication = cls.settings.es_user and cls.settings.es_password
-            if use_authentication:
-                es_config["http_auth"] = (cls.settings.es_user, cls.settings.es_password)
-
-            cls.es_client = Elasticsearch(**es_config)
+            cls.es_client = Elasticsearch(**cls.elasticsearch_config())
             cls.check_elasticsearch_connection()
         return cls.es_client
 
+    @classmethod
+    def connect_async_elasticsearch(cls):
+        # the aiohttp session and its pool of maxsize connections are opened by the first request, inside the event loop
+        if cls.async_es_client is None:
+            cls.async_es_client = AsyncElasticsearch(**cls.elasticsearch_config(), maxsize=cls.settings.es_max_connections)
+        return cls.async_es_client
+
+    @classmethod
+    async def close_async_elasticsearch(cls):
+        if cls.async_es_client is not None:
+            await cls.async_es_client.close()
+            cls.async_es_client = None
+
+    @classmethod
+    def reconnect(cls):
+        # the urllib3 connection pool must not share sockets with the process it was forked from
+        cls.es_client = None
+        cls.async_es_client = None
+        cls.connect_async_elasticsearch()
+        return cls.connect_elasticsearch()
+
     @classmethod
     def check_elasticsearch_connection(cls):
         try:
@@ -57,7 +57,10 @@ class ElasticsearchIndexConfigs:
     def __new__(cls):
         instance = super().__new__(cls)
         cls.EXTRACTED_CONFIG = {
-            "settings": ElasticSearchConfigs.Settings,
+            "settings": {
+                **ElasticSearchConfigs.Settings,
+                "refresh_interval": SettingsManager.settings.es_refresh_interval
+            },
             "mappings": {
                 "properties": {
                     "id": {
@@ -88,6 +91,9 @@ class ElasticsearchIndexConfigs:
                             }
                         }
                     },
+                    "sentence_hash": {
+                        "type": "keyword"
+                    },
                     "sentence_vector": {
                         "type": "dense_vector",
                         "dims": SettingsManager.settings.sentences_vector_size
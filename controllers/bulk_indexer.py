@@ -0,0 +1,202 @@
+import asyncio
+import json
+
+from configs.config import SettingsManager
+from configs.logger import LoggerConfig
+from controllers.elasticsearch_controller import AsyncESFuncs
+
+
+class BulkIndexer:
+    RETRY_STATUSES = (429, 502, 503, 504)
+    instances = {}
+
+    def __init__(self, index_name, max_docs=500, max_bytes=5 * 1024 * 1024, flush_interval_ms=200, queue_size=10000, max_retries=3, backoff_ms=100, refresh=None):
+        self.index_name = index_name
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval_ms / 1000
+        self.queue_size = queue_size
+        self.max_retries = max_retries
+        self.backoff = backoff_ms / 1000
+        self.refresh = refresh
+        self.loop = None
+        self.queue = None
+        self.worker = None
+        self.carry = None
+        self.closing = False
+        # a document waits in documents until a flush takes it and in in_flight until that flush settles,
+        # lookups and counters see it the whole time
+        self.documents = {}
+        self.in_flight = {}
+        self.stats = {"documents": 0, "flushes": 0, "retries": 0, "failed": 0, "last_flush_ms": 0.0, "max_flush_ms": 0.0}
+        self.flush_seconds = 0.0
+
+    @classmethod
+    def get(cls, index_name):
+        if not SettingsManager.settings.es_bulk_enabled:
+            return None
+        if index_name not in cls.instances:
+            settings = SettingsManager.settings
+            cls.instances[index_name] = cls(
+                index_name,
+                max_docs=settings.es_bulk_max_docs,
+                max_bytes=settings.es_bulk_max_bytes,
+                flush_interval_ms=settings.es_bulk_flush_interval_ms,
+                queue_size=settings.es_bulk_queue_size,
+                max_retries=settings.es_bulk_max_retries,
+                backoff_ms=settings.es_bulk_backoff_ms,
+            )
+        return cls.instances[index_name]
+
+    @classmethod
+    def report_all(cls):
+        return {index_name: indexer.report() for index_name, indexer in cls.instances.items()}
+
+    @classmethod
+    async def close_all(cls):
+        for indexer in cls.instances.values():
+            await indexer.close()
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # futures of another loop can no longer be awaited
+            self.documents = {}
+            self.in_flight = {}
+        if self.loop is not loop or self.worker.done():
+            self.loop = loop
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self.carry = None
+            self.worker = loop.create_task(self._run())
+
+    async def submit(self, document, id, wait=False):
+        self._ensure_worker()
+        if id in self.documents:
+            # not sent yet, the newer document replaces it in the same flush
+            done = self.documents[id][1]
+            self.documents[id] = (document, done)
+        else:
+            done = self.loop.create_future()
+            self.documents[id] = (document, done)
+            # a full queue holds the caller back until the next flush makes room
+            await self.queue.put((id, len(json.dumps(document, default=str))))
+        if wait:
+            await asyncio.shield(done)
+
+    def lookup(self, id):
+        entry = self.documents.get(id) or self.in_flight.get(id)
+        return dict(entry[0]) if entry else None
+
+    async def wait(self, id):
+        entry = self.documents.get(id) or self.in_flight.get(id)
+        if entry:
+            await asyncio.wait([entry[1]])
+
+    async def update_counter(self, id, count=1):
+        if id in self.documents:
+            self.documents[id][0]['counter'] += count
+            return
+        await self.wait(id)
+        await AsyncESFuncs.update_counter(self.index_name, id)
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            await self._flush(batch)
+
+    async def _collect(self):
+        first = self.carry or await self.queue.get()
+        self.carry = None
+        batch, size = [first[0]], first[1]
+        deadline = self.loop.time() + (0 if self.closing else self.flush_interval)
+        while len(batch) < self.max_docs:
+            timeout = deadline - self.loop.time()
+            try:
+                if timeout <= 0:
+                    item = self.queue.get_nowait()
+                else:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            if item[0] is None:
+                break
+            if size + item[1] > self.max_bytes:
+                self.carry = item
+                break
+            batch.append(item[0])
+            size += item[1]
+        return batch
+
+    async def _flush(self, batch):
+        start = self.loop.time()
+        pending = [id for id in dict.fromkeys(batch) if id in self.documents]
+        for id in pending:
+            self.in_flight[id] = self.documents.pop(id)
+        documents = len(pending)
+        attempt = 0
+        while pending:
+            errors = await self._send(pending)
+            retry = []
+            for id in pending:
+                error = errors.get(id)
+                if error is None:
+                    self._settle(id)
+                elif attempt < self.max_retries and error.get('status') in (None, *self.RETRY_STATUSES):
+                    retry.append(id)
+                else:
+                    self._settle(id, error)
+            pending = retry
+            if pending:
+                attempt += 1
+                self.stats["retries"] += len(pending)
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+        self._record(documents, self.loop.time() - start)
+
+    async def _send(self, ids):
+        datas = [{**self.in_flight[id][0], "_id": id} for id in ids]
+        try:
+            _, errors = await AsyncESFuncs.bulk_es(self.index_name, datas, refresh=self.refresh, raise_on_error=False)
+        except Exception as e:
+            # the request did not reach the cluster, every document is retried
+            return {id: {"status": None, "error": f"{type(e).__name__}: {e}"} for id in ids}
+        return {item['index']['_id']: item['index'] for item in errors}
+
+    def _settle(self, id, error=None):
+        _, done = self.in_flight.pop(id)
+        if error is None:
+            done.set_result(id)
+            return
+        self.stats["failed"] += 1
+        LoggerConfig.logger.error(f"[BulkIndexer] could not index document {id} into {self.index_name}: {error}")
+        done.set_exception(RuntimeError(f"bulk indexing of document {id} failed: {error.get('error')}"))
+        # nobody may be waiting on this document, the error is logged above
+        done.exception()
+
+    def _record(self, documents, seconds):
+        flush_ms = seconds * 1000
+        self.stats["documents"] += documents
+        self.stats["flushes"] += 1
+        self.stats["last_flush_ms"] = flush_ms
+        self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], flush_ms)
+        self.flush_seconds += seconds
+        LoggerConfig.logger.debug(f"[BulkIndexer] {documents} documents flushed to {self.index_name} in {flush_ms:.1f}ms")
+
+    def report(self):
+        flushes = self.stats["flushes"]
+        return {
+            **self.stats,
+            "avg_flush_ms": self.flush_seconds * 1000 / flushes if flushes else 0.0,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "pending_documents": len(self.documents) + len(self.in_flight),
+        }
+
+    async def close(self):
+        # every document submitted so far is flushed before the worker stops
+        if self.worker is None or self.worker.done():
+            return
+        self.closing = True
+        # wakes up the collector so the buffer is flushed without waiting for the interval
+        await self.queue.put((None, 0))
+        while self.documents or self.in_flight:
+            await asyncio.wait([done for _, done in [*self.documents.values(), *self.in_flight.values()]])
+        self.worker.cancel()
@@ -1,9 +1,13 @@
-from elasticsearch.helpers import bulk
+import asyncio
+
+from elasticsearch import NotFoundError
+from elasticsearch.helpers import bulk, async_bulk
 
 from dateutil.parser import parse as date_parse
 
 from configs.db import ElasticsearchConnection, ESIndex
 from configs.logger import LoggerConfig
+from controllers.embedding_cache import SentenceKey
 
 
 class ElasticsearchCRUD(ElasticsearchConnection):
@@ -25,21 +29,32 @@ class ElasticsearchCRUD(ElasticsearchConnection):
                 "_index": index_name,
                 "_op_type": "index",
                 "_id": data.get("_id", None),
-                "_source": data
+                # _id is metadata, elasticsearch rejects it inside the document
+                "_source": {key: value for key, value in data.items() if key != "_id"}
             }
             actions.append(action)
         return actions
 
     @classmethod
-    def bulk_es(cls, index_name, datas):
+    def write_refresh(cls, refresh=None):
+        # 'false' leaves a write to the periodic refresh, 'wait_for' returns once it is visible to searches
+        return cls.settings.es_write_refresh if refresh is None else refresh
+
+    @classmethod
+    def update_settings_es(cls, index_name, settings):
+        updated = cls.es_client.indices.put_settings(index=index_name, body=settings)
+        return updated
+
+    @classmethod
+    def bulk_es(cls, index_name, datas, refresh=None, **kwargs):
         actions = cls.cvt_datas_to_bulk(index_name, datas)
-        success, failed = bulk(cls.es_client, actions)
+        success, failed = bulk(cls.es_client, actions, refresh=cls.write_refresh(refresh), **kwargs)
         LoggerConfig.logger.info({"success": success, "failed":failed})
         return success, failed
     
     @classmethod
-    def insert_es(cls, index_name, body, id=None):
-        inserted = cls.es_client.index(index=index_name, document=body, id=id)
+    def insert_es(cls, index_name, body, id=None, refresh=None):
+        inserted = cls.es_client.index(index=index_name, document=body, id=id, refresh=cls.write_refresh(refresh))
         return inserted
 
     @classmethod
@@ -49,22 +64,37 @@ class ElasticsearchCRUD(ElasticsearchConnection):
     
     @classmethod
     def delete_es(cls, index_name, id):
-        deleted = cls.es_client.delete(index=index_name, id=id)
-        return deleted
+        try:
+            return cls.es_client.delete(index=index_name, id=id)
+        except NotFoundError:
+            return None
     
     @classmethod
     def delete_by_query_es(cls, index_name, body):
         deleted = cls.es_client.delete_by_query(index=index_name, body=body)
         return deleted
 
+    @classmethod
+    def get_es(cls, index_name, id):
+        try:
+            return cls.es_client.get(index=index_name, id=id)
+        except NotFoundError:
+            return None
+
+    @classmethod
+    def mget_es(cls, index_name, ids):
+        return cls.es_client.mget(index=index_name, body={"ids": ids})['docs']
+
     @classmethod
     def search_es(cls, index_name, **kwargs):
-        cls.es_client.indices.refresh(index=index_name)
+        # searches see what the index has refreshed so far, lookups by id go through get_es and mget_es
         search = cls.es_client.search(index=index_name, **kwargs)
         return search
     
 
 class ESFuncs(ElasticsearchCRUD):
+    MGET_CHUNK_SIZE = 10000
+
     @classmethod
     def start_index_es(cls):
         all_index_name, all_index_config = ESIndex.init_index()
@@ -74,19 +104,24 @@ class ESFuncs(ElasticsearchCRUD):
             if created:
                 LoggerConfig.logger.info(f'{all_index_name[index_name]} \033[96mCreated\033[0m :::')
             else:
+                refresh_interval = all_index_config[index_name]['settings']['refresh_interval']
+                cls.update_settings_es(all_index_name[index_name], {"index": {"refresh_interval": refresh_interval}})
                 LoggerConfig.logger.info(f'{all_index_name[index_name]} Already Exists :::')
             LoggerConfig.logger.info(f'[\033[96mEND\033[0m] Create Index {all_index_name[index_name]} :::')
 
-    @classmethod
-    def update_counter(cls, index_name, id):
-        script = {
+    @staticmethod
+    def counter_script(count=1):
+        return {
             "script": {
                 "source": "ctx._source.counter += params.count",
                 "lang": "painless",
-                "params": {"count": 1}
+                "params": {"count": count}
             }
         }
-        updated = cls.update_es(index_name=index_name, id=id, body=script)
+
+    @classmethod
+    def update_counter(cls, index_name, id):
+        updated = cls.update_es(index_name=index_name, id=id, body=cls.counter_script())
         LoggerConfig.logger.info(updated)
         return updated
     
@@ -113,9 +148,9 @@ class ESFuncs(ElasticsearchCRUD):
         return _format, _min, _max
 
     @classmethod
-    def aggregate_sentence_total_by_days(cls, index_name, data):
+    def sentence_total_by_days_query(cls, data):
         _format, _min, _max = cls.extract_calendar_interval(data['calendar_interval'], data['start_date'], data['end_date'])
-        query = {
+        return {
             "size": 0,
             "query": {
                 "bool": {
@@ -150,12 +185,119 @@ class ESFuncs(ElasticsearchCRUD):
                 }
             }
         }
-        result = cls.search_es(index_name=index_name, **query)
+
+    @classmethod
+    def aggregate_sentence_total_by_days(cls, index_name, data):
+        result = cls.search_es(index_name=index_name, **cls.sentence_total_by_days_query(data))
         return {"status": True, "data": result['aggregations']}
     
+    @classmethod
+    def sentence_hash(cls, sentence):
+        # documents are keyed by the normalized sentence and the model that embedded it
+        return SentenceKey.digest(SentenceKey.model_version(cls.settings), sentence).hex()
+
     @classmethod
     def check_sentence_exists(cls, index_name, sentence):
-        query = {"term": {"sentence.keyword": sentence}}
-        result = cls.search_es(index_name=index_name, query=query)['hits']
-        is_exist = result['total']['value'] != 0
-        return is_exist, result['hits'][0]['_source'] if is_exist else None
\ No newline at end of file
+        # a get by id is realtime, the document is found before the index refreshes
+        document = cls.get_es(index_name, cls.sentence_hash(sentence))
+        return (True, document['_source']) if document else (False, None)
+
+    @classmethod
+    def group_by_hash(cls, sentences):
+        sentences_by_hash = {}
+        for sentence in sentences:
+            sentences_by_hash.setdefault(cls.sentence_hash(sentence), []).append(sentence)
+        return sentences_by_hash
+
+    @staticmethod
+    def collect_sources(documents, sentences_by_hash, sources):
+        for document in documents:
+            if document.get('found'):
+                for sentence in sentences_by_hash[document['_id']]:
+                    sources[sentence] = document['_source']
+        return sources
+
+    @classmethod
+    def check_sentences_exist(cls, index_name, sentences):
+        sentences_by_hash = cls.group_by_hash(sentences)
+        ids = list(sentences_by_hash)
+        sources = {}
+        for start in range(0, len(ids), cls.MGET_CHUNK_SIZE):
+            cls.collect_sources(cls.mget_es(index_name, ids[start:start + cls.MGET_CHUNK_SIZE]), sentences_by_hash, sources)
+        return sources
+
+
+class AsyncElasticsearchCRUD(ElasticsearchConnection):
+    @classmethod
+    async def bulk_es(cls, index_name, datas, refresh=None, **kwargs):
+        actions = ElasticsearchCRUD.cvt_datas_to_bulk(index_name, datas)
+        success, failed = await async_bulk(cls.async_es_client, actions, refresh=ElasticsearchCRUD.write_refresh(refresh), **kwargs)
+        LoggerConfig.logger.info({"success": success, "failed":failed})
+        return success, failed
+
+    @classmethod
+    async def insert_es(cls, index_name, body, id=None, refresh=None):
+        inserted = await cls.async_es_client.index(index=index_name, document=body, id=id, refresh=ElasticsearchCRUD.write_refresh(refresh))
+        return inserted
+
+    @classmethod
+    async def update_es(cls, index_name, id, body):
+        updated = await cls.async_es_client.update(index=index_name, id=id, **body)
+        return updated
+
+    @classmethod
+    async def delete_es(cls, index_name, id):
+        try:
+            return await cls.async_es_client.delete(index=index_name, id=id)
+        except NotFoundError:
+            return None
+
+    @classmethod
+    async def delete_by_query_es(cls, index_name, body):
+        deleted = await cls.async_es_client.delete_by_query(index=index_name, body=body)
+        return deleted
+
+    @classmethod
+    async def get_es(cls, index_name, id):
+        try:
+            return await cls.async_es_client.get(index=index_name, id=id)
+        except NotFoundError:
+            return None
+
+    @classmethod
+    async def mget_es(cls, index_name, ids):
+        return (await cls.async_es_client.mget(index=index_name, body={"ids": ids}))['docs']
+
+    @classmethod
+    async def search_es(cls, index_name, **kwargs):
+        search = await cls.async_es_client.search(index=index_name, **kwargs)
+        return search
+
+
+class AsyncESFuncs(AsyncElasticsearchCRUD):
+    # the requests and queries are built by ESFuncs, only the I/O is awaited here
+    @classmethod
+    async def update_counter(cls, index_name, id):
+        updated = await cls.update_es(index_name=index_name, id=id, body=ESFuncs.counter_script())
+        LoggerConfig.logger.info(updated)
+        return updated
+
+    @classmethod
+    async def aggregate_sentence_total_by_days(cls, index_name, data):
+        result = await cls.search_es(index_name=index_name, **ESFuncs.sentence_total_by_days_query(data))
+        return {"status": True, "data": result['aggregations']}
+
+    @classmethod
+    async def check_sentence_exists(cls, index_name, sentence):
+        document = await cls.get_es(index_name, ESFuncs.sentence_hash(sentence))
+        return (True, document['_source']) if document else (False, None)
+
+    @classmethod
+    async def check_sentences_exist(cls, index_name, sentences):
+        sentences_by_hash = ESFuncs.group_by_hash(sentences)
+        ids = list(sentences_by_hash)
+        chunks = [ids[start:start + ESFuncs.MGET_CHUNK_SIZE] for start in range(0, len(ids), ESFuncs.MGET_CHUNK_SIZE)]
+        sources = {}
+        for documents in await asyncio.gather(*(cls.mget_es(index_name, chunk) for chunk in chunks)):
+            ESFuncs.collect_sources(documents, sentences_by_hash, sources)
+        return sources
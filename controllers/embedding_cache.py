@@ -0,0 +1,72 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import unicodedata
+import sys
+
+import numpy as np
+
+
+class SentenceKey:
+    @staticmethod
+    def normalize(sentence):
+        return unicodedata.normalize('NFC', sentence).strip()
+
+    @staticmethod
+    def model_version(settings):
+        return f"{settings.model_name}/{settings.model_file_name}"
+
+    @staticmethod
+    def digest(model_version, sentence):
+        key = f"{model_version}\x00{SentenceKey.normalize(sentence)}"
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, max_bytes, dtype='float32'):
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def entry_size(key, vector):
+        return sys.getsizeof(key) + sys.getsizeof(vector)
+
+    def get(self, key):
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return vector
+
+    def put(self, key, vector):
+        vector = np.array(vector, dtype=self.dtype)
+        size = self.entry_size(key, vector)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entry_size(key, self.entries.pop(key))
+            self.entries[key] = vector
+            self.size += size
+            while self.size > self.max_bytes:
+                old_key, old_vector = self.entries.popitem(last=False)
+                self.size -= self.entry_size(old_key, old_vector)
+                self.stats["evictions"] += 1
+
+    def report(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": self.stats["hits"] / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "dtype": self.dtype.name,
+        }
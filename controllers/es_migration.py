@@ -0,0 +1,75 @@
+from collections import deque
+import argparse
+import json
+
+from elasticsearch.helpers import scan, streaming_bulk, bulk
+
+from configs.logger import LoggerConfig
+from controllers.elasticsearch_controller import ESFuncs
+
+
+class SentenceHashMigration(ESFuncs):
+    # the ids merged into a document are kept on it, so a run that stopped before its deletes can be repeated
+    # without adding the same counter twice
+    MERGE_SCRIPT = (
+        "if (ctx._source.merged_ids == null) { ctx._source.merged_ids = []; }"
+        "if (ctx._source.merged_ids.contains(params.id)) { ctx.op = 'noop'; }"
+        "else { ctx._source.merged_ids.add(params.id); ctx._source.counter += params.counter; }"
+    )
+
+    @classmethod
+    def upserts(cls, index_name, old_ids, stats):
+        for document in scan(cls.es_client, index=index_name, query={"query": {"match_all": {}}}):
+            stats["scanned"] += 1
+            source = document['_source']
+            sentence_hash = cls.sentence_hash(source['sentence'])
+            if document['_id'] == sentence_hash:
+                continue
+            old_ids.append(document['_id'])
+            # documents of the same sentence are merged into one and their counters added up
+            yield {
+                "_op_type": "update",
+                "_index": index_name,
+                "_id": sentence_hash,
+                "script": {
+                    "source": cls.MERGE_SCRIPT,
+                    "lang": "painless",
+                    "params": {"id": document['_id'], "counter": source.get('counter', 1)}
+                },
+                "upsert": {**source, "sentence_hash": sentence_hash, "merged_ids": [document['_id']]},
+            }
+
+    @classmethod
+    def migrate(cls, index_name, chunk_size=500):
+        cls.es_client.indices.put_mapping(index=index_name, body={"properties": {"sentence_hash": {"type": "keyword"}, "merged_ids": {"type": "keyword"}}})
+        stats = {"scanned": 0, "rewritten": 0, "failed": 0}
+        old_ids = deque()
+        migrated_ids = []
+        results = streaming_bulk(cls.es_client, cls.upserts(index_name, old_ids, stats), chunk_size=chunk_size, raise_on_error=False)
+        for ok, item in results:
+            # results arrive in the order of the actions, an old document is only deleted once its copy is written
+            old_id = old_ids.popleft()
+            if ok:
+                migrated_ids.append(old_id)
+            else:
+                stats["failed"] += 1
+                LoggerConfig.logger.error(f"[Migration] could not rewrite document {old_id}: {item}")
+        bulk(cls.es_client, ({"_op_type": "delete", "_index": index_name, "_id": old_id} for old_id in migrated_ids), chunk_size=chunk_size, raise_on_error=False)
+        stats["rewritten"] = len(migrated_ids)
+        cls.es_client.indices.refresh(index=index_name)
+        LoggerConfig.logger.info(f"[Migration] {index_name}: {stats}")
+        return stats
+
+
+if __name__ == '__main__':
+    from configs.config import SettingsManager
+    SettingsManager.initialize()
+    from configs.db import ElasticsearchConnection, ESIndex
+    ElasticsearchConnection.connect_elasticsearch()
+    ESIndex.init_index()
+
+    parser = argparse.ArgumentParser(description="Re-key sentence documents by the hash of the sentence and the model version")
+    parser.add_argument('--index', default=ESIndex.EXTRACTED, help="index to migrate")
+    parser.add_argument('--chunk-size', type=int, default=500)
+    args = parser.parse_args()
+    print(json.dumps(SentenceHashMigration.migrate(args.index, args.chunk_size), indent=2))
@@ -1,19 +1,131 @@
 import os
+import asyncio
 import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 from configs.logger import LoggerConfig
 from configs.config import SettingsManager
+from controllers.embedding_cache import EmbeddingCache, SentenceKey
+from controllers.vector_store import VectorStore
+from controllers.inference_pool import InferencePool
+from model_ai.base_encoder import BaseEncoder
 
 # Disabling parallelism to avoid deadlocks
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+
+class MicroBatcher:
+    def __init__(self, handler, max_size=32, max_wait_ms=5, queue_size=1024, executor=None, concurrency=1):
+        self.handler = handler
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue_size = queue_size
+        self.executor = executor
+        self.concurrency = concurrency
+        self.loop = None
+        self.queue = None
+        self.slots = None
+        self.worker = None
+        self.carry = None
+        self.stats = {"batches": 0, "requests": 0, "sentences": 0, "last_fill_ratio": 0.0}
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop or self.worker.done():
+            self.loop = loop
+            self.queue = asyncio.Queue(maxsize=self.queue_size)
+            self.slots = asyncio.Semaphore(self.concurrency)
+            self.carry = None
+            self.worker = loop.create_task(self._run())
+
+    async def submit(self, sentences):
+        if not sentences:
+            return []
+        self._ensure_worker()
+        future = self.loop.create_future()
+        await self.queue.put((sentences, future))
+        return await future
+
+    async def _run(self):
+        while True:
+            # requests keep queueing while every inference slot is busy, so the next batch fills up
+            await self.slots.acquire()
+            batch, size = await self._collect()
+            self.loop.create_task(self._flush(batch, size))
+
+    async def _collect(self):
+        first = self.carry or await self.queue.get()
+        self.carry = None
+        batch, size = [first], len(first[0])
+        deadline = self.loop.time() + self.max_wait
+        while size < self.max_size:
+            timeout = deadline - self.loop.time()
+            try:
+                if timeout <= 0:
+                    item = self.queue.get_nowait()
+                else:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            if size + len(item[0]) > self.max_size:
+                self.carry = item
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch, size
+
+    async def _flush(self, batch, size):
+        try:
+            await self._dispatch(batch)
+        finally:
+            self.slots.release()
+
+    async def _dispatch(self, batch):
+        batch = [(sentences, future) for sentences, future in batch if not future.done()]
+        if not batch:
+            return
+        sentences = [sentence for item, _ in batch for sentence in item]
+        try:
+            vectors = await self.loop.run_in_executor(self.executor, self.handler, sentences)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        start = 0
+        for item, future in batch:
+            if not future.done():
+                future.set_result(vectors[start:start + len(item)])
+            start += len(item)
+        self._record(len(batch), len(sentences))
+
+    def _record(self, requests, sentences):
+        fill_ratio = sentences / self.max_size
+        self.stats["batches"] += 1
+        self.stats["requests"] += requests
+        self.stats["sentences"] += sentences
+        self.stats["last_fill_ratio"] = fill_ratio
+        LoggerConfig.logger.debug(f"[Batcher] {requests} requests, {sentences} sentences, fill ratio {fill_ratio:.2f}")
+
+    def report(self):
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "avg_fill_ratio": self.stats["sentences"] / (batches * self.max_size) if batches else 0.0,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+        }
+
+
 class SentenceExtractor:
     _instance = None
     _loading = False
 
     def __new__(cls):
         return cls.init_instance()
-    
+
     @classmethod
     def init_instance(cls):
         if cls._instance is None and cls._toggle_loading():
@@ -31,12 +143,105 @@ class SentenceExtractor:
             return cls._loading
         return False
 
+    @classmethod
+    def after_fork(cls):
+        if cls._instance is not None:
+            cls._instance.model.after_fork()
+
+    @classmethod
+    def report(cls):
+        if cls._instance is None:
+            return {}
+        return {
+            "batcher": cls._instance.batcher.report(),
+            "padding": cls._instance.model.padding_report(),
+            "timings": cls._instance.model.timing_report(),
+            "startup": cls._instance.model.startup_report(),
+            "cache": cls._instance.cache.report(),
+            "vector_store": cls._instance.store.report() if cls._instance.store else None,
+            "inference_pool": cls._instance.model.report() if isinstance(cls._instance.model, InferencePool) else None,
+        }
+
     def _initialize(self):
-        EmbeddingModel = importlib.import_module(f"model_ai.{SettingsManager.settings.model_name}").EmbeddingModel
-        self.model = EmbeddingModel()
+        processes = SettingsManager.settings.inference_processes
+        if processes:
+            # the model lives in separate processes, this one only batches requests and serves http
+            self.model = InferencePool(processes, SettingsManager.settings.inference_process_threads)
+        else:
+            EmbeddingModel = importlib.import_module(f"model_ai.{SettingsManager.settings.model_name}").EmbeddingModel
+            self.model = EmbeddingModel()
+        self.model_version = SentenceKey.model_version(SettingsManager.settings)
+        self.cache = EmbeddingCache(SettingsManager.settings.embedding_cache_max_bytes, SettingsManager.settings.embedding_cache_dtype)
+        self.store = None
+        if SettingsManager.settings.vector_store_path:
+            self.store = VectorStore(
+                SettingsManager.settings.vector_store_path,
+                self.model_version,
+                SettingsManager.settings.sentences_vector_size,
+                SettingsManager.settings.vector_store_max_bytes,
+                SettingsManager.settings.vector_store_compact_ratio
+            )
+        workers = processes or SettingsManager.settings.inference_workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        self.batcher = MicroBatcher(
+            self.extract,
+            max_size=SettingsManager.settings.batch_max_size,
+            max_wait_ms=SettingsManager.settings.batch_max_wait_ms,
+            queue_size=SettingsManager.settings.batch_queue_size,
+            executor=self.executor,
+            concurrency=workers,
+        )
 
     def extract(self, list_text):
-        return self.model.encode(list_text)['dense_vecs']
-    
+        return self.model.encode(list_text, return_type='np')['dense_vecs']
+
+    async def extract_async(self, list_text, return_type='ls', dimensions=None, dtype='float32'):
+        if isinstance(list_text, str):
+            return (await self.extract_async([list_text], return_type, dimensions, dtype))[0]
+
+        keys = [SentenceKey.digest(self.model_version, sentence) for sentence in list_text]
+        vectors = [self.cache.get(key) for key in keys]
+        misses = {}
+        for n, (key, vector) in enumerate(zip(keys, vectors)):
+            if vector is None:
+                misses.setdefault(key, []).append(n)
+        if self.store is not None:
+            for key in list(misses):
+                vector = self.store.get(key)
+                if vector is not None:
+                    self.cache.put(key, vector)
+                    for n in misses.pop(key):
+                        vectors[n] = vector
+
+        new_vectors = await self.batcher.submit([list_text[positions[0]] for positions in misses.values()])
+        for (key, positions), vector in zip(misses.items(), new_vectors):
+            self.cache.put(key, vector)
+            for n in positions:
+                vectors[n] = vector
+        if self.store is not None and misses:
+            stored = asyncio.get_running_loop().run_in_executor(None, self.store.put_many, list(misses), new_vectors)
+            stored.add_done_callback(self._log_store_error)
+        if return_type == 'ls' and dimensions is None and dtype == 'float32':
+            return [vector.tolist() if isinstance(vector, np.ndarray) else vector for vector in vectors]
+        return self.reduce(vectors, dimensions, dtype, return_type)
+
+    @staticmethod
+    def reduce(vectors, dimensions=None, dtype='float32', return_type='np'):
+        if len(vectors):
+            vectors = np.stack(vectors).astype(np.float32, copy=False)
+        else:
+            vectors = np.empty((0, SettingsManager.settings.sentences_vector_size), dtype=np.float32)
+        # the cache and the store keep full float32 vectors, truncation and the cast apply to the response only
+        vectors = BaseEncoder.truncate_np(vectors, dimensions).astype(dtype, copy=False)
+        return vectors if return_type == 'np' else vectors.tolist()
+
+    @staticmethod
+    def _log_store_error(future):
+        if not future.cancelled() and future.exception():
+            LoggerConfig.logger.error(f"[VectorStore] failed to persist vectors: {future.exception()}")
+
     def compute_token(self, sentence):
-        return self.model.count_tokenizer(sentence)
\ No newline at end of file
+        return self.model.count_tokenizer(sentence)
+
+    async def compute_token_async(self, sentence):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.compute_token, sentence)
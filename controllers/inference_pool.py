@@ -0,0 +1,264 @@
+from concurrent.futures import Future, TimeoutError
+from multiprocessing.shared_memory import SharedMemory
+import multiprocessing
+import importlib
+import itertools
+import threading
+import weakref
+import sys
+import os
+
+import numpy as np
+
+from configs.config import SettingsManager
+from configs.logger import LoggerConfig
+
+
+class SharedArray:
+    @staticmethod
+    def write(array):
+        array = np.ascontiguousarray(array)
+        if array.nbytes == 0:
+            return None, array.shape, array.dtype.str
+        shm = SharedMemory(create=True, size=array.nbytes)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+        shm.close()
+        return shm.name, array.shape, array.dtype.str
+
+    @staticmethod
+    def read(name, shape, dtype):
+        if name is None:
+            return np.empty(shape, dtype=dtype)
+        shm = SharedMemory(name=name)
+        # the name is removed right away, the pages stay mapped until the last view of the array is released
+        shm.unlink()
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        weakref.finalize(array, shm.close)
+        return array
+
+
+class InferenceProcess:
+    THREAD_VARIABLES = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+    @classmethod
+    def serve(cls, index, settings, threads, requests, responses):
+        SettingsManager.initialize()
+        for key, value in settings.items():
+            setattr(SettingsManager.settings, key, value)
+        SettingsManager.settings.inference_processes = 0
+        # the process is spawned, not forked, so the model sets up its session and precision itself instead of waiting for after_fork
+        SettingsManager.settings.preload_app = False
+        cls.pin_threads(threads)
+        try:
+            EmbeddingModel = importlib.import_module(f"model_ai.{SettingsManager.settings.model_name}").EmbeddingModel
+            model = EmbeddingModel()
+            if 'torch' in sys.modules:
+                sys.modules['torch'].set_num_threads(threads)
+        except Exception as e:
+            responses.put((('ready', index), 'error', f"{type(e).__name__}: {e}"))
+            raise
+        responses.put((('ready', index), 'ok', os.getpid()))
+        cls.loop(model, requests, responses)
+
+    @classmethod
+    def pin_threads(cls, threads):
+        for name in cls.THREAD_VARIABLES:
+            os.environ[name] = str(threads)
+        SettingsManager.settings.ort_intra_op_threads = threads
+
+    @staticmethod
+    def loop(model, requests, responses):
+        while True:
+            message = requests.get()
+            if message is None:
+                return
+            request_id, method, args = message
+            try:
+                if method == 'encode':
+                    result = SharedArray.write(np.asarray(model.encode(*args, return_type='np')['dense_vecs'], dtype=np.float32))
+                else:
+                    result = getattr(model, method)(*args)
+                responses.put((request_id, 'ok', result))
+            except Exception as e:
+                # the message is sent as text, an exception object might not pickle
+                responses.put((request_id, 'error', f"{type(e).__name__}: {e}"))
+
+
+class InferencePool:
+    def __init__(self, processes, threads=1, start_timeout=600):
+        self.size = processes
+        self.threads = threads
+        self.start_timeout = start_timeout
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.pid = None
+        self.processes = []
+        self.ready = set()
+        self.in_flight = [0] * self.size
+        self.stats = {"requests": 0, "sentences": 0, "errors": 0, "restarts": 0}
+        # a preloading master only forks the http workers, every worker starts its own pool in after_fork
+        if not SettingsManager.settings.preload_app:
+            self.start()
+
+    def start(self):
+        self.context = multiprocessing.get_context('spawn')
+        self.settings = SettingsManager.settings.model_dump()
+        self.pid = os.getpid()
+        self.pending = {}
+        self.ready = set()
+        self.in_flight = [0] * self.size
+        self.requests = [None] * self.size
+        self.processes = [None] * self.size
+        self.responses = self.context.Queue()
+        ready = [self._spawn(n) for n in range(self.size)]
+        self.collector = threading.Thread(target=self._collect, name='inference-responses', daemon=True)
+        self.collector.start()
+        for n, future in enumerate(ready):
+            self._wait_ready(n, future)
+
+    def _spawn(self, n):
+        future = self._register(('ready', n))
+        requests = self.context.Queue()
+        # spawn starts every process from a fresh interpreter, so no lock or thread of this process is inherited
+        process = self.context.Process(
+            target=InferenceProcess.serve,
+            args=(n, self.settings, self.threads, requests, self.responses),
+            name=f"inference-{n}",
+            daemon=True
+        )
+        process.start()
+        with self.lock:
+            self.requests[n], self.processes[n] = requests, process
+        return future
+
+    def _wait_ready(self, n, future):
+        pid = self._wait(('ready', n), future, n, self.processes[n], self.start_timeout)
+        with self.lock:
+            self.ready.add(n)
+        LoggerConfig.logger.info(f"[InferencePool] process {n} ready with pid {pid} and {self.threads} threads")
+
+    def _restart(self, n, process):
+        with self.lock:
+            # only the first caller that finds the process dead replaces it
+            if n not in self.ready or self.processes[n] is not process:
+                return
+            self.ready.discard(n)
+            self.stats["restarts"] += 1
+        LoggerConfig.logger.error(f"[InferencePool] process {n} exited with code {process.exitcode}, starting it again")
+        threading.Thread(target=self._replace, args=(n,), name=f"inference-restart-{n}", daemon=True).start()
+
+    def _replace(self, n):
+        try:
+            self._wait_ready(n, self._spawn(n))
+        except Exception as e:
+            LoggerConfig.logger.error(f"[InferencePool] process {n} could not be started again: {e}")
+
+    def _register(self, request_id):
+        future = Future()
+        with self.lock:
+            self.pending[request_id] = future
+        return future
+
+    def _collect(self):
+        while True:
+            message = self.responses.get()
+            if message is None:
+                return
+            request_id, status, payload = message
+            with self.lock:
+                future = self.pending.pop(request_id, None)
+            if future is None:
+                continue
+            if status == 'ok':
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _wait(self, request_id, future, n, process, timeout=None):
+        waited = 0
+        while True:
+            try:
+                return future.result(timeout=1)
+            except TimeoutError:
+                waited += 1
+                if not process.is_alive() or (timeout is not None and waited >= timeout):
+                    with self.lock:
+                        self.pending.pop(request_id, None)
+                    if not process.is_alive():
+                        self._restart(n, process)
+                    raise RuntimeError(f"inference process {n} stopped responding, exit code {process.exitcode}")
+
+    def _route(self, process=None):
+        while True:
+            with self.lock:
+                if not self.ready:
+                    raise RuntimeError("no inference process is running")
+                # the least busy process takes the request, a process being restarted takes none
+                n = min(self.ready, key=self.in_flight.__getitem__) if process is None else process
+                requests, target = self.requests[n], self.processes[n]
+                if process is not None or target.is_alive():
+                    self.in_flight[n] += 1
+                    return n, requests, target
+            # a process that died while idle is replaced before it is handed a request
+            self._restart(n, target)
+
+    def call(self, method, *args, process=None):
+        n, requests, target = self._route(process)
+        request_id = next(self.ids)
+        future = self._register(request_id)
+        try:
+            requests.put((request_id, method, args))
+            return self._wait(request_id, future, n, target)
+        finally:
+            with self.lock:
+                self.in_flight[n] -= 1
+
+    def encode(self, sentences, return_type='np'):
+        try:
+            vectors = SharedArray.read(*self.call('encode', sentences))
+        except Exception:
+            with self.lock:
+                self.stats["errors"] += 1
+            raise
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["sentences"] += len(sentences)
+        return {"dense_vecs": vectors.tolist() if return_type == 'ls' else vectors}
+
+    def count_tokenizer(self, sentence):
+        return self.call('count_tokenizer', sentence)
+
+    def padding_report(self):
+        return [self.call('padding_report', process=n) if n in self.ready else None for n in range(self.size)]
+
+    def timing_report(self):
+        return [self.call('timing_report', process=n) if n in self.ready else None for n in range(self.size)]
+
+    def startup_report(self):
+        return [self.call('startup_report', process=n) if n in self.ready else None for n in range(self.size)]
+
+    def report(self):
+        return {
+            **self.stats,
+            "processes": self.size,
+            "threads_per_process": self.threads,
+            "in_flight": list(self.in_flight),
+            "ready": sorted(self.ready),
+        }
+
+    def after_fork(self):
+        # the processes and the response thread belong to the parent, a forked worker starts its own pool
+        if self.pid != os.getpid():
+            self.start()
+
+    def close(self, timeout=10):
+        if not self.processes:
+            return
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.responses.put(None)
+        self.collector.join(timeout)
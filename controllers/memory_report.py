@@ -0,0 +1,39 @@
+import argparse
+import json
+import os
+
+import psutil
+
+
+class MemoryReport:
+    @staticmethod
+    def process(process=None):
+        process = process or psutil.Process()
+        memory = process.memory_full_info()
+        # uss is the memory only this process holds, pss splits every shared page between the processes mapping it
+        return {
+            "pid": process.pid,
+            "rss_bytes": memory.rss,
+            "uss_bytes": memory.uss,
+            "pss_bytes": getattr(memory, 'pss', memory.uss),
+            "shared_bytes": memory.rss - memory.uss,
+        }
+
+    @classmethod
+    def tree(cls, pid):
+        master = psutil.Process(pid)
+        processes = [cls.process(master)] + [cls.process(child) for child in master.children()]
+        return {
+            "master": processes[0],
+            "workers": processes[1:],
+            "total_rss_bytes": sum(p["rss_bytes"] for p in processes),
+            "total_uss_bytes": sum(p["uss_bytes"] for p in processes),
+            "total_pss_bytes": sum(p["pss_bytes"] for p in processes),
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report unique and proportional memory of the server master and its workers")
+    parser.add_argument('pid', type=int, nargs='?', default=os.getpid(), help="pid of the gunicorn master")
+    args = parser.parse_args()
+    print(json.dumps(MemoryReport.tree(args.pid), indent=2))
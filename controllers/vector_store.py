@@ -0,0 +1,205 @@
+from contextlib import contextmanager
+import argparse
+import threading
+import fcntl
+import os
+
+import numpy as np
+
+from configs.logger import LoggerConfig
+
+
+class VectorStore:
+    INDEX_DTYPE = np.dtype([('key', 'V16'), ('row', '<u8')])
+    COMPACT_CHUNK_ROWS = 65536
+
+    def __init__(self, path, model_version, dim, max_bytes, compact_ratio=0.75):
+        os.makedirs(path, exist_ok=True)
+        prefix = os.path.join(path, model_version.replace('/', '_'))
+        self.vectors_path = f"{prefix}.vectors"
+        self.index_path = f"{prefix}.index"
+        self.lock_path = f"{prefix}.lock"
+        self.dim = dim
+        self.row_bytes = dim * np.dtype(np.float32).itemsize
+        self.max_bytes = max_bytes
+        self.compact_ratio = compact_ratio
+        # the index and the matrix its rows point into are swapped together, a lookup never pairs one with the other's successor
+        self.mapped = ({}, None)
+        self.index_state = None
+        self.thread_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "skipped_writes": 0}
+        self.refresh(blocking=True)
+        LoggerConfig.logger.info(f"[VectorStore] mapped {len(self.mapped[0])} vectors from {self.vectors_path}")
+
+    @contextmanager
+    def file_lock(self, operation):
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _stat_index(self):
+        try:
+            stat = os.stat(self.index_path)
+            return stat.st_ino, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _count_rows(self):
+        try:
+            return os.path.getsize(self.vectors_path) // self.row_bytes
+        except FileNotFoundError:
+            return 0
+
+    def _reload(self):
+        state = self._stat_index()
+        if state == self.index_state:
+            return False
+        # a new inode means the files were rewritten by compaction
+        replaced = self.index_state is None or state is None or state[0] != self.index_state[0]
+        offset = 0 if replaced else self.index_state[1]
+
+        rows = self._count_rows()
+        vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dim)) if rows else None
+
+        # appended rows extend the index in place, a lookup on the previous matrix skips them by their row number
+        index = {} if replaced else self.mapped[0]
+        if state is not None:
+            with open(self.index_path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+            records = np.frombuffer(data[:len(data) - len(data) % self.INDEX_DTYPE.itemsize], dtype=self.INDEX_DTYPE)
+            index.update(zip(map(bytes, records['key']), records['row'].tolist()))
+        self.mapped = (index, vectors)
+        self.index_state = state
+        return True
+
+    def refresh(self, blocking=False):
+        if self._stat_index() == self.index_state:
+            return False
+        # lookups run on the event loop, while a writer holds the store they keep the index they have
+        if not self.thread_lock.acquire(blocking=blocking):
+            return False
+        try:
+            with self.file_lock(fcntl.LOCK_SH if blocking else fcntl.LOCK_SH | fcntl.LOCK_NB):
+                return self._reload()
+        except BlockingIOError:
+            return False
+        finally:
+            self.thread_lock.release()
+
+    def lookup(self, key):
+        index, vectors = self.mapped
+        row = index.get(key)
+        return vectors[row] if row is not None and vectors is not None and row < len(vectors) else None
+
+    def get(self, key):
+        vector = self.lookup(key)
+        if vector is None and self.refresh():
+            vector = self.lookup(key)
+        if vector is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return vector
+
+    def put_many(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self.thread_lock, self.file_lock(fcntl.LOCK_EX):
+            self._reload()
+            new = {}
+            index = self.mapped[0]
+            for key, vector in zip(keys, vectors):
+                if key not in index:
+                    new[key] = vector
+            if not new:
+                return 0
+
+            rows = self._count_rows()
+            if (rows + len(new)) * self.row_bytes > self.max_bytes:
+                self.stats["skipped_writes"] += len(new)
+                LoggerConfig.logger.warning(f"[VectorStore] size cap of {self.max_bytes} bytes reached, run compaction to make room")
+                return 0
+
+            with open(self.vectors_path, 'ab') as f:
+                # drop a partially written row left behind by a crashed writer
+                f.truncate(rows * self.row_bytes)
+                f.write(np.stack(list(new.values())).tobytes())
+            records = np.zeros(len(new), dtype=self.INDEX_DTYPE)
+            records['key'] = list(new.keys())
+            records['row'] = np.arange(rows, rows + len(new))
+            with open(self.index_path, 'ab') as f:
+                f.write(records.tobytes())
+            self._reload()
+            self.stats["writes"] += len(new)
+            return len(new)
+
+    def compact(self, max_bytes=None):
+        # by default the store shrinks below its cap, so appends have room again until the next compaction
+        max_rows = (max_bytes or int(self.max_bytes * self.compact_ratio)) // self.row_bytes
+        with self.thread_lock, self.file_lock(fcntl.LOCK_EX):
+            self.index_state = None
+            self._reload()
+            index, vectors = self.mapped
+            entries_before = len(index)
+            # keep the most recently written rows when the store is over its size
+            items = sorted(index.items(), key=lambda item: item[1])
+            items = items[len(items) - max_rows:] if len(items) > max_rows else items
+
+            vectors_tmp, index_tmp = f"{self.vectors_path}.tmp", f"{self.index_path}.tmp"
+            with open(vectors_tmp, 'wb') as f:
+                for start in range(0, len(items), self.COMPACT_CHUNK_ROWS):
+                    rows = [row for _, row in items[start:start + self.COMPACT_CHUNK_ROWS]]
+                    f.write(np.ascontiguousarray(vectors[rows]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            records = np.zeros(len(items), dtype=self.INDEX_DTYPE)
+            records['key'] = [key for key, _ in items]
+            records['row'] = np.arange(len(items))
+            with open(index_tmp, 'wb') as f:
+                f.write(records.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(vectors_tmp, self.vectors_path)
+            os.replace(index_tmp, self.index_path)
+
+            self.index_state = None
+            self._reload()
+        LoggerConfig.logger.info(f"[VectorStore] compacted {entries_before} entries into {len(items)}")
+        return {"entries_before": entries_before, "entries": len(items), "bytes": len(items) * self.row_bytes}
+
+    def report(self):
+        self.refresh()
+        index, vectors = self.mapped
+        rows = len(vectors) if vectors is not None else 0
+        return {
+            **self.stats,
+            "entries": len(index),
+            "rows": rows,
+            "bytes": rows * self.row_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+if __name__ == '__main__':
+    from configs.config import SettingsManager
+    SettingsManager.initialize()
+    settings = SettingsManager.settings
+
+    parser = argparse.ArgumentParser(description="Maintain the persistent sentence vector store")
+    parser.add_argument('command', choices=['compact', 'report'])
+    parser.add_argument('--max-bytes', type=int, default=None, help="size kept by compaction (default: VECTOR_STORE_MAX_BYTES x VECTOR_STORE_COMPACT_RATIO)")
+    args = parser.parse_args()
+
+    if not settings.vector_store_path:
+        raise SystemExit("VECTOR_STORE_PATH is not configured")
+    store = VectorStore(
+        settings.vector_store_path,
+        f"{settings.model_name}/{settings.model_file_name}",
+        settings.sentences_vector_size,
+        settings.vector_store_max_bytes,
+        settings.vector_store_compact_ratio
+    )
+    print(store.compact(args.max_bytes) if args.command == 'compact' else store.report())
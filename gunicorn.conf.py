@@ -0,0 +1,21 @@
+# ENVIRONMENT=prod gunicorn app:app -c gunicorn.conf.py --workers 4
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:8087')
+worker_class = 'uvicorn.workers.UvicornWorker'
+# app.py, and with it the model, is loaded once in the master, workers are forked from it
+# and share the weight pages copy-on-write instead of loading a copy each
+preload_app = True
+# read by the app as it loads in the master, thread pools that do not survive fork are then only started in the workers
+os.environ['PRELOAD_APP'] = 'true'
+timeout = 600
+
+
+def post_fork(server, worker):
+    from configs.db import MongoDBConnection, MGCollection, ElasticsearchConnection
+    from controllers.extractor import SentenceExtractor
+
+    MongoDBConnection.reconnect()
+    MGCollection.reconnect()
+    ElasticsearchConnection.reconnect()
+    SentenceExtractor.after_fork()
@@ -1,23 +1,294 @@
-import torch
+from huggingface_hub import snapshot_download
+from huggingface_hub.utils import LocalEntryNotFoundError
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Union
+import sys
+import os
+import threading
+import time
 from configs.config import SettingsManager
+from configs.logger import LoggerConfig
 
 class BaseEncoder:
+    SNAPSHOT_IGNORE_PATTERNS = ['flax_model.msgpack', 'rust_model.ot', 'tf_model.h5']
+
     def __init__(self):
-        self.device = SettingsManager.settings.device if torch.cuda.is_available() else 'cpu'
+        self.device = self.resolve_device()
         self.model_name = None
         self.model = None
         self.tokenizer = None
+        self.max_length = None
+        self.max_batch_size = SettingsManager.settings.max_sentences_per_batch
+        self.max_tokens_per_batch = SettingsManager.settings.max_tokens_per_batch
+        self.padding_stats = {"real_tokens": 0, "padded_tokens": 0, "unsorted_padded_tokens": 0}
+        self.timings = {"tokenize": 0.0, "forward": 0.0, "postprocess": 0.0}
+        self.stats_lock = threading.Lock()
+        self.pooler_lock = threading.Lock()
+        self.pooler_loaded = False
+        self.startup_timings = {}
+
+    def resolve_device(self):
+        # torch is imported here rather than at module level, so backends without torch never load it
+        import torch
+        return SettingsManager.settings.device if torch.cuda.is_available() else 'cpu'
 
     def encode(self, text:Union[List[str], str], return_type='ls'):
         raise NotImplementedError
 
+    def load_pooler(self):
+        raise NotImplementedError
+
+    def after_fork(self):
+        pass
+
+    @classmethod
+    def resolve_snapshot(cls, model_name):
+        if os.path.exists(model_name):
+            return model_name
+        cache_folder = os.getenv('HF_HUB_CACHE')
+        revision = SettingsManager.settings.model_revision or None
+        try:
+            # a snapshot that is already cached is used without any request to the hub
+            return snapshot_download(repo_id=model_name, revision=revision, cache_dir=cache_folder, local_files_only=True)
+        except LocalEntryNotFoundError:
+            LoggerConfig.logger.warning(f"{model_name} is not in the local cache, downloading it from the hub")
+            return snapshot_download(repo_id=model_name, revision=revision, cache_dir=cache_folder, ignore_patterns=cls.SNAPSHOT_IGNORE_PATTERNS)
+
+    def timed_load(self, phase, load):
+        start = time.perf_counter()
+        result = load()
+        self.startup_timings[phase] = time.perf_counter() - start
+        return result
+
+    def load_concurrently(self, load_weights, load_tokenizer):
+        # the tokenizer is read on a second thread while the weights load
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='load-tokenizer') as executor:
+            tokenizer = executor.submit(self.timed_load, 'tokenizer', load_tokenizer)
+            model = self.timed_load('weights', load_weights)
+            return model, tokenizer.result()
+
+    def startup_report(self):
+        return {f"{phase}_seconds": seconds for phase, seconds in self.startup_timings.items()}
+
+    def log_startup(self, start):
+        self.startup_timings['total'] = time.perf_counter() - start
+        LoggerConfig.logger.info('[Startup] ' + ' '.join(f"{phase}={seconds:.2f}s" for phase, seconds in self.startup_timings.items()))
+
+    def ensure_pooler(self):
+        if not SettingsManager.settings.pooler_heads_enabled:
+            raise ValueError('return_sparse and return_colbert are disabled, set POOLER_HEADS_ENABLED to use them')
+        # the sparse and colbert heads are only loaded by the first batch that asks for them
+        if self.pooler_loaded:
+            return
+        with self.pooler_lock:
+            if not self.pooler_loaded:
+                self.load_pooler()
+                self.pooler_loaded = True
+
     def count_tokenizer(self, sentence):
         raise NotImplementedError
-    
-    def convert_pt_type(self, result, return_type):
-        if not isinstance(result, torch.Tensor):
+
+    def tokenize_batches(self, sentences, batch_size=None, max_tokens_per_batch=None, return_tensors='pt'):
+        if not sentences:
+            return
+        batch_size = batch_size or self.max_batch_size
+        max_tokens_per_batch = max_tokens_per_batch or self.max_tokens_per_batch
+        start = time.perf_counter()
+        tokens = self.tokenizer(
+            sentences,
+            max_length=self.max_length,
+            padding=False,
+            return_token_type_ids=False,
+            truncation=True
+        )
+        lengths = list(map(len, tokens['input_ids']))
+        batches = self.plan_batches(lengths, batch_size, max_tokens_per_batch)
+        self.record_padding(lengths, batches, batch_size)
+        self.record_timing('tokenize', start)
+
+        for indices in batches:
+            start = time.perf_counter()
+            batch_token = self.tokenizer.pad(
+                {
+                    'input_ids': [tokens['input_ids'][i] for i in indices],
+                    'attention_mask': [tokens['attention_mask'][i] for i in indices]
+                },
+                padding=True,
+                return_tensors=return_tensors
+            )
+            self.record_timing('tokenize', start)
+            yield indices, batch_token
+
+    @staticmethod
+    def plan_batches(lengths, batch_size, max_tokens_per_batch):
+        order = sorted(range(len(lengths)), key=lengths.__getitem__, reverse=True)
+        batches = []
+        for i in order:
+            batch = batches[-1] if batches else None
+            # the first sentence of a batch is the longest one, so it sets the padded length
+            batch_full = batch is None or len(batch) >= batch_size or (len(batch) + 1) * lengths[batch[0]] > max_tokens_per_batch
+            if batch_full:
+                batches.append([i])
+            else:
+                batch.append(i)
+        return batches
+
+    def record_padding(self, lengths, batches, batch_size):
+        padded_size = lambda batch: len(batch) * max(batch)
+        padded_tokens = sum(padded_size([lengths[i] for i in batch]) for batch in batches)
+        unsorted_padded_tokens = sum(padded_size(lengths[n:n + batch_size]) for n in range(0, len(lengths), batch_size))
+        with self.stats_lock:
+            self.padding_stats["real_tokens"] += sum(lengths)
+            self.padding_stats["padded_tokens"] += padded_tokens
+            self.padding_stats["unsorted_padded_tokens"] += unsorted_padded_tokens
+
+    def padding_report(self):
+        real, padded, unsorted_padded = self.padding_stats["real_tokens"], self.padding_stats["padded_tokens"], self.padding_stats["unsorted_padded_tokens"]
+        return {
+            **self.padding_stats,
+            "padding_ratio": 1 - real / padded if padded else 0.0,
+            "unsorted_padding_ratio": 1 - real / unsorted_padded if unsorted_padded else 0.0,
+        }
+
+    def record_timing(self, phase, start):
+        with self.stats_lock:
+            self.timings[phase] += time.perf_counter() - start
+
+    def timing_report(self):
+        total = sum(self.timings.values())
+        return {
+            **{f"{phase}_seconds": seconds for phase, seconds in self.timings.items()},
+            **{f"{phase}_share": seconds / total if total else 0.0 for phase, seconds in self.timings.items()},
+        }
+
+    def compute_lexical_weights(self, token_weights, input_ids, unused_tokens):
+        import torch
+        batch_size = input_ids.size(0)
+        rows = torch.arange(batch_size, device=input_ids.device).unsqueeze(-1).expand_as(input_ids)
+        unused_tokens = torch.tensor(unused_tokens, device=input_ids.device)
+        keep = (token_weights > 0) & ~torch.isin(input_ids, unused_tokens)
+
+        # one key per (row, token id) pair, so a single segment max covers the whole batch
+        keys = rows[keep] * self.vocab_size + input_ids[keep]
+        unique_keys, inverse = torch.unique(keys, sorted=True, return_inverse=True)
+        weights = torch.zeros(unique_keys.size(0), dtype=token_weights.dtype, device=token_weights.device)
+        weights = weights.scatter_reduce(0, inverse, token_weights[keep], reduce='amax', include_self=False)
+        return unique_keys // self.vocab_size, unique_keys % self.vocab_size, weights
+
+    def compute_lexical_weights_np(self, token_weights, input_ids, unused_tokens):
+        rows = np.broadcast_to(np.arange(input_ids.shape[0])[:, None], input_ids.shape)
+        keep = (token_weights > 0) & ~np.isin(input_ids, unused_tokens)
+
+        keys = rows[keep].astype(np.int64) * self.vocab_size + input_ids[keep]
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        weights = np.zeros(unique_keys.shape[0], dtype=token_weights.dtype)
+        np.maximum.at(weights, inverse, token_weights[keep])
+        return unique_keys // self.vocab_size, unique_keys % self.vocab_size, weights
+
+    def lexical_weights_to_dict(self, row_ids, token_ids, weights, batch_size):
+        counts = np.bincount(np.asarray(row_ids.tolist(), dtype=np.int64), minlength=batch_size).tolist()
+        token_ids, weights = list(map(str, token_ids.tolist())), weights.tolist()
+        results, start = [], 0
+        for count in counts:
+            results.append(dict(zip(token_ids[start:start + count], weights[start:start + count])))
+            start += count
+        return results
+
+    def lexical_weights_to_sparse(self, row_ids, token_ids, weights, batch_size):
+        import torch
+        counts = torch.bincount(row_ids, minlength=batch_size).tolist()
+        return [
+            # the ids are already sorted and unique, coalesce only marks them so (is_coalesced needs torch 2.1)
+            torch.sparse_coo_tensor(ids.unsqueeze(0), row_weights, (self.vocab_size,)).coalesce()
+            for ids, row_weights in zip(torch.split(token_ids, counts), torch.split(weights, counts))
+        ]
+
+    def lexical_weights_to_coo(self, row_ids, token_ids, weights, batch_size, return_type):
+        if return_type == 'pt':
+            import torch
+            return self.lexical_weights_to_sparse(torch.from_numpy(row_ids), torch.from_numpy(token_ids), torch.from_numpy(weights), batch_size)
+        splits = np.cumsum(np.bincount(row_ids, minlength=batch_size))[:-1]
+        rows = zip(np.split(token_ids, splits), np.split(weights, splits))
+        if return_type == 'np':
+            return [{"indices": ids, "values": row_weights, "shape": (self.vocab_size,)} for ids, row_weights in rows]
+        return [{"indices": ids.tolist(), "values": row_weights.tolist(), "shape": [self.vocab_size]} for ids, row_weights in rows]
+
+    @staticmethod
+    def pack_token_vectors(token_vectors, mask, normalize=True):
+        import torch
+        # a single masked select keeps the real tokens of every row in one (tokens, hidden) tensor
+        mask = mask.bool()
+        vectors = token_vectors[mask]
+        if normalize:
+            vectors = torch.nn.functional.normalize(vectors, dim=-1)
+        counts = mask.sum(-1)
+        offsets = torch.cat([counts.new_zeros(1), counts.cumsum(0)])
+        return vectors, offsets
+
+    @staticmethod
+    def pack_token_vectors_np(token_vectors, mask, normalize=True):
+        mask = mask.astype(bool)
+        vectors = token_vectors[mask]
+        if normalize:
+            vectors = BaseEncoder.normalize_np(vectors)
+        return vectors, BaseEncoder.token_offsets(mask)
+
+    @staticmethod
+    def token_offsets(mask):
+        return np.concatenate([[0], np.cumsum(mask.sum(-1))]).astype(np.int64)
+
+    @staticmethod
+    def normalize_np(vectors, eps=1e-12):
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), eps)
+
+    @staticmethod
+    def check_dimensions(dimensions, size):
+        if not 0 < dimensions <= size:
+            raise ValueError(f"dimensions should be between 1 and {size}, but got {dimensions}")
+
+    @staticmethod
+    def truncate_np(vectors, dimensions=None, normalize=True):
+        if dimensions is None:
+            return vectors
+        BaseEncoder.check_dimensions(dimensions, vectors.shape[-1])
+        # the leading dimensions are kept and rescaled to unit length
+        vectors = vectors[..., :dimensions]
+        return BaseEncoder.normalize_np(vectors) if normalize else np.ascontiguousarray(vectors)
+
+    def split_packed(self, vectors, offsets, return_type):
+        if isinstance(vectors, np.ndarray):
+            vectors = self.convert_np_type(vectors, 'np' if return_type == 'ls' else return_type)
+        else:
+            vectors = self.convert_pt_type(vectors.cpu(), 'np' if return_type == 'ls' else return_type)
+        offsets = offsets.tolist()
+        rows = [vectors[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        return [row.tolist() for row in rows] if return_type == 'ls' else rows
+
+    @staticmethod
+    def pack_rows(rows, return_type):
+        counts = [len(row) for row in rows]
+        offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64)
+        if return_type == 'pt':
+            import torch
+            return {"vectors": torch.cat(rows) if rows else torch.zeros(0, 0), "offsets": torch.from_numpy(offsets)}
+        if return_type == 'np':
+            return {"vectors": np.concatenate(rows) if rows else np.zeros((0, 0), dtype=np.float32), "offsets": offsets}
+        return {"vectors": [vector for row in rows for vector in row], "offsets": offsets.tolist()}
+
+    @staticmethod
+    def scatter_results(results, indices, values):
+        for i, value in zip(indices, values):
+            results[i] = value
+
+    def convert_pt_type(self, result, return_type, dtype=None):
+        torch = sys.modules.get('torch')
+        if torch is None or not isinstance(result, torch.Tensor):
             raise TypeError(f"result should be a torch.Tensor, but got {type(result)}")
+        if dtype is not None:
+            result = result.to(getattr(torch, dtype))
+        if result.is_sparse and return_type in ('np', 'ls'):
+            return self.convert_sparse_type(result, return_type)
         if return_type == 'pt':
             return result
         elif return_type == 'np':
@@ -25,4 +296,28 @@ class BaseEncoder:
         elif return_type == 'ls':
             return result.cpu().detach().numpy().tolist()
         else:
-            raise ValueError(f"return_type should be 'pt', 'np' or 'ls', but got {return_type}")
\ No newline at end of file
+            raise ValueError(f"return_type should be 'pt', 'np' or 'ls', but got {return_type}")
+
+    def convert_sparse_type(self, result, return_type):
+        result = result.coalesce().cpu()
+        indices = result.indices().numpy()
+        indices = indices[0] if result.dim() == 1 else indices
+        values = result.values().detach().numpy()
+        if return_type == 'np':
+            return {"indices": indices, "values": values, "shape": tuple(result.shape)}
+        return {"indices": indices.tolist(), "values": values.tolist(), "shape": list(result.shape)}
+
+    def convert_np_type(self, result, return_type, dtype=None):
+        if not isinstance(result, np.ndarray):
+            raise TypeError(f"result should be a numpy.ndarray, but got {type(result)}")
+        if dtype is not None:
+            result = result.astype(dtype, copy=False)
+        if return_type == 'np':
+            return result
+        elif return_type == 'ls':
+            return result.tolist()
+        elif return_type == 'pt':
+            import torch
+            return torch.from_numpy(result)
+        else:
+            raise ValueError(f"return_type should be 'pt', 'np' or 'ls', but got {return_type}")
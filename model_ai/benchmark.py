@@ -0,0 +1,139 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import importlib
+import argparse
+import json
+import time
+
+import numpy as np
+import psutil
+from pydantic import TypeAdapter
+
+
+class ModelBenchmark:
+    SENTENCES = [
+        "สวัสดีครับ",
+        "วันนี้อากาศดีมาก เหมาะกับการออกไปเดินเล่นที่สวนสาธารณะ",
+        "ร้านอาหารนี้เปิดตั้งแต่เจ็ดโมงเช้าถึงสี่ทุ่ม",
+        "กรุณาตรวจสอบยอดเงินในบัญชีก่อนทำรายการโอน",
+        "ระบบจะส่งรหัสยืนยันไปยังหมายเลขโทรศัพท์ที่ลงทะเบียนไว้",
+        "ประเทศไทยมีจังหวัดทั้งหมดเจ็ดสิบเจ็ดจังหวัด",
+        "การประชุมถูกเลื่อนออกไปเป็นวันพฤหัสบดีหน้า เนื่องจากผู้บริหารติดภารกิจต่างประเทศ",
+        "สินค้าที่สั่งซื้อจะจัดส่งภายในสามถึงห้าวันทำการ",
+        "Hello, how are you?",
+        "The quick brown fox jumps over the lazy dog.",
+        "Dense retrieval maps queries and documents into the same vector space.",
+        "Please reset my password because I can no longer access my account.",
+        "Quarterly revenue grew by twelve percent compared with the same period last year.",
+        "BGE-M3 supports dense, sparse and multi-vector retrieval in more than one hundred languages.",
+        "ขอบคุณ thank you very much",
+        "โปรโมชั่นนี้ใช้ได้ถึงวันที่ 31 ธันวาคม 2024 only for online orders",
+    ]
+
+    @staticmethod
+    def apply_overrides(settings, overrides):
+        for key, value in overrides.items():
+            annotation = type(settings).model_fields[key].annotation
+            setattr(settings, key, TypeAdapter(annotation).validate_python(value))
+
+    @staticmethod
+    def summarize_latency(latencies):
+        latencies = np.asarray(latencies)
+        return {
+            "mean_seconds": float(latencies.mean()),
+            "p50_seconds": float(np.percentile(latencies, 50)),
+            "p95_seconds": float(np.percentile(latencies, 95)),
+        }
+
+    @staticmethod
+    def cosine_agreement(baseline, candidate):
+        baseline, candidate = np.asarray(baseline, dtype=np.float64), np.asarray(candidate, dtype=np.float64)
+        cosine = (baseline * candidate).sum(-1) / (np.linalg.norm(baseline, axis=-1) * np.linalg.norm(candidate, axis=-1))
+        return {
+            "mean": float(cosine.mean()),
+            "min": float(cosine.min()),
+            "p05": float(np.percentile(cosine, 5)),
+        }
+
+    @classmethod
+    def run_variant(cls, overrides, sentences, repeats, batch_size=None):
+        from configs.config import SettingsManager
+        SettingsManager.initialize()
+        cls.apply_overrides(SettingsManager.settings, overrides)
+        process = psutil.Process()
+        rss_start = process.memory_info().rss
+
+        start = time.perf_counter()
+        EmbeddingModel = importlib.import_module(f"model_ai.{SettingsManager.settings.model_name}").EmbeddingModel
+        model = EmbeddingModel()
+        load_seconds = time.perf_counter() - start
+        rss_loaded = process.memory_info().rss
+
+        vectors = np.asarray(model.encode(sentences, batch_size=batch_size, return_type='np')['dense_vecs'], dtype=np.float32)
+        latencies = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model.encode(sentences, batch_size=batch_size, return_type='np')
+            latencies.append(time.perf_counter() - start)
+        return {
+            "overrides": overrides,
+            "vectors": vectors,
+            "load_seconds": load_seconds,
+            "latency": cls.summarize_latency(latencies),
+            "sentences_per_second": len(sentences) / float(np.percentile(latencies, 50)),
+            "model_rss_bytes": rss_loaded - rss_start,
+            "rss_bytes": process.memory_info().rss,
+        }
+
+    @classmethod
+    def compare(cls, baseline, candidate, sentences=None, repeats=5, batch_size=None):
+        sentences = sentences or cls.SENTENCES
+        results = []
+        for overrides in (baseline, candidate):
+            # a saved optimized graph belongs to one model, every variant builds its own from the model it compares
+            overrides = {**overrides, "ort_optimized_model_path": ""}
+            # every variant runs in a fresh process, so its imports and allocations do not leak into the other one
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                results.append(executor.submit(cls.run_variant, overrides, sentences, repeats, batch_size).result())
+        baseline_result, candidate_result = results
+        return {
+            "sentences": len(sentences),
+            "cosine": cls.cosine_agreement(baseline_result.pop("vectors"), candidate_result.pop("vectors")),
+            "baseline": baseline_result,
+            "candidate": candidate_result,
+            "delta": {
+                "latency_p50_seconds": candidate_result["latency"]["p50_seconds"] - baseline_result["latency"]["p50_seconds"],
+                "latency_ratio": candidate_result["latency"]["p50_seconds"] / baseline_result["latency"]["p50_seconds"],
+                "throughput_ratio": baseline_result["latency"]["p50_seconds"] / candidate_result["latency"]["p50_seconds"],
+                "rss_bytes": candidate_result["rss_bytes"] - baseline_result["rss_bytes"],
+                "model_rss_bytes": candidate_result["model_rss_bytes"] - baseline_result["model_rss_bytes"],
+            },
+        }
+
+    @staticmethod
+    def format_report(report):
+        return json.dumps(report, indent=2, ensure_ascii=False)
+
+    @staticmethod
+    def parse_overrides(items):
+        return dict(item.split('=', 1) for item in items or [])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare dense vectors, latency and memory of two model configurations")
+    parser.add_argument('--baseline', action='append', metavar='SETTING=VALUE', help="setting override of the reference model, can be repeated")
+    parser.add_argument('--candidate', action='append', metavar='SETTING=VALUE', help="setting override of the compared model, can be repeated")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=None)
+    parser.add_argument('--min-cosine', type=float, default=None, help="fail when the mean dense cosine agreement is below this value")
+    args = parser.parse_args()
+
+    report = ModelBenchmark.compare(
+        ModelBenchmark.parse_overrides(args.baseline),
+        ModelBenchmark.parse_overrides(args.candidate),
+        repeats=args.repeats,
+        batch_size=args.batch_size
+    )
+    print(ModelBenchmark.format_report(report))
+    if args.min_cosine is not None and report["cosine"]["mean"] < args.min_cosine:
+        raise SystemExit(f"mean cosine agreement {report['cosine']['mean']:.4f} is below {args.min_cosine}")
@@ -1,37 +1,42 @@
-from huggingface_hub import snapshot_download
 from transformers import AutoTokenizer, AutoModel
 import torch
 
-from collections import defaultdict
 from typing import List, Union
-import numpy as np
+import time
 import os
 
+from configs.config import SettingsManager
 from configs.logger import LoggerConfig
 from model_ai.base_encoder import BaseEncoder
 
 
 class EmbeddingModel(BaseEncoder):
+    PRECISIONS = ('fp32', 'int8', 'bf16')
+
     def __init__(self, model_name='BAAI/bge-m3', sentence_pooling_method='cls', normlized=True, use_fp16=False, max_length=8192):
         super().__init__()
+        start = time.perf_counter()
         self.model_name = model_name
         self.load_model()
-        self.load_pooler()
         if use_fp16: self.model.half()
         self.model.eval()
+        self.precision = None
+        if not SettingsManager.settings.preload_app:
+            self.precision = self.timed_load('precision', lambda: self.apply_precision(SettingsManager.settings.torch_cpu_precision))
         self.sentence_pooling_method = sentence_pooling_method
         self.vocab_size = self.model.config.vocab_size
         self.normlized = normlized
         self.max_length = max_length
+        self.log_startup(start)
 
     def load_model(self):
-        model_path_not_exist = not os.path.exists(self.model_name)
-        if model_path_not_exist:
-            cache_folder = os.getenv('HF_HUB_CACHE')
-            self.model_name = snapshot_download(repo_id=self.model_name, cache_dir=cache_folder, ignore_patterns=['flax_model.msgpack', 'rust_model.ot', 'tf_model.h5'])
-            
-        self.model = AutoModel.from_pretrained(self.model_name).to(self.device)
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.model_name = self.timed_load('resolve', lambda: self.resolve_snapshot(self.model_name))
+        # low_cpu_mem_usage builds the model without random init and reads safetensors weights through mmap,
+        # the pooling layer is left out because only last_hidden_state is used
+        self.model, self.tokenizer = self.load_concurrently(
+            lambda: AutoModel.from_pretrained(self.model_name, low_cpu_mem_usage=True, add_pooling_layer=False).to(self.device),
+            lambda: AutoTokenizer.from_pretrained(self.model_name)
+        )
 
     def load_pooler(self):
         pooler_colbert_path_exist = os.path.exists(os.path.join(self.model_name, 'colbert_linear.pt'))
@@ -49,51 +54,70 @@ class EmbeddingModel(BaseEncoder):
         else:
             LoggerConfig.logger.error('The parameters of colbert_linear and sparse linear is new initialize. Make sure the model is loaded for training, not inferencing')
 
-    def dense_embedding(self, hidden_state, mask, return_type='ls'):
+    def after_fork(self):
+        if self.precision is None:
+            # quantize_dynamic starts the OpenMP pool, which hangs in a worker forked after it, so the master leaves it to the workers
+            self.precision = self.timed_load('precision', lambda: self.apply_precision(SettingsManager.settings.torch_cpu_precision))
+
+    @staticmethod
+    def cpu_capability():
+        # torch.backends.cpu.get_cpu_capability only exists from torch 2.1
+        backend = getattr(torch.backends, 'cpu', None)
+        return backend.get_cpu_capability() if hasattr(backend, 'get_cpu_capability') else None
+
+    def apply_precision(self, precision):
+        if precision not in self.PRECISIONS:
+            raise ValueError(f"torch_cpu_precision should be one of {list(self.PRECISIONS)}, but got {precision}")
+        if precision == 'fp32':
+            return precision
+        if self.device != 'cpu':
+            LoggerConfig.logger.warning(f"torch_cpu_precision={precision} only applies on cpu, running on {self.device} without it")
+            return 'fp32'
+        if precision == 'int8':
+            # Linear weights are stored as int8 and activations are quantized per batch, the heads stay in fp32
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif self.cpu_capability() is None:
+            LoggerConfig.logger.warning(f"torch_cpu_precision=bf16 needs AVX-512, torch {torch.__version__} cannot report the cpu capability, running in fp32")
+            return 'fp32'
+        elif not self.cpu_capability().startswith('AVX512'):
+            LoggerConfig.logger.warning(f"torch_cpu_precision=bf16 needs AVX-512, this cpu supports {self.cpu_capability()}, running in fp32")
+            return 'fp32'
+        LoggerConfig.logger.info(f"torch cpu precision {precision}")
+        return precision
+
+    def dense_embedding(self, hidden_state, mask, return_type='ls', dimensions=None, dtype=None):
         if self.sentence_pooling_method == 'cls':
             dense_vecs = hidden_state[:, 0]
         elif self.sentence_pooling_method == 'mean':
             s = torch.sum(hidden_state * mask.unsqueeze(-1).float(), dim=1)
             d = mask.sum(axis=1, keepdim=True).float()
             dense_vecs = s / d
-        
+
+        if dimensions is not None:
+            # truncated before normalizing, so the kept dimensions are renormalized to unit length
+            self.check_dimensions(dimensions, dense_vecs.size(-1))
+            dense_vecs = dense_vecs[:, :dimensions]
         dense_vecs = torch.nn.functional.normalize(dense_vecs, dim=-1) if self.normlized else dense_vecs
-        return self.convert_pt_type(dense_vecs.contiguous(), return_type)
+        return self.convert_pt_type(dense_vecs.contiguous(), return_type, dtype)
 
-    def sparse_embedding(self, hidden_state, input_ids, return_embedding: bool = True, return_type='ls'):
+    def sparse_embedding(self, hidden_state, input_ids, return_embedding: bool = True, return_type='ls', sparse_format='dense'):
         token_weights = torch.relu(self.sparse_linear(hidden_state)).to(self.device)
         unused_tokens = [self.tokenizer.cls_token_id, self.tokenizer.eos_token_id, self.tokenizer.pad_token_id, self.tokenizer.unk_token_id]
         
-        def _process_token_weights(token_weights: np.ndarray, input_ids: list):
-            result = defaultdict(int)
-            set_unused_tokens = set(unused_tokens)
-            for w, idx in zip(token_weights, input_ids):
-                idx = idx.item()
-                if idx not in set_unused_tokens and w > 0:
-                    idx = str(idx)
-                    if w > result[idx]:
-                        result[idx] = w.item()
-            return result
-        
+        row_ids, token_ids, weights = self.compute_lexical_weights(token_weights.squeeze(-1), input_ids, unused_tokens)
         if not return_embedding:
-            token_weights = list(map(_process_token_weights, token_weights, input_ids)) 
-            return token_weights
-
-        sparse_embedding = torch.zeros(input_ids.size(0), input_ids.size(1), self.vocab_size, dtype=token_weights.dtype, device=self.device)
-        sparse_embedding = torch.scatter(sparse_embedding, dim=-1, index=input_ids.unsqueeze(-1), src=token_weights)
-        sparse_embedding = torch.max(sparse_embedding, dim=1).values
-        sparse_embedding[:, unused_tokens] *= 0.
-        return self.convert_pt_type(sparse_embedding.contiguous(), return_type)
+            return self.lexical_weights_to_dict(row_ids, token_ids, weights, input_ids.size(0))
+        if sparse_format == 'coo':
+            return [self.convert_pt_type(row, return_type) for row in self.lexical_weights_to_sparse(row_ids, token_ids, weights, input_ids.size(0))]
+
+        sparse_embedding = torch.zeros(input_ids.size(0), self.vocab_size, dtype=weights.dtype, device=self.device)
+        sparse_embedding[row_ids, token_ids] = weights
+        return self.convert_pt_type(sparse_embedding, return_type)
     
     def colbert_embedding(self, last_hidden_state, mask, return_type='ls'):
         colbert_vecs = self.colbert_linear(last_hidden_state[:, 1:])
-        colbert_vecs = colbert_vecs * mask[:, 1:][:, :, None].float().contiguous()
-        def _process_colbert_vecs(colbert_vecs, mask):
-            use_token_layer = mask.sum(-1)
-            embedded_without_cls_layer = colbert_vecs[:use_token_layer - 1]
-            embedded_without_cls_layer = torch.nn.functional.normalize(embedded_without_cls_layer, dim=-1).cpu() if self.normlized else embedded_without_cls_layer.cpu()
-            return self.convert_pt_type(embedded_without_cls_layer, return_type)
-        return list(map(_process_colbert_vecs, colbert_vecs, mask))
+        colbert_vecs, offsets = self.pack_token_vectors(colbert_vecs, mask[:, 1:], normalize=self.normlized)
+        return self.split_packed(colbert_vecs, offsets, return_type)
     
     def convert_id_to_token(self, lexical_weights):
         return_type = list
@@ -112,60 +136,64 @@ class EmbeddingModel(BaseEncoder):
             new_lexical_weights = new_lexical_weights[0]
         return new_lexical_weights
 
-    def _encode(self, token, return_dense=True, return_sparse=True, return_colbert=True, return_sparse_embedding=True, return_type='ls'):
+    def _encode(self, token, return_dense=True, return_sparse=True, return_colbert=True, return_sparse_embedding=True, return_type='ls', sparse_format='dense', dimensions=None, dtype=None):
         if not return_dense and not return_sparse and not return_colbert:
             raise ValueError('At least one of return_dense, return_sparse, return_colbert should be True')
-        last_hidden_state = self.model(**token, return_dict=True).last_hidden_state
+        if return_sparse or return_colbert:
+            self.ensure_pooler()
+        start = time.perf_counter()
+        with torch.autocast('cpu', dtype=torch.bfloat16, enabled=self.precision == 'bf16'):
+            last_hidden_state = self.model(**token, return_dict=True).last_hidden_state
+        if self.precision == 'bf16':
+            last_hidden_state = last_hidden_state.float()
+        self.record_timing('forward', start)
 
+        start = time.perf_counter()
         dense_vecs, sparse_vecs, colbert_vecs = None, None, None
         if return_dense:
-            dense_vecs = self.dense_embedding(last_hidden_state, token['attention_mask'], return_type=return_type)
+            dense_vecs = self.dense_embedding(last_hidden_state, token['attention_mask'], return_type=return_type, dimensions=dimensions, dtype=dtype)
         if return_sparse:
-            sparse_vecs = self.sparse_embedding(last_hidden_state, token['input_ids'], return_embedding=return_sparse_embedding, return_type=return_type)
+            sparse_vecs = self.sparse_embedding(last_hidden_state, token['input_ids'], return_embedding=return_sparse_embedding, return_type=return_type, sparse_format=sparse_format)
         if return_colbert:
             colbert_vecs = self.colbert_embedding(last_hidden_state, token['attention_mask'], return_type=return_type)
+        self.record_timing('postprocess', start)
 
         return dense_vecs, sparse_vecs, colbert_vecs
 
     @torch.no_grad()
-    def encode(self, sentences:Union[List[str], str], return_dense=True, return_sparse=False, return_colbert=False, return_sparse_embedding=False, return_type='ls', batch_size=12):
+    def encode(self, sentences:Union[List[str], str], return_dense=True, return_sparse=False, return_colbert=False, return_sparse_embedding=False, return_type='ls', batch_size=None, max_tokens_per_batch=None, sparse_format='dense', colbert_format='rows', dimensions=None, dtype=None):
         input_was_string = False
         if isinstance(sentences, str):
             sentences = [sentences]
             input_was_string = True
         
-        init_res = lambda return_vect: [] if return_vect else None
+        init_res = lambda return_vect: [None] * len(sentences) if return_vect else None
         all_dense_vecs, all_sparse_vecs, all_colbert_vecs = init_res(return_dense), init_res(return_sparse), init_res(return_colbert)
-        for batch in range(0, len(sentences), batch_size):
-            sentences_batch = sentences[batch:batch + batch_size]
-            batch_token = self.tokenizer(
-                sentences_batch,
-                max_length=self.max_length, 
-                padding=True, 
-                return_token_type_ids=False, 
-                truncation=True, 
-                return_tensors='pt'
-            ).to(self.device)
-
+        for indices, batch_token in self.tokenize_batches(sentences, batch_size, max_tokens_per_batch):
             dense_vecs, sparse_vecs, colbert_vecs = self._encode(
-                batch_token, 
+                batch_token.to(self.device), 
                 return_dense=return_dense,
                 return_sparse=return_sparse,
                 return_colbert=return_colbert,
                 return_sparse_embedding=return_sparse_embedding,
-                return_type=return_type
+                return_type=return_type,
+                sparse_format=sparse_format,
+                dimensions=dimensions,
+                dtype=dtype
             )
             if return_dense:
-                all_dense_vecs.extend(dense_vecs)
+                self.scatter_results(all_dense_vecs, indices, dense_vecs)
             if return_sparse:
-                all_sparse_vecs.extend(sparse_vecs)
+                self.scatter_results(all_sparse_vecs, indices, sparse_vecs)
             if return_colbert:
-                all_colbert_vecs.extend(colbert_vecs)
+                self.scatter_results(all_colbert_vecs, indices, colbert_vecs)
         
+        if return_colbert and colbert_format == 'packed':
+            all_colbert_vecs = self.pack_rows(all_colbert_vecs, return_type)
         if input_was_string:
             all_dense_vecs = all_dense_vecs[0] if return_dense else None
             all_sparse_vecs = all_sparse_vecs[0] if return_sparse else None
-            all_colbert_vecs = all_colbert_vecs[0] if return_colbert else None
+            all_colbert_vecs = all_colbert_vecs[0] if return_colbert and colbert_format != 'packed' else all_colbert_vecs
         return {"dense_vecs": all_dense_vecs, "lexical_weights": all_sparse_vecs, "colbert_vecs": all_colbert_vecs}
             
     def count_tokenizer(self, sentence):
@@ -1,104 +1,159 @@
-from optimum.onnxruntime import ORTModelForFeatureExtraction
-from huggingface_hub import snapshot_download
-from transformers import AutoTokenizer
-import torch
+import onnxruntime as ort
+import numpy as np
 
-from collections import defaultdict
 from typing import List, Union
-import numpy as np
 from pathlib import Path
+import json
+import time
 import os
 
 from configs.config import SettingsManager
 from configs.logger import LoggerConfig
 from model_ai.base_encoder import BaseEncoder
+from model_ai.fast_tokenizer import FastTokenizer
+from model_ai.ort_session import OrtSessionProfile
 
 
 class EmbeddingModel(BaseEncoder):
+    HEADS_FILE = 'pooler_heads.npz'
+    HEAD_OUTPUTS = ('dense_vecs', 'sparse_weights', 'colbert_vecs')
+
     def __init__(self, model_name='BAAI/bge-m3', sentence_pooling_method='cls', normlized=True, max_length=8192):
         super().__init__()
+        start = time.perf_counter()
         self.model_name = model_name
-        self.load_model()
-        self.load_pooler()
         self.sentence_pooling_method = sentence_pooling_method
-        self.vocab_size = self.model.config.vocab_size
         self.normlized = normlized
+        self.load_model()
+        if self.fused_heads:
+            self.check_fused_heads()
+        self.vocab_size = self.config['vocab_size']
         self.max_length = max_length
+        if SettingsManager.settings.preload_app:
+            # onnxruntime thread pools do not survive fork, the master only reads the graph and every worker opens its own session
+            self.model = None
+        self.log_startup(start)
+
+    def resolve_device(self):
+        return SettingsManager.settings.device if 'CUDAExecutionProvider' in ort.get_available_providers() else 'cpu'
 
     def load_model(self):
-        model_path_not_exist = not os.path.exists(self.model_name)
-        if model_path_not_exist:
-            cache_folder = os.getenv('HF_HUB_CACHE')
-            self.model_name = snapshot_download(repo_id=self.model_name, cache_dir=cache_folder, ignore_patterns=['flax_model.msgpack', 'rust_model.ot', 'tf_model.h5'])
+        self.model_name = self.timed_load('resolve', lambda: self.resolve_snapshot(self.model_name))
+        self.model_dir = Path().resolve() / 'model_ai' / 'models' / SettingsManager.settings.model_file_name
+        with open(self.model_dir / 'config.json', encoding='utf-8') as f:
+            self.config = json.load(f)
+        self.model, self.tokenizer = self.load_concurrently(lambda: self.create_session(self.model_dir), lambda: FastTokenizer.from_pretrained(self.model_name))
+        self.input_names = [node.name for node in self.model.get_inputs()]
+        output_names = [node.name for node in self.model.get_outputs()]
+        self.fused_heads = set(self.HEAD_OUTPUTS) <= set(output_names)
+        self.output_name = 'last_hidden_state' if 'last_hidden_state' in output_names else output_names[0]
+        self.run_options = OrtSessionProfile.run_options(self.device, only_fetches=self.fused_heads)
+        OrtSessionProfile.log_session(self.model, self.run_options)
 
-        self.model = ORTModelForFeatureExtraction.from_pretrained(
-            f"{str(Path().resolve())}/model_ai/models/{SettingsManager.settings.model_file_name}",
-            use_io_binding=self.device!='cpu'
-        ).to(self.device)
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+    def create_session(self, model_dir):
+        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if self.device != 'cpu' else ['CPUExecutionProvider']
+        optimized_model_path = SettingsManager.settings.ort_optimized_model_path
+        source_path = str(model_dir / OrtSessionProfile.find_model(model_dir))
+        if optimized_model_path and OrtSessionProfile.is_optimized_from(optimized_model_path, source_path, providers):
+            # the saved graph is already optimized, so loading it skips the optimization passes
+            session_options = OrtSessionProfile.session_options(optimization_level='disable')
+            return ort.InferenceSession(optimized_model_path, sess_options=session_options, providers=providers)
+        session_options = OrtSessionProfile.session_options()
+        if optimized_model_path:
+            session_options.optimized_model_filepath = optimized_model_path
+        session = ort.InferenceSession(source_path, sess_options=session_options, providers=providers)
+        if optimized_model_path:
+            OrtSessionProfile.record_optimized_model(optimized_model_path, source_path, providers)
+        return session
+
+    def after_fork(self):
+        # onnxruntime thread pools do not survive fork, so every worker opens its own session,
+        # with ORT_DISABLE_PREPACKING the new session reads the weights from the shared page cache
+        if self.model is not None:
+            # freeing a session inherited without its threads hangs, it stays referenced for the life of the worker
+            self.parent_session = self.model
+        self.model = self.create_session(self.model_dir)
+        LoggerConfig.logger.info(f"[ORT] session reopened in worker {os.getpid()}")
 
     def load_pooler(self):
+        if self.fused_heads:
+            return
+        heads_path = os.path.join(self.model_name, self.HEADS_FILE)
         pooler_colbert_path_exist = os.path.exists(os.path.join(self.model_name, 'colbert_linear.pt'))
         pooler_sparse_path_exist = os.path.exists(os.path.join(self.model_name, 'sparse_linear.pt'))
-        if pooler_colbert_path_exist and pooler_sparse_path_exist:
+        if os.path.exists(heads_path) or (pooler_colbert_path_exist and pooler_sparse_path_exist):
             LoggerConfig.logger.info('loading existing colbert_linear and sparse_linear')
-
-            colbert_state_dict = torch.load(os.path.join(self.model_name, 'colbert_linear.pt'), map_location=self.device, weights_only=True)
-            self.colbert_linear = torch.nn.Linear(in_features=self.model.config.hidden_size, out_features=self.model.config.hidden_size).to(self.device)
-            self.colbert_linear.load_state_dict(colbert_state_dict)
-
-            sparse_state_dict = torch.load(os.path.join(self.model_name, 'sparse_linear.pt'), map_location=self.device, weights_only=True)
-            self.sparse_linear = torch.nn.Linear(in_features=self.model.config.hidden_size, out_features=1).to(self.device)
-            self.sparse_linear.load_state_dict(sparse_state_dict)
+            heads = dict(np.load(heads_path)) if os.path.exists(heads_path) else self.export_heads(self.model_name, heads_path)
+            self.colbert_weight, self.colbert_bias = heads['colbert_weight'], heads['colbert_bias']
+            self.sparse_weight, self.sparse_bias = heads['sparse_weight'], heads['sparse_bias']
         else:
             LoggerConfig.logger.error('The parameters of colbert_linear and sparse linear is new initialize. Make sure the model is loaded for training, not inferencing')
 
-    def dense_embedding(self, hidden_state, mask, return_type='ls'):
+    def check_fused_heads(self):
+        # pooling and normalization are baked into the exported graph, see model_ai/export_onnx.py
+        metadata = self.model.get_modelmeta().custom_metadata_map
+        exported = (metadata.get('sentence_pooling_method', 'cls'), metadata.get('normlized', 'True') == 'True')
+        if exported != (self.sentence_pooling_method, self.normlized):
+            raise ValueError(f"ONNX graph was exported with sentence_pooling_method={exported[0]} normlized={exported[1]}, but the model uses sentence_pooling_method={self.sentence_pooling_method} normlized={self.normlized}")
+        LoggerConfig.logger.info('colbert_linear and sparse_linear are part of the ONNX graph')
+
+    @staticmethod
+    def export_heads(model_name, heads_path):
+        # torch is only needed once to read the released .pt heads, later loads read the numpy copy
+        import torch
+        LoggerConfig.logger.warning(f"converting colbert_linear and sparse_linear to {heads_path}, this load imports torch")
+        colbert_state_dict = torch.load(os.path.join(model_name, 'colbert_linear.pt'), map_location='cpu', weights_only=True)
+        sparse_state_dict = torch.load(os.path.join(model_name, 'sparse_linear.pt'), map_location='cpu', weights_only=True)
+        heads = {
+            'colbert_weight': np.ascontiguousarray(colbert_state_dict['weight'].float().numpy().T),
+            'colbert_bias': colbert_state_dict['bias'].float().numpy(),
+            'sparse_weight': np.ascontiguousarray(sparse_state_dict['weight'].float().numpy().T),
+            'sparse_bias': sparse_state_dict['bias'].float().numpy(),
+        }
+        try:
+            np.savez(heads_path, **heads)
+        except OSError as e:
+            LoggerConfig.logger.warning(f"could not save {heads_path}: {e}")
+        return heads
+
+    def dense_embedding(self, hidden_state, mask, return_type='ls', dimensions=None, dtype=None):
         if self.sentence_pooling_method == 'cls':
             dense_vecs = hidden_state[:, 0]
         elif self.sentence_pooling_method == 'mean':
-            s = torch.sum(hidden_state * mask.unsqueeze(-1).float(), dim=1)
-            d = mask.sum(axis=1, keepdim=True).float()
+            s = np.sum(hidden_state * mask[:, :, None].astype(hidden_state.dtype), axis=1)
+            d = mask.sum(axis=1, keepdims=True)
             dense_vecs = s / d
-        
-        dense_vecs = torch.nn.functional.normalize(dense_vecs, dim=-1) if self.normlized else dense_vecs
-        return self.convert_pt_type(dense_vecs.contiguous(), return_type)
 
-    def sparse_embedding(self, hidden_state, input_ids, return_embedding: bool = True, return_type='ls'):
-        token_weights = torch.relu(self.sparse_linear(hidden_state)).to(self.device)
+        if dimensions is not None:
+            self.check_dimensions(dimensions, dense_vecs.shape[-1])
+            dense_vecs = dense_vecs[:, :dimensions]
+        dense_vecs = self.normalize_np(dense_vecs) if self.normlized else dense_vecs
+        return self.convert_np_type(np.ascontiguousarray(dense_vecs, dtype=np.float32), return_type, dtype)
+
+    def sparse_embedding(self, hidden_state, input_ids, return_embedding: bool = True, return_type='ls', sparse_format='dense'):
+        token_weights = np.maximum(hidden_state @ self.sparse_weight + self.sparse_bias, 0)
+        return self.lexical_embedding(token_weights[..., 0], input_ids, return_embedding=return_embedding, return_type=return_type, sparse_format=sparse_format)
+
+    def lexical_embedding(self, token_weights, input_ids, return_embedding: bool = True, return_type='ls', sparse_format='dense'):
         unused_tokens = [self.tokenizer.cls_token_id, self.tokenizer.eos_token_id, self.tokenizer.pad_token_id, self.tokenizer.unk_token_id]
-        
-        def _process_token_weights(token_weights: np.ndarray, input_ids: list):
-            result = defaultdict(int)
-            set_unused_tokens = set(unused_tokens)
-            for w, idx in zip(token_weights, input_ids):
-                idx = idx.item()
-                if idx not in set_unused_tokens and w > 0:
-                    idx = str(idx)
-                    if w > result[idx]:
-                        result[idx] = w.item()
-            return result
-        
+
+        row_ids, token_ids, weights = self.compute_lexical_weights_np(token_weights, input_ids, unused_tokens)
         if not return_embedding:
-            token_weights = list(map(_process_token_weights, token_weights, input_ids)) 
-            return token_weights
-
-        sparse_embedding = torch.zeros(input_ids.size(0), input_ids.size(1), self.vocab_size, dtype=token_weights.dtype, device=self.device)
-        sparse_embedding = torch.scatter(sparse_embedding, dim=-1, index=input_ids.unsqueeze(-1), src=token_weights)
-        sparse_embedding = torch.max(sparse_embedding, dim=1).values
-        sparse_embedding[:, unused_tokens] *= 0.
-        return self.convert_pt_type(sparse_embedding.contiguous(), return_type)
-    
+            return self.lexical_weights_to_dict(row_ids, token_ids, weights, input_ids.shape[0])
+        if sparse_format == 'coo':
+            return self.lexical_weights_to_coo(row_ids, token_ids, weights, input_ids.shape[0], return_type)
+
+        sparse_embedding = np.zeros((input_ids.shape[0], self.vocab_size), dtype=weights.dtype)
+        sparse_embedding[row_ids, token_ids] = weights
+        return self.convert_np_type(sparse_embedding, return_type)
+
     def colbert_embedding(self, last_hidden_state, mask, return_type='ls'):
-        colbert_vecs = self.colbert_linear(last_hidden_state[:, 1:])
-        colbert_vecs = colbert_vecs * mask[:, 1:][:, :, None].float().contiguous()
-        def _process_colbert_vecs(colbert_vecs, mask):
-            use_token_layer = mask.sum(-1)
-            embedded_without_cls_layer = colbert_vecs[:use_token_layer - 1]
-            embedded_without_cls_layer = torch.nn.functional.normalize(embedded_without_cls_layer, dim=-1).cpu() if self.normlized else embedded_without_cls_layer.cpu()
-            return self.convert_pt_type(embedded_without_cls_layer, return_type)
-        return list(map(_process_colbert_vecs, colbert_vecs, mask))
-    
+        # the head only runs on real tokens, padding positions are dropped before the matmul
+        token_states, offsets = self.pack_token_vectors_np(last_hidden_state[:, 1:], mask[:, 1:], normalize=False)
+        colbert_vecs = token_states @ self.colbert_weight + self.colbert_bias
+        colbert_vecs = self.normalize_np(colbert_vecs) if self.normlized else colbert_vecs
+        return self.split_packed(colbert_vecs, offsets, return_type)
+
     def convert_id_to_token(self, lexical_weights):
         return_type = list
         if isinstance(lexical_weights, dict):
@@ -116,61 +171,89 @@ class EmbeddingModel(BaseEncoder):
             new_lexical_weights = new_lexical_weights[0]
         return new_lexical_weights
 
-    def _encode(self, token, return_dense=True, return_sparse=True, return_colbert=True, return_sparse_embedding=True, return_type='ls'):
+    def forward(self, token, output_names=None):
+        inputs = {name: token[name] if name in token else np.zeros_like(token['input_ids']) for name in self.input_names}
+        if output_names is None:
+            return self.model.run([self.output_name], inputs, self.run_options)[0]
+        return dict(zip(output_names, self.model.run(output_names, inputs, self.run_options)))
+
+    def _encode_fused(self, token, return_dense=True, return_sparse=True, return_colbert=True, return_sparse_embedding=True, return_type='ls', sparse_format='dense', dimensions=None, dtype=None):
+        # only the requested head outputs are copied out of the runtime, the hidden state never is
+        output_names = [name for name, requested in zip(self.HEAD_OUTPUTS, (return_dense, return_sparse, return_colbert)) if requested]
+        start = time.perf_counter()
+        outputs = self.forward(token, output_names)
+        self.record_timing('forward', start)
+
+        start = time.perf_counter()
+        dense_vecs, sparse_vecs, colbert_vecs = None, None, None
+        if return_dense:
+            # the graph normalizes the full vector, a truncated one is renormalized here
+            dense_vecs = self.convert_np_type(self.truncate_np(outputs['dense_vecs'], dimensions, self.normlized), return_type, dtype)
+        if return_sparse:
+            sparse_vecs = self.lexical_embedding(outputs['sparse_weights'], token['input_ids'], return_embedding=return_sparse_embedding, return_type=return_type, sparse_format=sparse_format)
+        if return_colbert:
+            colbert_vecs = self.split_packed(outputs['colbert_vecs'], self.token_offsets(token['attention_mask'][:, 1:]), return_type)
+        self.record_timing('postprocess', start)
+
+        return dense_vecs, sparse_vecs, colbert_vecs
+
+    def _encode(self, token, return_dense=True, return_sparse=True, return_colbert=True, return_sparse_embedding=True, return_type='ls', sparse_format='dense', dimensions=None, dtype=None):
         if not return_dense and not return_sparse and not return_colbert:
             raise ValueError('At least one of return_dense, return_sparse, return_colbert should be True')
-        last_hidden_state = self.model(**token, return_dict=True).last_hidden_state
+        if return_sparse or return_colbert:
+            self.ensure_pooler()
+        if self.fused_heads:
+            return self._encode_fused(token, return_dense, return_sparse, return_colbert, return_sparse_embedding, return_type, sparse_format, dimensions, dtype)
+        start = time.perf_counter()
+        last_hidden_state = self.forward(token)
+        self.record_timing('forward', start)
 
+        start = time.perf_counter()
         dense_vecs, sparse_vecs, colbert_vecs = None, None, None
         if return_dense:
-            dense_vecs = self.dense_embedding(last_hidden_state, token['attention_mask'], return_type=return_type)
+            dense_vecs = self.dense_embedding(last_hidden_state, token['attention_mask'], return_type=return_type, dimensions=dimensions, dtype=dtype)
         if return_sparse:
-            sparse_vecs = self.sparse_embedding(last_hidden_state, token['input_ids'], return_embedding=return_sparse_embedding, return_type=return_type)
+            sparse_vecs = self.sparse_embedding(last_hidden_state, token['input_ids'], return_embedding=return_sparse_embedding, return_type=return_type, sparse_format=sparse_format)
         if return_colbert:
             colbert_vecs = self.colbert_embedding(last_hidden_state, token['attention_mask'], return_type=return_type)
+        self.record_timing('postprocess', start)
 
         return dense_vecs, sparse_vecs, colbert_vecs
 
-    @torch.no_grad()
-    def encode(self, sentences:Union[List[str], str], return_dense=True, return_sparse=False, return_colbert=False, return_sparse_embedding=False, return_type='ls', batch_size=12):
+    def encode(self, sentences:Union[List[str], str], return_dense=True, return_sparse=False, return_colbert=False, return_sparse_embedding=False, return_type='ls', batch_size=None, max_tokens_per_batch=None, sparse_format='dense', colbert_format='rows', dimensions=None, dtype=None):
         input_was_string = False
         if isinstance(sentences, str):
             sentences = [sentences]
             input_was_string = True
-        
-        init_res = lambda return_vect: [] if return_vect else None
-        all_dense_vecs, all_sparse_vecs, all_colbert_vecs = init_res(return_dense), init_res(return_sparse), init_res(return_colbert)
-        for batch in range(0, len(sentences), batch_size):
-            sentences_batch = sentences[batch:batch + batch_size]
-            batch_token = self.tokenizer(
-                sentences_batch,
-                max_length=self.max_length, 
-                padding=True, 
-                return_token_type_ids=False, 
-                truncation=True, 
-                return_tensors='pt'
-            ).to(self.device)
 
+        init_res = lambda return_vect: [None] * len(sentences) if return_vect else None
+        all_dense_vecs, all_sparse_vecs, all_colbert_vecs = init_res(return_dense), init_res(return_sparse), init_res(return_colbert)
+        for indices, batch_token in self.tokenize_batches(sentences, batch_size, max_tokens_per_batch, return_tensors='np'):
             dense_vecs, sparse_vecs, colbert_vecs = self._encode(
-                batch_token, 
+                batch_token,
                 return_dense=return_dense,
                 return_sparse=return_sparse,
                 return_colbert=return_colbert,
                 return_sparse_embedding=return_sparse_embedding,
-                return_type=return_type
+                return_type=return_type,
+                sparse_format=sparse_format,
+                dimensions=dimensions,
+                dtype=dtype
             )
             if return_dense:
-                all_dense_vecs.extend(dense_vecs)
+                self.scatter_results(all_dense_vecs, indices, dense_vecs)
             if return_sparse:
-                all_sparse_vecs.extend(sparse_vecs)
+                self.scatter_results(all_sparse_vecs, indices, sparse_vecs)
             if return_colbert:
-                all_colbert_vecs.extend(colbert_vecs)
-        
+                self.scatter_results(all_colbert_vecs, indices, colbert_vecs)
+
+        if return_colbert and colbert_format == 'packed':
+            all_colbert_vecs = self.pack_rows(all_colbert_vecs, return_type)
         if input_was_string:
             all_dense_vecs = all_dense_vecs[0] if return_dense else None
             all_sparse_vecs = all_sparse_vecs[0] if return_sparse else None
-            all_colbert_vecs = all_colbert_vecs[0] if return_colbert else None
+            all_colbert_vecs = all_colbert_vecs[0] if return_colbert and colbert_format != 'packed' else all_colbert_vecs
         return {"dense_vecs": all_dense_vecs, "lexical_weights": all_sparse_vecs, "colbert_vecs": all_colbert_vecs}
 
     def count_tokenizer(self, sentence):
-        return list(map(len, self.tokenizer(sentence)['input_ids']))
\ No newline at end of file
+        return list(map(len, self.tokenizer(sentence)['input_ids']))
@@ -0,0 +1,124 @@
+from transformers import AutoModel
+import onnxruntime as ort
+import numpy as np
+import torch
+import onnx
+
+from pathlib import Path
+import argparse
+import inspect
+import shutil
+import os
+
+from configs.logger import LoggerConfig
+from model_ai.bge_m3_onnx import EmbeddingModel
+from model_ai.fast_tokenizer import FastTokenizer
+
+
+class M3HeadsModule(torch.nn.Module):
+    def __init__(self, model, colbert_linear, sparse_linear, sentence_pooling_method='cls', normlized=True):
+        super().__init__()
+        self.model = model
+        self.colbert_linear = colbert_linear
+        self.sparse_linear = sparse_linear
+        self.sentence_pooling_method = sentence_pooling_method
+        self.normlized = normlized
+
+    def forward(self, input_ids, attention_mask):
+        last_hidden_state = self.model(input_ids=input_ids, attention_mask=attention_mask, return_dict=True).last_hidden_state
+        if self.sentence_pooling_method == 'cls':
+            dense_vecs = last_hidden_state[:, 0]
+        else:
+            dense_vecs = torch.sum(last_hidden_state * attention_mask.unsqueeze(-1).to(last_hidden_state.dtype), dim=1) / attention_mask.sum(dim=1, keepdim=True).to(last_hidden_state.dtype)
+        sparse_weights = torch.relu(self.sparse_linear(last_hidden_state)).squeeze(-1)
+        # real tokens of every row packed into one (tokens, hidden) output, the row offsets follow from attention_mask
+        colbert_vecs = self.colbert_linear(last_hidden_state[:, 1:][attention_mask[:, 1:].bool()])
+        if self.normlized:
+            dense_vecs = torch.nn.functional.normalize(dense_vecs, dim=-1)
+            colbert_vecs = torch.nn.functional.normalize(colbert_vecs, dim=-1)
+        return dense_vecs, sparse_weights, colbert_vecs
+
+
+class OnnxExporter:
+    SHARED_FILES = ('config.json', 'tokenizer.json', 'tokenizer_config.json', 'special_tokens_map.json', 'sentencepiece.bpe.model')
+    SAMPLE_SENTENCES = ["สวัสดีครับ", "BGE-M3 supports dense, sparse and multi-vector retrieval."]
+
+    @staticmethod
+    def load_heads(model_dir, hidden_size):
+        colbert_linear = torch.nn.Linear(hidden_size, hidden_size)
+        colbert_linear.load_state_dict(torch.load(os.path.join(model_dir, 'colbert_linear.pt'), map_location='cpu', weights_only=True))
+        sparse_linear = torch.nn.Linear(hidden_size, 1)
+        sparse_linear.load_state_dict(torch.load(os.path.join(model_dir, 'sparse_linear.pt'), map_location='cpu', weights_only=True))
+        return colbert_linear, sparse_linear
+
+    @staticmethod
+    def export_kwargs():
+        # newer torch defaults to the dynamo exporter, the graph is traced with the TorchScript exporter on every version
+        return {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+
+    @classmethod
+    def export(cls, model_name, output_dir, sentence_pooling_method='cls', normlized=True, opset=17):
+        model_name = EmbeddingModel.resolve_snapshot(model_name)
+        output_dir = Path(output_dir)
+        output_path = output_dir / 'model.onnx'
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        model = AutoModel.from_pretrained(model_name).eval()
+        module = M3HeadsModule(model, *cls.load_heads(model_name, model.config.hidden_size), sentence_pooling_method, normlized).eval()
+        token = FastTokenizer.from_pretrained(model_name)(cls.SAMPLE_SENTENCES, padding=True, return_tensors='np')
+        inputs = (torch.from_numpy(token['input_ids']), torch.from_numpy(token['attention_mask']))
+
+        LoggerConfig.logger.info(f"[Export] exporting {model_name} with dense, sparse and colbert heads to {output_path}")
+        with torch.no_grad():
+            expected = [output.numpy() for output in module(*inputs)]
+            torch.onnx.export(
+                module,
+                inputs,
+                str(output_path),
+                input_names=['input_ids', 'attention_mask'],
+                output_names=list(EmbeddingModel.HEAD_OUTPUTS),
+                dynamic_axes={
+                    'input_ids': {0: 'batch', 1: 'sequence'},
+                    'attention_mask': {0: 'batch', 1: 'sequence'},
+                    'dense_vecs': {0: 'batch'},
+                    'sparse_weights': {0: 'batch', 1: 'sequence'},
+                    'colbert_vecs': {0: 'tokens'},
+                },
+                opset_version=opset,
+                **cls.export_kwargs()
+            )
+
+        graph = onnx.load(str(output_path), load_external_data=False)
+        onnx.helper.set_model_props(graph, {'sentence_pooling_method': sentence_pooling_method, 'normlized': str(normlized)})
+        onnx.save(graph, str(output_path))
+        for name in cls.SHARED_FILES:
+            if os.path.exists(os.path.join(model_name, name)):
+                shutil.copy2(os.path.join(model_name, name), output_dir / name)
+
+        session = ort.InferenceSession(str(output_path), providers=['CPUExecutionProvider'])
+        outputs = session.run(list(EmbeddingModel.HEAD_OUTPUTS), {'input_ids': token['input_ids'], 'attention_mask': token['attention_mask']})
+        max_abs_diff = max(float(np.abs(output - reference).max()) for output, reference in zip(outputs, expected))
+        LoggerConfig.logger.info(f"[Export] wrote {output_path}, max abs difference to torch {max_abs_diff:.2e}")
+        return {"output": str(output_path), "max_abs_diff": max_abs_diff}
+
+
+if __name__ == '__main__':
+    from configs.config import SettingsManager
+    SettingsManager.initialize()
+    settings = SettingsManager.settings
+
+    parser = argparse.ArgumentParser(description="Export bge-m3 with the dense, sparse and colbert heads as one ONNX graph")
+    parser.add_argument('--model', default='BAAI/bge-m3', help="hugging face repo id or local snapshot of the model")
+    parser.add_argument('--output', default=f"{settings.model_file_name}_heads", help="model directory name of the exported model")
+    parser.add_argument('--pooling', default='cls', choices=['cls', 'mean'], help="sentence pooling baked into dense_vecs")
+    parser.add_argument('--no-normalize', action='store_true', help="do not normalize dense_vecs and colbert_vecs inside the graph")
+    parser.add_argument('--opset', type=int, default=17)
+    args = parser.parse_args()
+
+    print(OnnxExporter.export(
+        args.model,
+        Path().resolve() / 'model_ai' / 'models' / args.output,
+        sentence_pooling_method=args.pooling,
+        normlized=not args.no_normalize,
+        opset=args.opset
+    ))
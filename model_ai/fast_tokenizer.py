@@ -0,0 +1,53 @@
+from typing import List, Union
+import json
+import os
+
+import numpy as np
+from tokenizers import Tokenizer
+
+
+class FastTokenizer:
+    SPECIAL_TOKENS = ('cls_token', 'eos_token', 'pad_token', 'unk_token')
+
+    def __init__(self, tokenizer, special_tokens):
+        self.tokenizer = tokenizer
+        self.tokenizer.no_padding()
+        self.tokenizer.no_truncation()
+        for name in self.SPECIAL_TOKENS:
+            setattr(self, f"{name}_id", tokenizer.token_to_id(special_tokens[name]))
+
+    @classmethod
+    def from_pretrained(cls, model_dir):
+        tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        with open(os.path.join(model_dir, 'special_tokens_map.json'), encoding='utf-8') as f:
+            special_tokens = json.load(f)
+        special_tokens = {name: token['content'] if isinstance(token, dict) else token for name, token in special_tokens.items()}
+        return cls(tokenizer, special_tokens)
+
+    def __call__(self, sentences:Union[List[str], str], max_length=None, truncation=False, padding=False, return_token_type_ids=False, return_tensors=None):
+        input_was_string = isinstance(sentences, str)
+        encodings = self.tokenizer.encode_batch([sentences] if input_was_string else sentences)
+        input_ids = [encoding.ids for encoding in encodings]
+        if truncation and max_length:
+            # keep the closing special token, like the transformers tokenizer does for single sequences
+            input_ids = [ids[:max_length - 1] + ids[-1:] if len(ids) > max_length else ids for ids in input_ids]
+        features = {'input_ids': input_ids, 'attention_mask': [[1] * len(ids) for ids in input_ids]}
+        if padding or return_tensors:
+            return self.pad(features, return_tensors=return_tensors)
+        if input_was_string:
+            return {name: values[0] for name, values in features.items()}
+        return features
+
+    def pad(self, features, padding=True, return_tensors='np'):
+        if return_tensors not in (None, 'np'):
+            raise ValueError(f"return_tensors should be 'np', but got {return_tensors}")
+        max_length = max(map(len, features['input_ids']), default=0)
+        input_ids = np.full((len(features['input_ids']), max_length), self.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(features['input_ids']), max_length), dtype=np.int64)
+        for n, ids in enumerate(features['input_ids']):
+            input_ids[n, :len(ids)] = ids
+            attention_mask[n, :len(ids)] = 1
+        return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+    def decode(self, ids, skip_special_tokens=False):
+        return self.tokenizer.decode(ids, skip_special_tokens=skip_special_tokens)
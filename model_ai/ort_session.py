@@ -0,0 +1,104 @@
+from pathlib import Path
+import json
+import os
+
+import onnxruntime as ort
+
+from configs.config import SettingsManager
+from configs.logger import LoggerConfig
+
+
+class OrtSessionProfile:
+    OPTIMIZATION_LEVELS = {
+        'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    EXECUTION_MODES = {
+        'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+        'parallel': ort.ExecutionMode.ORT_PARALLEL,
+    }
+
+    @classmethod
+    def session_options(cls, optimization_level=None):
+        settings = SettingsManager.settings
+        optimization_level = optimization_level or settings.ort_graph_optimization_level
+        if optimization_level not in cls.OPTIMIZATION_LEVELS:
+            raise ValueError(f"ort_graph_optimization_level should be one of {list(cls.OPTIMIZATION_LEVELS)}, but got {optimization_level}")
+        if settings.ort_execution_mode not in cls.EXECUTION_MODES:
+            raise ValueError(f"ort_execution_mode should be one of {list(cls.EXECUTION_MODES)}, but got {settings.ort_execution_mode}")
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = settings.ort_intra_op_threads
+        options.inter_op_num_threads = settings.ort_inter_op_threads
+        options.graph_optimization_level = cls.OPTIMIZATION_LEVELS[optimization_level]
+        options.execution_mode = cls.EXECUTION_MODES[settings.ort_execution_mode]
+        options.enable_mem_pattern = settings.ort_enable_mem_pattern
+        options.enable_cpu_mem_arena = settings.ort_enable_cpu_mem_arena
+        if settings.ort_disable_prepacking:
+            # weights stored as external data stay on the read-only mmap of the data file instead of a prepacked
+            # copy, so every worker process shares the same physical pages
+            options.add_session_config_entry('session.disable_prepacking', '1')
+        return options
+
+    @staticmethod
+    def run_options(device='cpu', only_fetches=False):
+        arena_shrinkage = SettingsManager.settings.ort_arena_shrinkage
+        if not arena_shrinkage and not only_fetches:
+            return None
+        options = ort.RunOptions()
+        # a graph with several outputs only runs the nodes needed for the outputs that were asked for
+        options.only_execute_path_to_fetches = only_fetches
+        if arena_shrinkage:
+            # release the arena memory grown by a large batch back to the system after every run
+            arena = 'cpu:0' if device == 'cpu' else f"gpu:{device.split(':')[1] if ':' in device else 0}"
+            options.add_run_config_entry('memory.enable_memory_arena_shrinkage', arena)
+        return options
+
+    @staticmethod
+    def find_model(model_dir):
+        models = sorted(f.name for f in Path(model_dir).glob('*.onnx'))
+        if len(models) != 1:
+            raise ValueError(f"expected one ONNX file in {model_dir}, found {models}")
+        return models[0]
+
+    @staticmethod
+    def optimized_model_source(model_path, providers):
+        # the saved graph is only valid for the model file, optimization level and providers it was built from
+        stat = os.stat(model_path)
+        return {
+            "model_path": str(Path(model_path).resolve()),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "optimization_level": SettingsManager.settings.ort_graph_optimization_level,
+            "providers": list(providers),
+        }
+
+    @classmethod
+    def is_optimized_from(cls, optimized_model_path, model_path, providers):
+        try:
+            with open(f"{optimized_model_path}.json", encoding='utf-8') as f:
+                source = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        return os.path.exists(optimized_model_path) and source == cls.optimized_model_source(model_path, providers)
+
+    @classmethod
+    def record_optimized_model(cls, optimized_model_path, model_path, providers):
+        with open(f"{optimized_model_path}.json", 'w', encoding='utf-8') as f:
+            json.dump(cls.optimized_model_source(model_path, providers), f)
+
+    @staticmethod
+    def log_session(session, run_options=None):
+        options = session.get_session_options()
+        LoggerConfig.logger.info(
+            f"[ORT] providers={session.get_providers()} "
+            f"intra_op_threads={options.intra_op_num_threads} inter_op_threads={options.inter_op_num_threads} "
+            f"optimization={options.graph_optimization_level} execution_mode={options.execution_mode} "
+            f"mem_pattern={options.enable_mem_pattern} cpu_mem_arena={options.enable_cpu_mem_arena} "
+            f"prepacking={not SettingsManager.settings.ort_disable_prepacking} "
+            f"arena_shrinkage={run_options is not None and SettingsManager.settings.ort_arena_shrinkage} "
+            f"only_fetches={run_options is not None and run_options.only_execute_path_to_fetches} "
+            f"optimized_model={options.optimized_model_filepath or None}"
+        )
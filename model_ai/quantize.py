@@ -0,0 +1,81 @@
+from pathlib import Path
+import argparse
+import shutil
+import os
+
+from onnxruntime.quantization import quantize_dynamic, QuantType
+
+from configs.logger import LoggerConfig
+from model_ai.ort_session import OrtSessionProfile
+
+
+class OnnxQuantizer:
+    EXTERNAL_DATA_THRESHOLD = 2 * 1024 * 1024 * 1024
+
+    @staticmethod
+    def model_dir(model_file_name):
+        return Path().resolve() / 'model_ai' / 'models' / model_file_name
+
+    @staticmethod
+    def model_files(model_path):
+        return [f for f in model_path.parent.iterdir() if f.name.startswith(model_path.name)]
+
+    @classmethod
+    def uses_external_data(cls, model_path):
+        # protobuf cannot hold graphs over 2GB, so large models keep their weights next to the graph
+        return len(cls.model_files(model_path)) > 1 or os.path.getsize(model_path) > cls.EXTERNAL_DATA_THRESHOLD
+
+    @classmethod
+    def quantize(cls, model_dir, output_dir, source=None, per_channel=True):
+        model_dir, output_dir = Path(model_dir), Path(output_dir)
+        model_path = model_dir / (source or OrtSessionProfile.find_model(model_dir))
+        output_path = output_dir / 'model.onnx'
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        LoggerConfig.logger.info(f"[Quantize] quantizing {model_path} to INT8 (per_channel={per_channel})")
+        quantize_dynamic(
+            model_path,
+            output_path,
+            per_channel=per_channel,
+            weight_type=QuantType.QInt8,
+            use_external_data_format=cls.uses_external_data(model_path)
+        )
+        # config and tokenizer files are shared, so the quantized directory loads like any other model directory
+        for f in model_dir.iterdir():
+            if f.is_file() and f.suffix != '.onnx' and not f.name.startswith(model_path.name):
+                shutil.copy2(f, output_dir / f.name)
+
+        source_bytes = sum(f.stat().st_size for f in cls.model_files(model_path))
+        output_bytes = sum(f.stat().st_size for f in cls.model_files(output_path))
+        LoggerConfig.logger.info(f"[Quantize] wrote {output_path} ({output_bytes} bytes, source {source_bytes} bytes)")
+        return {"output": str(output_path), "bytes": output_bytes, "source_bytes": source_bytes}
+
+
+if __name__ == '__main__':
+    from configs.config import SettingsManager
+    SettingsManager.initialize()
+    settings = SettingsManager.settings
+
+    parser = argparse.ArgumentParser(description="Quantize the configured ONNX model to dynamic INT8")
+    parser.add_argument('--source', default=None, help="ONNX file to quantize inside the model directory")
+    parser.add_argument('--output', default=f"{settings.model_file_name}_int8", help="model directory name of the quantized model")
+    parser.add_argument('--per-tensor', action='store_true', help="use one scale per tensor instead of one per output channel")
+    parser.add_argument('--skip-report', action='store_true', help="do not compare the quantized model against the source model")
+    parser.add_argument('--min-cosine', type=float, default=0.99, help="fail when the mean dense cosine agreement is below this value")
+    args = parser.parse_args()
+
+    print(OnnxQuantizer.quantize(
+        OnnxQuantizer.model_dir(settings.model_file_name),
+        OnnxQuantizer.model_dir(args.output),
+        args.source,
+        per_channel=not args.per_tensor
+    ))
+    if not args.skip_report:
+        from model_ai.benchmark import ModelBenchmark
+        report = ModelBenchmark.compare(
+            {"model_name": "bge_m3_onnx", "model_file_name": settings.model_file_name},
+            {"model_name": "bge_m3_onnx", "model_file_name": args.output}
+        )
+        print(ModelBenchmark.format_report(report))
+        if report["cosine"]["mean"] < args.min_cosine:
+            raise SystemExit(f"mean cosine agreement {report['cosine']['mean']:.4f} is below {args.min_cosine}")
@@ -1,29 +1,54 @@
-from fastapi import APIRouter, BackgroundTasks, status, Body, Depends, Query
-from typing import Annotated
+from fastapi import APIRouter, BackgroundTasks, status, Body, Depends, Query, Header
+from fastapi.exceptions import RequestValidationError
+from typing import Annotated, Literal, Union
 from bson import ObjectId
 
+from configs.config import SettingsManager
 from configs.db import MGCollection, ESIndex
 from configs.security import get_token, UnauthorizedMessage
 from controllers.extractor import SentenceExtractor
 from controllers.mongodb_controller import MGFuncs
-from controllers.elasticsearch_controller import ESFuncs
+from controllers.elasticsearch_controller import ESFuncs, AsyncESFuncs
+from controllers.bulk_indexer import BulkIndexer
 from models.extract_model import ExtractorModel, ExtractorListModel
 from models.report_model import BodyList
 from request_examples.get_list import getList
 from schemas.extract_schema import extract_serializer_list, extract_serializer
+from schemas.vector_schema import binary_media_type, vector_response
 
 extractor_route = APIRouter(tags=["Sentence Extractor"])
 
 
+def vector_dimensions(dimensions: Annotated[Union[int, None], Query(ge=1)] = None):
+    # the vector size comes from the settings, so the bound is checked per request instead of in the query schema
+    vector_size = SettingsManager.settings.sentences_vector_size
+    if dimensions is not None and dimensions > vector_size:
+        raise RequestValidationError([{
+            "type": "less_than_equal",
+            "loc": ("query", "dimensions"),
+            "msg": f"Input should be less than or equal to {vector_size}",
+            "input": dimensions,
+            "ctx": {"le": vector_size},
+        }])
+    return dimensions
+
+
 @extractor_route.post(
         "/extractor/model",
         responses={status.HTTP_401_UNAUTHORIZED: dict(model=UnauthorizedMessage)},
         )
 async def embedded_model(
     body: ExtractorListModel,
+    accept: Annotated[Union[str, None], Header()] = None,
+    dtype: Annotated[Literal['float32', 'float16'], Query()] = 'float32',
+    dimensions: Annotated[Union[int, None], Depends(vector_dimensions)] = None,
     token_auth: str = Depends(get_token),
 ):
-    vectors = SentenceExtractor().extract(body.sentences)
+    media_type = binary_media_type(accept)
+    if media_type:
+        vectors = await SentenceExtractor().extract_async(body.sentences, return_type='np', dimensions=dimensions, dtype=dtype)
+        return vector_response(vectors, media_type, dtype)
+    vectors = await SentenceExtractor().extract_async(body.sentences, dimensions=dimensions, dtype=dtype)
     return {"vector": vectors}
 
 
@@ -33,19 +58,20 @@ async def embedded_model(
         )
 async def multiple_sentence_embedding(
     body: ExtractorListModel,
+    dtype: Annotated[Literal['float32', 'float16'], Query()] = 'float32',
+    dimensions: Annotated[Union[int, None], Depends(vector_dimensions)] = None,
     token_auth: str = Depends(get_token),
 ):
-    results = [None] * len(body.sentences)
-    new_setences = {}
-    for n, sentence in enumerate(body.sentences):
-        is_exist, source = ESFuncs.check_sentence_exists(ESIndex.EXTRACTED, sentence)
-        if is_exist:
-            results[n] = source['sentence_vector']
-        else:
-            new_setences[n] = sentence
-    vect_new_sentences = (await embedded_model(body=ExtractorListModel(sentences=list(new_setences.values()))))['vector']
-    for n, new_vect in zip(list(new_setences.keys()), vect_new_sentences):
-        results[n] = new_vect
+    sources = await AsyncESFuncs.check_sentences_exist(ESIndex.EXTRACTED, body.sentences)
+    vectors = {sentence: source['sentence_vector'] for sentence, source in sources.items()}
+    new_setences = list(dict.fromkeys(sentence for sentence in body.sentences if sentence not in vectors))
+    if new_setences:
+        vect_new_sentences = (await embedded_model(body=ExtractorListModel(sentences=new_setences)))['vector']
+        vectors.update(zip(new_setences, vect_new_sentences))
+    results = [vectors[sentence] for sentence in body.sentences]
+    if dimensions is not None or dtype != 'float32':
+        # stored vectors are full float32, they are reduced together with the new ones
+        results = SentenceExtractor.reduce(results, dimensions, dtype, return_type='ls')
     return {"result": results}
 
 
@@ -57,7 +83,10 @@ async def single_sentence_embedding(
     body: ExtractorModel,
     token_auth: str = Depends(get_token),
 ):
-    is_exist, source = ESFuncs.check_sentence_exists(ESIndex.EXTRACTED, body.sentence)
+    indexer = BulkIndexer.get(ESIndex.EXTRACTED)
+    # a sentence still buffered by the bulk indexer is not in the index yet
+    source = indexer.lookup(ESFuncs.sentence_hash(body.sentence)) if indexer else None
+    is_exist, source = (True, source) if source else await AsyncESFuncs.check_sentence_exists(ESIndex.EXTRACTED, body.sentence)
     if is_exist:
         return {"is_exist": True, "result": source}
     else:
@@ -72,9 +101,12 @@ async def single_sentence_embedding(
 async def extractor_sentence(
     body: ExtractorModel,
     background_tasks: BackgroundTasks,
+    durable: Annotated[bool, Query(description="Return once the sentence is written to Elasticsearch")] = False,
     token_auth: str = Depends(get_token),
 ):
     sentence_vector = await single_sentence_embedding(body=ExtractorModel(sentence=body.sentence))
+    sentence_hash = ESFuncs.sentence_hash(body.sentence)
+    indexer = BulkIndexer.get(ESIndex.EXTRACTED)
     if sentence_vector['is_exist']:
         sentence_vector['result']['counter'] += 1
         background_tasks.add_task(
@@ -83,18 +115,26 @@ async def extractor_sentence(
             update = {"$set": {"counter": sentence_vector['result']['counter']}}
         )
 
-        background_tasks.add_task(
-            ESFuncs.update_counter,
-            index_name=ESIndex.EXTRACTED,
-            id=sentence_vector['result']['id']
-        )
+        if indexer:
+            background_tasks.add_task(indexer.update_counter, sentence_hash)
+        else:
+            background_tasks.add_task(
+                AsyncESFuncs.update_counter,
+                index_name=ESIndex.EXTRACTED,
+                id=sentence_hash
+            )
         return sentence_vector['result']
     
     body: dict = body.model_dump()
-    _id = MGCollection.EXTRACTED.insert_one(body.copy())
+    # the record keeps the id of its Elasticsearch document, which a later change of model version would not reproduce
+    _id = MGCollection.EXTRACTED.insert_one({**body, 'sentence_hash': sentence_hash})
     body['sentence_vector'] = sentence_vector['result']
     body['id'] = str(_id.inserted_id)
-    ESFuncs.insert_es(ESIndex.EXTRACTED, body, id=body['id'])
+    document = {**body, 'sentence_hash': sentence_hash}
+    if indexer:
+        await indexer.submit(document, sentence_hash, wait=durable)
+    else:
+        await AsyncESFuncs.insert_es(ESIndex.EXTRACTED, document, id=sentence_hash)
     return body
 
 @extractor_route.get(
@@ -104,7 +144,7 @@ async def extractor_sentence(
 async def embedded_model_warmup(
     token_auth: str = Depends(get_token),
 ):
-    SentenceExtractor().extract('สวัสดีครับ')
+    await SentenceExtractor().extract_async('สวัสดีครับ')
     return {"detail": "success"}
 
 
@@ -155,7 +195,15 @@ async def delete_extractor(
     data = MGCollection.EXTRACTED.find_one({"_id": ObjectId(id)})
     if data:
         MGCollection.EXTRACTED.delete_one(filter={"_id": ObjectId(id)})
-        ESFuncs.delete_es(index_name=ESIndex.EXTRACTED, id=id)
+        sentence_hash = data.get('sentence_hash') or ESFuncs.sentence_hash(data['sentence'])
+        indexer = BulkIndexer.get(ESIndex.EXTRACTED)
+        if indexer:
+            await indexer.wait(sentence_hash)
+        deleted = await AsyncESFuncs.delete_es(index_name=ESIndex.EXTRACTED, id=sentence_hash)
+        if deleted is None:
+            # a document written before the index was migrated to hash ids is found by the record id it stores,
+            # nothing is left when the document of a merged duplicate was already deleted
+            await AsyncESFuncs.delete_by_query_es(index_name=ESIndex.EXTRACTED, body={"query": {"term": {"id.keyword": id}}})
         return {"status": True, "data": extract_serializer(data)}
     else:
         return {"status": False, "detail": "Item not found."}
@@ -1,12 +1,15 @@
 from fastapi import APIRouter, status, Depends, Query
 
 from datetime import datetime, timedelta
+import asyncio
 
 from configs.security import get_token, UnauthorizedMessage
 from configs.db import ESIndex
 from controllers.mongodb_controller import MGFuncs
-from controllers.elasticsearch_controller import ESFuncs
+from controllers.elasticsearch_controller import ESFuncs, AsyncESFuncs
 from controllers.extractor import SentenceExtractor
+from controllers.bulk_indexer import BulkIndexer
+from controllers.memory_report import MemoryReport
 from models.report_model import CalendarInterval
 
 report_route = APIRouter(tags=["Report"])
@@ -31,7 +34,7 @@ async def extractor_report(
     ),
     token_auth: str = Depends(get_token),
 ):
-    result = ESFuncs.aggregate_sentence_total_by_days(
+    result = await AsyncESFuncs.aggregate_sentence_total_by_days(
         ESIndex.EXTRACTED, 
         {
             "start_date": start_date, 
@@ -59,4 +62,22 @@ def check_dependency(token_auth: str = Depends(get_token)):
             "apm": "connected" if apm_connected else "disconnected",
             "sentence_extractor": "started" if st_started else "stopped",
         }
-    }
\ No newline at end of file
+    }
+
+
+@report_route.get(
+        "/report/performance",
+        responses={status.HTTP_401_UNAUTHORIZED: dict(model=UnauthorizedMessage)},
+        )
+async def performance_report(token_auth: str = Depends(get_token)):
+    # the inference processes answer their reports through the pool queues, the event loop does not wait for them
+    report = await asyncio.get_running_loop().run_in_executor(None, SentenceExtractor.report)
+    return {"status": True, "data": {**report, "bulk_indexer": BulkIndexer.report_all()}}
+
+
+@report_route.get(
+        "/report/memory",
+        responses={status.HTTP_401_UNAUTHORIZED: dict(model=UnauthorizedMessage)},
+        )
+def memory_report(token_auth: str = Depends(get_token)):
+    return {"status": True, "data": MemoryReport.process()}
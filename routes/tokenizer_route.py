@@ -15,5 +15,5 @@ async def tokenizer_counter(
     body: ExtractorListModel,
     token_auth: str = Depends(get_token),
 ):
-    counts = SentenceExtractor().compute_token(body.sentences)
+    counts = await SentenceExtractor().compute_token_async(body.sentences)
     return {"success": True, "token_count": counts}
\ No newline at end of file
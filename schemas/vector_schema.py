@@ -0,0 +1,34 @@
+import io
+
+import numpy as np
+from fastapi import Response
+
+BINARY_MEDIA_TYPES = ('application/octet-stream', 'application/x-npy')
+
+
+def binary_media_type(accept):
+    if not accept:
+        return None
+    for media_range in accept.split(','):
+        media_type = media_range.split(';')[0].strip().lower()
+        if media_type in BINARY_MEDIA_TYPES:
+            return media_type
+    return None
+
+
+def vector_response(vectors, media_type, dtype='float32'):
+    vectors = np.ascontiguousarray(vectors, dtype=np.dtype(dtype).newbyteorder('<'))
+    if media_type == 'application/x-npy':
+        buffer = io.BytesIO()
+        np.save(buffer, vectors, allow_pickle=False)
+        content = buffer.getvalue()
+    else:
+        content = vectors.tobytes()
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={
+            "X-Vector-Shape": ",".join(map(str, vectors.shape)),
+            "X-Vector-Dtype": vectors.dtype.name,
+        }
+    )
@@ -1,4 +1,5 @@
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
+import asyncio
 
 from configs.db import ElasticsearchConnection, ESIndex
 from configs.config import SettingsManager
@@ -10,6 +11,7 @@ class MockESSetting:
     es_version = '7.10.2'
     es_user = ''
     es_password = ''
+    es_max_connections = 25
 @patch.object(SettingsManager, 'settings', MockESSetting)
 def test_connect_elasticsearch(mock_es_client):
     ElasticsearchConnection.es_client = None
@@ -26,6 +28,43 @@ def test_connect_elasticsearch(mock_es_client):
     mock_es_client.return_value.ping.assert_called_once()
 
 
+@patch.object(SettingsManager, 'settings', MockESSetting)
+def test_elasticsearch_reconnect(mock_es_client, mock_async_es_client):
+    ElasticsearchConnection.es_client = MagicMock()
+    ElasticsearchConnection.async_es_client = MagicMock()
+    es_client = ElasticsearchConnection.reconnect()
+    assert es_client is mock_es_client.return_value
+    assert es_client is ElasticsearchConnection.es_client
+    assert ElasticsearchConnection.async_es_client is mock_async_es_client.return_value
+    mock_es_client.assert_called_once()
+    mock_async_es_client.assert_called_once()
+
+
+@patch.object(SettingsManager, 'settings', MockESSetting)
+def test_connect_async_elasticsearch(mock_async_es_client):
+    ElasticsearchConnection.async_es_client = None
+    async_es_client = ElasticsearchConnection.connect_async_elasticsearch()
+    assert async_es_client is mock_async_es_client.return_value
+    assert ElasticsearchConnection.connect_async_elasticsearch() is async_es_client
+    mock_async_es_client.assert_called_once_with(
+        host='localhost',
+        port=9200,
+        api_version='7.10.2',
+        timeout=60*60,
+        use_ssl=False,
+        maxsize=25,
+    )
+
+
+def test_close_async_elasticsearch():
+    async_es_client = MagicMock(close=AsyncMock())
+    ElasticsearchConnection.async_es_client = async_es_client
+    asyncio.run(ElasticsearchConnection.close_async_elasticsearch())
+    async_es_client.close.assert_awaited_once()
+    assert ElasticsearchConnection.async_es_client is None
+    asyncio.run(ElasticsearchConnection.close_async_elasticsearch())
+
+
 class MockESSetting:
     es_host = 'localhost'
     es_port = 9200
@@ -186,6 +225,7 @@ def test_elasticsearch_connection_already_initialized(mock_request, mock_es_clie
 
 class MockESIndexSetting:
     sentences_vector_size = 512
+    es_refresh_interval = '1s'
     @classmethod
     def model_dump(cls):
         return {
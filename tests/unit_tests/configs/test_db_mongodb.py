@@ -65,6 +65,15 @@ def test_mongo_initialization(mock_mongo_client):
     mock_mongo_client.assert_called_once()
 
 
+@patch.object(SettingsManager, 'settings', MockMongoSetting)
+def test_mongo_reconnect(mock_mongo_client):
+    MongoDBConnection.mongo_client = MagicMock()
+    mongo_conn = MongoDBConnection.reconnect()
+    assert mongo_conn is mock_mongo_client.return_value
+    assert mongo_conn is MongoDBConnection.mongo_client
+    mock_mongo_client.assert_called_once()
+
+
 class MockMongo:
     mongodb_db = 'test_db'
     @classmethod
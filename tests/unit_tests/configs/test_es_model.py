@@ -58,9 +58,10 @@ def test_elasticsearch_configs():
 
 def test_elasticsearch_index_configs(mock_settings_manager):
     mock_settings_manager.sentences_vector_size = 33
+    mock_settings_manager.es_refresh_interval = '30s'
     ElasticsearchIndexConfigs()
     expected_index_config = {
-        "settings": ElasticSearchConfigs.Settings,
+        "settings": {**ElasticSearchConfigs.Settings, "refresh_interval": '30s'},
         "mappings": {
             "properties": {
                 "id": {
@@ -91,6 +92,9 @@ def test_elasticsearch_index_configs(mock_settings_manager):
                         }
                     }
                 },
+                "sentence_hash": {
+                    "type": "keyword"
+                },
                 "sentence_vector": {
                     "type": "dense_vector",
                     "dims": 33
@@ -1,10 +1,15 @@
 import pytest
-from unittest.mock import patch
+from unittest.mock import patch, AsyncMock
 
 from configs.logger import LoggerConfig
 from configs.db import ElasticsearchConnection
 from configs.config import SettingsManager
 
+@pytest.fixture(scope='function')
+def settings():
+    SettingsManager.initialize()
+    return SettingsManager.settings
+
 @pytest.fixture(scope='function')
 def mock_settings_manager():
     with patch.object(SettingsManager, 'settings') as mock:
@@ -15,6 +20,11 @@ def mock_logger_info():
     with patch.object(LoggerConfig.logger, "info") as mock:
         yield mock
 
+@pytest.fixture(scope="function")
+def mock_logger_warning():
+    with patch.object(LoggerConfig.logger, "warning") as mock:
+        yield mock
+
 @pytest.fixture(scope="function")
 def mock_logger_error():
     with patch.object(LoggerConfig.logger, "error") as mock:
@@ -30,11 +40,21 @@ def mock_es_client():
     with patch('configs.db.Elasticsearch') as mock:
         yield mock
 
+@pytest.fixture(scope='function')
+def mock_async_es_client():
+    with patch('configs.db.AsyncElasticsearch') as mock:
+        yield mock
+
 @pytest.fixture(scope='function')
 def mock_es_client_attr():
     with patch.object(ElasticsearchConnection, 'es_client') as mock:
         yield mock
 
+@pytest.fixture(scope='function')
+def mock_async_es_client_attr():
+    with patch.object(ElasticsearchConnection, 'async_es_client', new_callable=AsyncMock) as mock:
+        yield mock
+
 @pytest.fixture(scope='function')
 def mock_apm_client():
     with patch('configs.db.ApmClient') as mock:
@@ -0,0 +1,124 @@
+import pytest
+from unittest.mock import patch, AsyncMock
+import asyncio
+
+from controllers.bulk_indexer import BulkIndexer
+from controllers.elasticsearch_controller import AsyncESFuncs
+
+
+@pytest.fixture(scope='function')
+def mock_bulk_es():
+    with patch.object(AsyncESFuncs, 'bulk_es', new_callable=AsyncMock) as mock:
+        mock.return_value = (0, [])
+        yield mock
+
+@pytest.fixture(scope='function')
+def mock_update_counter():
+    with patch.object(AsyncESFuncs, 'update_counter', new_callable=AsyncMock) as mock:
+        yield mock
+
+def sent_ids(mock_bulk_es):
+    return [[data['_id'] for data in call.args[1]] for call in mock_bulk_es.await_args_list]
+
+
+def test_flush_on_size(mock_bulk_es):
+    indexer = BulkIndexer('test_index', max_docs=2, flush_interval_ms=60000)
+    async def main():
+        await asyncio.gather(
+            indexer.submit({'sentence': 'a'}, 'a', wait=True),
+            indexer.submit({'sentence': 'b'}, 'b', wait=True),
+        )
+    asyncio.run(main())
+    mock_bulk_es.assert_awaited_once_with('test_index', [{'sentence': 'a', '_id': 'a'}, {'sentence': 'b', '_id': 'b'}], refresh=None, raise_on_error=False)
+    report = indexer.report()
+    assert (report["flushes"], report["documents"], report["pending_documents"]) == (1, 2, 0)
+
+def test_flush_on_interval(mock_bulk_es):
+    indexer = BulkIndexer('test_index', max_docs=100, flush_interval_ms=10)
+    asyncio.run(indexer.submit({'sentence': 'a'}, 'a', wait=True))
+    assert sent_ids(mock_bulk_es) == [['a']]
+
+def test_flush_on_bytes(mock_bulk_es):
+    indexer = BulkIndexer('test_index', max_docs=100, max_bytes=40, flush_interval_ms=10)
+    async def main():
+        await asyncio.gather(*(indexer.submit({'sentence': s * 10}, s, wait=True) for s in 'abc'))
+    asyncio.run(main())
+    # every document is 26 bytes, two of them do not fit in one request
+    assert sent_ids(mock_bulk_es) == [['a'], ['b'], ['c']]
+
+def test_retry_partial_failure(mock_bulk_es):
+    mock_bulk_es.side_effect = [
+        (1, [{'index': {'_id': 'b', 'status': 429, 'error': 'rejected'}}]),
+        (1, []),
+    ]
+    indexer = BulkIndexer('test_index', max_docs=2, flush_interval_ms=60000, backoff_ms=1)
+    async def main():
+        await asyncio.gather(
+            indexer.submit({'sentence': 'a'}, 'a', wait=True),
+            indexer.submit({'sentence': 'b'}, 'b', wait=True),
+        )
+    asyncio.run(main())
+    assert sent_ids(mock_bulk_es) == [['a', 'b'], ['b']]
+    assert (indexer.stats["retries"], indexer.stats["failed"]) == (1, 0)
+
+def test_non_retryable_failure(mock_bulk_es, mock_logger_error):
+    mock_bulk_es.return_value = (0, [{'index': {'_id': 'a', 'status': 400, 'error': 'mapper_parsing_exception'}}])
+    indexer = BulkIndexer('test_index', flush_interval_ms=1, backoff_ms=1)
+    with pytest.raises(RuntimeError, match='bulk indexing of document a failed: mapper_parsing_exception'):
+        asyncio.run(indexer.submit({'sentence': 'a'}, 'a', wait=True))
+    mock_bulk_es.assert_awaited_once()
+    assert indexer.stats["failed"] == 1
+    mock_logger_error.assert_called_once()
+
+def test_connection_error_retries(mock_bulk_es, mock_logger_error):
+    mock_bulk_es.side_effect = ConnectionError('refused')
+    indexer = BulkIndexer('test_index', flush_interval_ms=1, max_retries=2, backoff_ms=1)
+    with pytest.raises(RuntimeError, match='ConnectionError: refused'):
+        asyncio.run(indexer.submit({'sentence': 'a'}, 'a', wait=True))
+    assert mock_bulk_es.await_count == 3
+    assert indexer.stats["retries"] == 2
+
+def test_buffered_lookup_and_counter(mock_bulk_es, mock_update_counter):
+    indexer = BulkIndexer('test_index', flush_interval_ms=60000)
+    async def main():
+        await indexer.submit({'sentence': 'a', 'counter': 1}, 'a')
+        # the copy handed out does not change the buffered document
+        indexer.lookup('a')['counter'] = 10
+        await indexer.update_counter('a')
+        await indexer.submit({'sentence': 'a', 'counter': 5}, 'a')
+        assert indexer.lookup('a') == {'sentence': 'a', 'counter': 5}
+        assert indexer.lookup('b') is None
+        assert indexer.report()["queue_depth"] == 1
+        await indexer.close()
+        mock_update_counter.assert_not_awaited()
+        await indexer.update_counter('a')
+    asyncio.run(main())
+    assert mock_bulk_es.await_args.args[1] == [{'sentence': 'a', 'counter': 5, '_id': 'a'}]
+    mock_update_counter.assert_awaited_once_with('test_index', 'a')
+
+def test_counter_waits_for_flush(mock_bulk_es, mock_update_counter):
+    indexer = BulkIndexer('test_index', flush_interval_ms=1)
+    sent = asyncio.Event()
+    async def bulk_es(*args, **kwargs):
+        sent.set()
+        await asyncio.sleep(0.01)
+        return (1, [])
+    mock_bulk_es.side_effect = bulk_es
+    async def main():
+        await indexer.submit({'sentence': 'a', 'counter': 1}, 'a')
+        await sent.wait()
+        # the document is on its way, the counter is updated in the index once it lands
+        assert indexer.lookup('a') == {'sentence': 'a', 'counter': 1}
+        await indexer.update_counter('a')
+        assert indexer.lookup('a') is None
+    asyncio.run(main())
+    mock_update_counter.assert_awaited_once_with('test_index', 'a')
+
+def test_get(settings):
+    with patch.dict(BulkIndexer.instances, clear=True), patch.object(settings, 'es_bulk_max_docs', 7):
+        indexer = BulkIndexer.get('test_index')
+        assert BulkIndexer.get('test_index') is indexer
+        assert indexer.max_docs == 7
+        assert BulkIndexer.report_all() == {'test_index': indexer.report()}
+        with patch.object(settings, 'es_bulk_enabled', False):
+            assert BulkIndexer.get('test_index') is None
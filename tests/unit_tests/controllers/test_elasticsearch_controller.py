@@ -1,7 +1,10 @@
 import pytest
 from unittest.mock import patch
+import asyncio
 
-from controllers.elasticsearch_controller import ElasticsearchCRUD, ESFuncs
+from elasticsearch import NotFoundError
+
+from controllers.elasticsearch_controller import ElasticsearchCRUD, ESFuncs, AsyncElasticsearchCRUD, AsyncESFuncs
 
 
 class TestElasticsearchCRUD:
@@ -31,13 +34,13 @@ class TestElasticsearchCRUD:
                         "_index": "test_index",
                         "_op_type": "index",
                         "_id": "1",
-                        "_source": {"_id": "1", "field": "value1"}
+                        "_source": {"field": "value1"}
                     },
                     {
                         "_index": "test_index",
                         "_op_type": "index",
                         "_id": "2",
-                        "_source": {"_id": "2", "field": "value2"}
+                        "_source": {"field": "value2"}
                     }
                 ]
             ),
@@ -48,7 +51,7 @@ class TestElasticsearchCRUD:
                         "_index": "test_index",
                         "_op_type": "index",
                         "_id": "1",
-                        "_source": {"_id": "1", "field": "value1"}
+                        "_source": {"field": "value1"}
                     }
                 ]
             ),
@@ -103,7 +106,7 @@ class TestElasticsearchCRUD:
         assert result == expected_action
 
     @patch('controllers.elasticsearch_controller.bulk')
-    def test_bulk_es(self, mock_bulk, mock_es_client_attr, mock_logger_info):
+    def test_bulk_es(self, mock_bulk, mock_es_client_attr, mock_logger_info, settings):
         mock_bulk.return_value = (5, 0)
 
         datas = [{"_id": "1", "field": "value1"}, {"_id": "2", "field": "value2"}]
@@ -112,14 +115,40 @@ class TestElasticsearchCRUD:
         assert success == 5
         assert failed == 0
         mock_bulk.assert_called_once()
+        assert mock_bulk.call_args.kwargs == {"refresh": 'false'}
         mock_logger_info.assert_called()
 
-    def test_insert_es(self, mock_es_client_attr):
+    @patch('controllers.elasticsearch_controller.bulk')
+    def test_bulk_es_wait_for(self, mock_bulk, mock_es_client_attr, mock_logger_info, settings):
+        mock_bulk.return_value = (1, 0)
+
+        ElasticsearchCRUD.bulk_es("test_index", [{"_id": "1"}], refresh='wait_for')
+        assert mock_bulk.call_args.kwargs == {"refresh": 'wait_for'}
+
+    def test_write_refresh(self, settings):
+        assert ElasticsearchCRUD.write_refresh() == 'false'
+        assert ElasticsearchCRUD.write_refresh('wait_for') == 'wait_for'
+        with patch.object(ElasticsearchCRUD.settings, 'es_write_refresh', 'wait_for'):
+            assert ElasticsearchCRUD.write_refresh() == 'wait_for'
+            assert ElasticsearchCRUD.write_refresh(False) is False
+
+    def test_insert_es(self, mock_es_client_attr, settings):
         mock_es_client_attr.index.return_value = {"_id": "1"}
 
         result = ElasticsearchCRUD.insert_es("test_index", {"field": "value"}, id="1")
         assert result == {"_id": "1"}
-        mock_es_client_attr.index.assert_called_once_with(index="test_index", document={"field": "value"}, id="1")
+        mock_es_client_attr.index.assert_called_once_with(index="test_index", document={"field": "value"}, id="1", refresh='false')
+
+    def test_insert_es_wait_for(self, mock_es_client_attr, settings):
+        ElasticsearchCRUD.insert_es("test_index", {"field": "value"}, id="1", refresh='wait_for')
+        mock_es_client_attr.index.assert_called_once_with(index="test_index", document={"field": "value"}, id="1", refresh='wait_for')
+
+    def test_update_settings_es(self, mock_es_client_attr):
+        mock_es_client_attr.indices.put_settings.return_value = {"acknowledged": True}
+
+        result = ElasticsearchCRUD.update_settings_es("test_index", {"index": {"refresh_interval": "30s"}})
+        assert result == {"acknowledged": True}
+        mock_es_client_attr.indices.put_settings.assert_called_once_with(index="test_index", body={"index": {"refresh_interval": "30s"}})
 
     def test_update_es(self, mock_es_client_attr):
         mock_es_client_attr.update.return_value = {"_id": "1"}
@@ -135,6 +164,11 @@ class TestElasticsearchCRUD:
         assert result == {"_id": "1"}
         mock_es_client_attr.delete.assert_called_once_with(index="test_index", id="1")
 
+    def test_delete_es_not_found(self, mock_es_client_attr):
+        mock_es_client_attr.delete.side_effect = NotFoundError(404, 'not_found', {})
+
+        assert ElasticsearchCRUD.delete_es("test_index", id="1") is None
+
     def test_delete_by_query_es(self, mock_es_client_attr):
         mock_es_client_attr.delete_by_query.return_value = {"deleted": 2}
 
@@ -142,33 +176,53 @@ class TestElasticsearchCRUD:
         assert result == {"deleted": 2}
         mock_es_client_attr.delete_by_query.assert_called_once_with(index="test_index", body={"query": {"match_all": {}}})
 
+    def test_get_es(self, mock_es_client_attr):
+        mock_es_client_attr.get.return_value = {"_id": "1", "found": True}
+
+        assert ElasticsearchCRUD.get_es("test_index", "1") == {"_id": "1", "found": True}
+        mock_es_client_attr.get.assert_called_once_with(index="test_index", id="1")
+
+    def test_get_es_not_found(self, mock_es_client_attr):
+        mock_es_client_attr.get.side_effect = NotFoundError(404, 'not_found', {})
+
+        assert ElasticsearchCRUD.get_es("test_index", "1") is None
+
+    def test_mget_es(self, mock_es_client_attr):
+        mock_es_client_attr.mget.return_value = {"docs": [{"_id": "1", "found": True}, {"_id": "2", "found": False}]}
+
+        assert ElasticsearchCRUD.mget_es("test_index", ["1", "2"]) == [{"_id": "1", "found": True}, {"_id": "2", "found": False}]
+        mock_es_client_attr.mget.assert_called_once_with(index="test_index", body={"ids": ["1", "2"]})
+
     def test_search_es(self, mock_es_client_attr):
         mock_es_client_attr.search.return_value = {"hits": {"hits": [{"_id": "1"}]}}
 
         result = ElasticsearchCRUD.search_es("test_index", body={"query": {"match_all": {}}})
         assert result == {"hits": {"hits": [{"_id": "1"}]}}
         mock_es_client_attr.search.assert_called_once_with(index="test_index", body={"query": {"match_all": {}}})
+        mock_es_client_attr.indices.refresh.assert_not_called()
 
 
 class TestESFuncs:
     @patch('controllers.elasticsearch_controller.ESIndex.init_index')
     @patch('controllers.elasticsearch_controller.ElasticsearchCRUD.create_index_es', autospec=True)
-    def test_start_index_es(self, mock_create_ind, mock_index, mock_logger_info):
+    def test_start_index_es(self, mock_create_ind, mock_index, mock_es_client_attr, mock_logger_info):
         mock_index.return_value = (
             {
                 'index1': 'index1_value',
                 'index2': 'index2_value'
             },
             {
-            'index1': {'setting': 'value1'},
-            'index2': {'setting': 'value2'}
+            'index1': {'settings': {'refresh_interval': '1s'}},
+            'index2': {'settings': {'refresh_interval': '30s'}}
             }
         )
         mock_create_ind.side_effect = [True, False]
         ESFuncs.start_index_es()
 
-        mock_create_ind.assert_any_call('index1_value', {'setting': 'value1'})
-        mock_create_ind.assert_any_call('index2_value', {'setting': 'value2'})
+        mock_create_ind.assert_any_call('index1_value', {'settings': {'refresh_interval': '1s'}})
+        mock_create_ind.assert_any_call('index2_value', {'settings': {'refresh_interval': '30s'}})
+        # an index that already exists takes the configured refresh interval
+        mock_es_client_attr.indices.put_settings.assert_called_once_with(index='index2_value', body={"index": {"refresh_interval": '30s'}})
 
         mock_logger_info.assert_any_call('index1_value \033[96mCreated\033[0m :::')
         mock_logger_info.assert_any_call('index2_value Already Exists :::')
@@ -270,19 +324,158 @@ class TestESFuncs:
         mock_search_es.assert_called_once_with(index_name='test_index', **expected_query)
         assert result == {"status": True, "data": {'total_by_day': {'buckets': []}, 'total_count': {'value': 100}}}
 
-    @patch('controllers.elasticsearch_controller.ElasticsearchCRUD.search_es', autospec=True)
-    def test_check_sentence_exists(self, mock_search_es):
-        mock_search_es.return_value = {
-            'hits': {
-                'total': {'value': 1},
-                'hits': [{'_id': '1', '_source': {'sentence': 'sentence'}}]
-            }
-        }
+    def test_sentence_hash(self, settings):
+        sentence_hash = ESFuncs.sentence_hash('sentence')
+        assert len(sentence_hash) == 32
+        assert ESFuncs.sentence_hash(' sentence ') == sentence_hash
+        assert ESFuncs.sentence_hash('Sentence') != sentence_hash
+        with patch.object(ESFuncs.settings, 'model_file_name', 'other'):
+            assert ESFuncs.sentence_hash('sentence') != sentence_hash
 
-        is_exist, result = ESFuncs.check_sentence_exists('test_index', 'sentence')
+    @patch('controllers.elasticsearch_controller.ElasticsearchCRUD.get_es', autospec=True)
+    def test_check_sentence_exists(self, mock_get_es, settings):
+        mock_get_es.return_value = {'_id': ESFuncs.sentence_hash('sentence'), 'found': True, '_source': {'sentence': 'sentence'}}
 
-        expected_query = {"term": {"sentence.keyword": 'sentence'}}
+        is_exist, result = ESFuncs.check_sentence_exists('test_index', 'sentence')
 
-        mock_search_es.assert_called_once_with(index_name='test_index', query=expected_query)
+        mock_get_es.assert_called_once_with('test_index', ESFuncs.sentence_hash('sentence'))
         assert is_exist == True
-        assert result == {'sentence': 'sentence'}
\ No newline at end of file
+        assert result == {'sentence': 'sentence'}
+
+    @patch('controllers.elasticsearch_controller.ElasticsearchCRUD.get_es', autospec=True)
+    def test_check_sentence_not_exists(self, mock_get_es, settings):
+        mock_get_es.return_value = None
+        assert ESFuncs.check_sentence_exists('test_index', 'sentence') == (False, None)
+
+    @patch('controllers.elasticsearch_controller.ElasticsearchCRUD.mget_es', autospec=True)
+    def test_check_sentences_exist(self, mock_mget_es, settings):
+        mock_mget_es.return_value = [
+            {'_id': ESFuncs.sentence_hash('a'), 'found': True, '_source': {'sentence': 'a', 'sentence_vector': [1.0]}},
+            {'_id': ESFuncs.sentence_hash('b'), 'found': False},
+            {'_id': ESFuncs.sentence_hash('c'), 'found': True, '_source': {'sentence': 'c', 'sentence_vector': [3.0]}},
+        ]
+
+        result = ESFuncs.check_sentences_exist('test_index', ['a', 'b', 'a', 'c', ' c'])
+
+        mock_mget_es.assert_called_once_with('test_index', [ESFuncs.sentence_hash(s) for s in ['a', 'b', 'c']])
+        assert result == {
+            'a': {'sentence': 'a', 'sentence_vector': [1.0]},
+            'c': {'sentence': 'c', 'sentence_vector': [3.0]},
+            ' c': {'sentence': 'c', 'sentence_vector': [3.0]},
+        }
+
+    @patch('controllers.elasticsearch_controller.ElasticsearchCRUD.mget_es', autospec=True)
+    def test_check_sentences_exist_chunks(self, mock_mget_es, settings):
+        mock_mget_es.return_value = []
+        with patch.object(ESFuncs, 'MGET_CHUNK_SIZE', 2):
+            assert ESFuncs.check_sentences_exist('test_index', ['a', 'b', 'c']) == {}
+        assert [call.args[1] for call in mock_mget_es.call_args_list] == [
+            [ESFuncs.sentence_hash('a'), ESFuncs.sentence_hash('b')],
+            [ESFuncs.sentence_hash('c')],
+        ]
+        mock_mget_es.reset_mock()
+        assert ESFuncs.check_sentences_exist('test_index', []) == {}
+        mock_mget_es.assert_not_called()
+
+
+class TestAsyncElasticsearchCRUD:
+    @patch('controllers.elasticsearch_controller.async_bulk')
+    def test_bulk_es(self, mock_async_bulk, mock_async_es_client_attr, mock_logger_info, settings):
+        mock_async_bulk.return_value = (2, 0)
+
+        datas = [{"_id": "1", "field": "value1"}, {"_id": "2", "field": "value2"}]
+        assert asyncio.run(AsyncElasticsearchCRUD.bulk_es("test_index", datas, refresh='wait_for')) == (2, 0)
+        mock_async_bulk.assert_awaited_once_with(mock_async_es_client_attr, ElasticsearchCRUD.cvt_datas_to_bulk("test_index", datas), refresh='wait_for')
+
+    def test_insert_es(self, mock_async_es_client_attr, settings):
+        mock_async_es_client_attr.index.return_value = {"_id": "1"}
+
+        assert asyncio.run(AsyncElasticsearchCRUD.insert_es("test_index", {"field": "value"}, id="1")) == {"_id": "1"}
+        mock_async_es_client_attr.index.assert_awaited_once_with(index="test_index", document={"field": "value"}, id="1", refresh='false')
+
+    def test_update_es(self, mock_async_es_client_attr):
+        mock_async_es_client_attr.update.return_value = {"_id": "1"}
+
+        assert asyncio.run(AsyncElasticsearchCRUD.update_es("test_index", id="1", body={"doc": {"field": "new_value"}})) == {"_id": "1"}
+        mock_async_es_client_attr.update.assert_awaited_once_with(index="test_index", id="1", doc={"field": "new_value"})
+
+    def test_delete_es(self, mock_async_es_client_attr):
+        mock_async_es_client_attr.delete.return_value = {"_id": "1"}
+
+        assert asyncio.run(AsyncElasticsearchCRUD.delete_es("test_index", id="1")) == {"_id": "1"}
+        mock_async_es_client_attr.delete.assert_awaited_once_with(index="test_index", id="1")
+
+    def test_delete_es_not_found(self, mock_async_es_client_attr):
+        mock_async_es_client_attr.delete.side_effect = NotFoundError(404, 'not_found', {})
+
+        assert asyncio.run(AsyncElasticsearchCRUD.delete_es("test_index", id="1")) is None
+
+    def test_delete_by_query_es(self, mock_async_es_client_attr):
+        mock_async_es_client_attr.delete_by_query.return_value = {"deleted": 1}
+
+        assert asyncio.run(AsyncElasticsearchCRUD.delete_by_query_es("test_index", {"query": {"term": {"id.keyword": "1"}}})) == {"deleted": 1}
+        mock_async_es_client_attr.delete_by_query.assert_awaited_once_with(index="test_index", body={"query": {"term": {"id.keyword": "1"}}})
+
+    def test_get_es(self, mock_async_es_client_attr):
+        mock_async_es_client_attr.get.return_value = {"_id": "1", "found": True}
+        assert asyncio.run(AsyncElasticsearchCRUD.get_es("test_index", "1")) == {"_id": "1", "found": True}
+
+        mock_async_es_client_attr.get.side_effect = NotFoundError(404, 'not_found', {})
+        assert asyncio.run(AsyncElasticsearchCRUD.get_es("test_index", "1")) is None
+
+    def test_mget_es(self, mock_async_es_client_attr):
+        mock_async_es_client_attr.mget.return_value = {"docs": [{"_id": "1", "found": False}]}
+
+        assert asyncio.run(AsyncElasticsearchCRUD.mget_es("test_index", ["1"])) == [{"_id": "1", "found": False}]
+        mock_async_es_client_attr.mget.assert_awaited_once_with(index="test_index", body={"ids": ["1"]})
+
+    def test_search_es(self, mock_async_es_client_attr):
+        mock_async_es_client_attr.search.return_value = {"hits": {"hits": []}}
+
+        assert asyncio.run(AsyncElasticsearchCRUD.search_es("test_index", query={"match_all": {}})) == {"hits": {"hits": []}}
+        mock_async_es_client_attr.search.assert_awaited_once_with(index="test_index", query={"match_all": {}})
+
+
+class TestAsyncESFuncs:
+    @patch('controllers.elasticsearch_controller.AsyncElasticsearchCRUD.update_es')
+    def test_update_counter(self, mock_update_es, mock_logger_info):
+        mock_update_es.return_value = {'result': 'updated'}
+
+        assert asyncio.run(AsyncESFuncs.update_counter('test_index', '123')) == {'result': 'updated'}
+        mock_update_es.assert_awaited_once_with(index_name='test_index', id='123', body=ESFuncs.counter_script())
+
+    @patch('controllers.elasticsearch_controller.AsyncElasticsearchCRUD.search_es')
+    def test_aggregate_sentence_total_by_days(self, mock_search_es):
+        mock_search_es.return_value = {'aggregations': {'total_count': {'value': 3}}}
+        data = {'start_date': '2023-01-01', 'end_date': '2023-01-31', 'calendar_interval': 'day'}
+
+        result = asyncio.run(AsyncESFuncs.aggregate_sentence_total_by_days('test_index', data))
+        assert result == {"status": True, "data": {'total_count': {'value': 3}}}
+        mock_search_es.assert_awaited_once_with(index_name='test_index', **ESFuncs.sentence_total_by_days_query(data))
+
+    @patch('controllers.elasticsearch_controller.AsyncElasticsearchCRUD.get_es')
+    def test_check_sentence_exists(self, mock_get_es, settings):
+        mock_get_es.return_value = {'found': True, '_source': {'sentence': 'sentence'}}
+        assert asyncio.run(AsyncESFuncs.check_sentence_exists('test_index', 'sentence')) == (True, {'sentence': 'sentence'})
+        mock_get_es.assert_awaited_once_with('test_index', ESFuncs.sentence_hash('sentence'))
+
+        mock_get_es.return_value = None
+        assert asyncio.run(AsyncESFuncs.check_sentence_exists('test_index', 'sentence')) == (False, None)
+
+    @patch('controllers.elasticsearch_controller.AsyncElasticsearchCRUD.mget_es')
+    def test_check_sentences_exist(self, mock_mget_es, settings):
+        documents = {
+            ESFuncs.sentence_hash('a'): {'_id': ESFuncs.sentence_hash('a'), 'found': True, '_source': {'sentence': 'a'}},
+            ESFuncs.sentence_hash('b'): {'_id': ESFuncs.sentence_hash('b'), 'found': False},
+            ESFuncs.sentence_hash('c'): {'_id': ESFuncs.sentence_hash('c'), 'found': True, '_source': {'sentence': 'c'}},
+        }
+        mock_mget_es.side_effect = lambda index_name, ids: [documents[id] for id in ids]
+
+        with patch.object(ESFuncs, 'MGET_CHUNK_SIZE', 2):
+            result = asyncio.run(AsyncESFuncs.check_sentences_exist('test_index', ['a', 'b', 'c', 'a']))
+        assert result == {'a': {'sentence': 'a'}, 'c': {'sentence': 'c'}}
+        # the chunks are fetched concurrently
+        assert [call.args[1] for call in mock_mget_es.await_args_list] == [
+            [ESFuncs.sentence_hash('a'), ESFuncs.sentence_hash('b')],
+            [ESFuncs.sentence_hash('c')],
+        ]
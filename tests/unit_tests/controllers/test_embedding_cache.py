@@ -0,0 +1,72 @@
+import pytest
+
+import numpy as np
+
+from controllers.embedding_cache import EmbeddingCache, SentenceKey
+
+
+class TestSentenceKey:
+    @pytest.mark.parametrize(
+        "sentence, expected",
+        [
+            ("  hello  ", "hello"),
+            ("สวัสดีครับ", "สวัสดีครับ"),
+            ("é", "é"),
+        ]
+    )
+    def test_normalize(self, sentence, expected):
+        assert SentenceKey.normalize(sentence) == expected
+
+    def test_digest(self):
+        assert SentenceKey.digest("bge_m3", "hello") == SentenceKey.digest("bge_m3", " hello ")
+        assert SentenceKey.digest("bge_m3", "hello") != SentenceKey.digest("bge_m3_onnx", "hello")
+        assert len(SentenceKey.digest("bge_m3", "hello")) == 16
+
+
+class TestEmbeddingCache:
+    def test_get_put(self):
+        cache = EmbeddingCache(max_bytes=1024 * 1024)
+        assert cache.get(b"a") is None
+        cache.put(b"a", [0.1, 0.2])
+
+        vector = cache.get(b"a")
+        assert isinstance(vector, np.ndarray)
+        assert vector.dtype == np.float32
+        assert vector.tolist() == pytest.approx([0.1, 0.2])
+        assert cache.report()["hits"] == 1
+        assert cache.report()["misses"] == 1
+        assert cache.report()["hit_ratio"] == 0.5
+
+    def test_float16(self):
+        cache = EmbeddingCache(max_bytes=1024 * 1024, dtype='float16')
+        cache.put(b"a", [0.1] * 1024)
+        assert cache.get(b"a").dtype == np.float16
+        assert cache.report()["bytes"] < EmbeddingCache.entry_size(b"a", np.zeros(1024, dtype=np.float32))
+
+    def test_evict_least_recently_used(self):
+        entry_size = EmbeddingCache.entry_size(b"a", np.zeros(16, dtype=np.float32))
+        cache = EmbeddingCache(max_bytes=entry_size * 2)
+        cache.put(b"a", np.zeros(16))
+        cache.put(b"b", np.zeros(16))
+        cache.get(b"a")
+        cache.put(b"c", np.zeros(16))
+
+        assert cache.get(b"b") is None
+        assert cache.get(b"a") is not None
+        assert cache.get(b"c") is not None
+        assert cache.report()["evictions"] == 1
+        assert cache.report()["bytes"] <= cache.max_bytes
+
+    def test_replace_existing_key(self):
+        cache = EmbeddingCache(max_bytes=1024 * 1024)
+        cache.put(b"a", np.zeros(16))
+        cache.put(b"a", np.ones(16))
+        assert cache.report()["entries"] == 1
+        assert cache.report()["bytes"] == EmbeddingCache.entry_size(b"a", np.ones(16, dtype=np.float32))
+        assert cache.get(b"a").tolist() == [1.0] * 16
+
+    def test_disabled(self):
+        cache = EmbeddingCache(max_bytes=0)
+        cache.put(b"a", np.zeros(16))
+        assert cache.get(b"a") is None
+        assert cache.report()["entries"] == 0
@@ -0,0 +1,37 @@
+from unittest.mock import patch
+
+from controllers.es_migration import SentenceHashMigration
+
+
+def test_migrate(mock_es_client_attr, mock_logger_info, mock_logger_error, settings):
+    unchanged = SentenceHashMigration.sentence_hash('kept')
+    documents = [
+        {'_id': 'old-1', '_source': {'sentence': 'a', 'counter': 2}},
+        {'_id': unchanged, '_source': {'sentence': 'kept', 'counter': 1}},
+        {'_id': 'old-2', '_source': {'sentence': 'a ', 'counter': 3}},
+        {'_id': 'old-3', '_source': {'sentence': 'b', 'counter': 1}},
+    ]
+    actions = []
+    def streaming_bulk(client, generator, chunk_size, raise_on_error):
+        for action in generator:
+            actions.append(action)
+            yield action['_id'] != SentenceHashMigration.sentence_hash('b'), {"update": {"_id": action['_id']}}
+
+    with patch('controllers.es_migration.scan', return_value=iter(documents)), \
+         patch('controllers.es_migration.streaming_bulk', side_effect=streaming_bulk), \
+         patch('controllers.es_migration.bulk') as mock_bulk:
+        stats = SentenceHashMigration.migrate('test_index')
+        deletes = list(mock_bulk.call_args.args[1])
+
+    assert stats == {"scanned": 4, "rewritten": 2, "failed": 1}
+    # both spellings of the sentence land on the same document and their counters are added up
+    assert [action['_id'] for action in actions] == [SentenceHashMigration.sentence_hash('a')] * 2 + [SentenceHashMigration.sentence_hash('b')]
+    assert [action['script']['params']['counter'] for action in actions] == [2, 3, 1]
+    assert actions[0]['upsert'] == {'sentence': 'a', 'counter': 2, 'sentence_hash': SentenceHashMigration.sentence_hash('a'), 'merged_ids': ['old-1']}
+    # a repeated run skips the ids already merged into the document instead of adding their counters again
+    assert [action['script']['params']['id'] for action in actions] == ['old-1', 'old-2', 'old-3']
+    assert "merged_ids.contains(params.id)" in actions[0]['script']['source']
+    # the document that failed to rewrite is kept under its old id
+    assert [action['_id'] for action in deletes] == ['old-1', 'old-2']
+    mock_es_client_attr.indices.put_mapping.assert_called_once_with(index='test_index', body={"properties": {"sentence_hash": {"type": "keyword"}, "merged_ids": {"type": "keyword"}}})
+    mock_es_client_attr.indices.refresh.assert_called_once_with(index='test_index')
@@ -1,7 +1,16 @@
 import pytest
 from unittest.mock import MagicMock, patch
 
-from controllers.extractor import SentenceExtractor
+import asyncio
+import time
+
+import numpy as np
+
+from controllers.extractor import SentenceExtractor, MicroBatcher
+from controllers.embedding_cache import EmbeddingCache, SentenceKey
+from controllers.vector_store import VectorStore
+from controllers.inference_pool import InferencePool
+from configs.config import SettingsManager
 
 
 @pytest.fixture(scope='module')
@@ -76,7 +85,7 @@ def test_extract(mock_embedding_model):
     result = sentence_extractor.extract(list_text)
 
     assert result == expected_output
-    mock_embedding_model.encode.assert_called_once_with(list_text)
+    mock_embedding_model.encode.assert_called_once_with(list_text, return_type='np')
 
 
 def test_compute_token(mock_embedding_model):
@@ -87,4 +96,185 @@ def test_compute_token(mock_embedding_model):
     result = sentence_extractor.compute_token(sentence)
     assert result == expected_token_count
 
-    mock_embedding_model.count_tokenizer.assert_called_once_with(sentence)
\ No newline at end of file
+    mock_embedding_model.count_tokenizer.assert_called_once_with(sentence)
+
+
+def test_extract_async(mock_embedding_model):
+    sentence_extractor = SentenceExtractor()
+    sentence_extractor.cache = EmbeddingCache(max_bytes=1024 * 1024)
+    handler = MagicMock(side_effect=lambda sentences: [[float(len(s)), 0.5] for s in sentences])
+    sentence_extractor.batcher = MicroBatcher(handler)
+
+    assert asyncio.run(sentence_extractor.extract_async(['a', 'bb'])) == [[1.0, 0.5], [2.0, 0.5]]
+    assert asyncio.run(sentence_extractor.extract_async('a')) == [1.0, 0.5]
+    assert asyncio.run(sentence_extractor.extract_async([])) == []
+    handler.assert_called_once_with(['a', 'bb'])
+
+
+def test_extract_async_numpy(mock_embedding_model):
+    sentence_extractor = SentenceExtractor()
+    sentence_extractor.cache = EmbeddingCache(max_bytes=1024 * 1024, dtype='float16')
+    handler = MagicMock(side_effect=lambda sentences: np.array([[float(len(s)), 0.5] for s in sentences]))
+    sentence_extractor.batcher = MicroBatcher(handler)
+
+    result = asyncio.run(sentence_extractor.extract_async(['a', 'bb'], return_type='np'))
+    assert result.dtype == np.float32
+    assert result.tolist() == [[1.0, 0.5], [2.0, 0.5]]
+    assert asyncio.run(sentence_extractor.extract_async('a', return_type='np')).tolist() == [1.0, 0.5]
+
+
+def test_extract_async_deduplicates_misses(mock_embedding_model):
+    sentence_extractor = SentenceExtractor()
+    sentence_extractor.cache = EmbeddingCache(max_bytes=1024 * 1024)
+    handler = MagicMock(side_effect=lambda sentences: [[float(len(s))] for s in sentences])
+    sentence_extractor.batcher = MicroBatcher(handler)
+
+    result = asyncio.run(sentence_extractor.extract_async(['ccc', ' ccc', 'a', 'ccc']))
+    assert result == [[3.0], [3.0], [1.0], [3.0]]
+    handler.assert_called_once_with(['ccc', 'a'])
+    assert sentence_extractor.cache.report()["misses"] == 4
+
+
+def test_extract_async_dimensions(mock_embedding_model):
+    sentence_extractor = SentenceExtractor()
+    sentence_extractor.cache = EmbeddingCache(1024 * 1024)
+    vectors = {'a': [3.0, 4.0, 12.0], 'b': [0.0, 2.0, 0.0]}
+    with patch.object(sentence_extractor, 'batcher') as batcher:
+        batcher.submit = MagicMock(side_effect=lambda sentences: asyncio.sleep(0, [np.array(vectors[s], dtype=np.float32) for s in sentences]))
+        result = asyncio.run(sentence_extractor.extract_async(['a', 'b'], dimensions=2, dtype='float16'))
+        assert result == [pytest.approx([0.6, 0.8], abs=1e-3), [0.0, 1.0]]
+        result = asyncio.run(sentence_extractor.extract_async(['a', 'b'], return_type='np', dimensions=2))
+    assert result.dtype == np.float32
+    assert result.shape == (2, 2)
+    # the cache keeps the full vector
+    assert sentence_extractor.cache.get(SentenceKey.digest(sentence_extractor.model_version, 'a')).tolist() == [3.0, 4.0, 12.0]
+
+def test_reduce():
+    assert SentenceExtractor.reduce([[3.0, 4.0, 1.0]], return_type='ls') == [[3.0, 4.0, 1.0]]
+    assert SentenceExtractor.reduce([[3.0, 4.0, 1.0]], 2, 'float16').dtype == np.float16
+    assert SentenceExtractor.reduce([], 2).shape == (0, 2)
+
+
+def test_report():
+    sentence_extractor = SentenceExtractor()
+    sentence_extractor.batcher = MicroBatcher(MagicMock(), max_size=4)
+    sentence_extractor.model.padding_report.return_value = {"padding_ratio": 0.1}
+    sentence_extractor.model.timing_report.return_value = {"forward_seconds": 1.0}
+    sentence_extractor.model.startup_report.return_value = {"weights_seconds": 2.0}
+    assert SentenceExtractor.report() == {
+        "batcher": sentence_extractor.batcher.report(),
+        "padding": {"padding_ratio": 0.1},
+        "timings": {"forward_seconds": 1.0},
+        "startup": {"weights_seconds": 2.0},
+        "cache": sentence_extractor.cache.report(),
+        "vector_store": None,
+        "inference_pool": None,
+    }
+
+
+def test_after_fork():
+    sentence_extractor = SentenceExtractor()
+    SentenceExtractor.after_fork()
+    sentence_extractor.model.after_fork.assert_called_once()
+
+
+@patch.object(InferencePool, 'start')
+def test_initialize_inference_pool(mock_start, mock_import_module):
+    sentence_extractor = object.__new__(SentenceExtractor)
+    with patch.object(SettingsManager.settings, 'inference_processes', 3), \
+            patch.object(SettingsManager.settings, 'inference_process_threads', 2):
+        sentence_extractor._initialize()
+    mock_start.assert_called_once()
+    assert isinstance(sentence_extractor.model, InferencePool)
+    assert (sentence_extractor.model.size, sentence_extractor.model.threads) == (3, 2)
+    assert sentence_extractor.executor._max_workers == 3
+    assert sentence_extractor.batcher.concurrency == 3
+    sentence_extractor.executor.shutdown()
+
+
+def test_compute_token_async(mock_embedding_model):
+    sentence_extractor = SentenceExtractor()
+    mock_embedding_model.count_tokenizer.reset_mock()
+
+    assert asyncio.run(sentence_extractor.compute_token_async(['Hello'])) == 42
+    mock_embedding_model.count_tokenizer.assert_called_once_with(['Hello'])
+
+
+def test_extract_async_uses_vector_store(mock_embedding_model, tmp_path, mock_logger_info):
+    sentence_extractor = SentenceExtractor()
+    sentence_extractor.cache = EmbeddingCache(max_bytes=1024 * 1024)
+    sentence_extractor.store = VectorStore(str(tmp_path), "model", dim=2, max_bytes=1024)
+    handler = MagicMock(side_effect=lambda sentences: [[float(len(s)), 0.5] for s in sentences])
+    sentence_extractor.batcher = MicroBatcher(handler)
+
+    async def extract_and_persist(sentences):
+        vectors = await sentence_extractor.extract_async(sentences)
+        await asyncio.sleep(0.1)
+        return vectors
+
+    assert asyncio.run(extract_and_persist(['a', 'bb'])) == [[1.0, 0.5], [2.0, 0.5]]
+    assert sentence_extractor.store.report()["entries"] == 2
+
+    sentence_extractor.cache = EmbeddingCache(max_bytes=1024 * 1024)
+    assert asyncio.run(extract_and_persist(['bb', 'ccc'])) == [[2.0, 0.5], [3.0, 0.5]]
+    assert [call.args[0] for call in handler.call_args_list] == [['a', 'bb'], ['ccc']]
+    assert sentence_extractor.store.report()["hits"] == 1
+    sentence_extractor.store = None
+
+
+class TestMicroBatcher:
+    @staticmethod
+    async def submit_all(batcher, requests):
+        return await asyncio.gather(*(batcher.submit(sentences) for sentences in requests))
+
+    def test_coalesce_concurrent_requests(self):
+        handler = MagicMock(side_effect=lambda sentences: [f"vec_{s}" for s in sentences])
+        batcher = MicroBatcher(handler, max_size=8, max_wait_ms=50)
+
+        results = asyncio.run(self.submit_all(batcher, [['a'], ['b', 'c'], ['d']]))
+
+        assert results == [['vec_a'], ['vec_b', 'vec_c'], ['vec_d']]
+        handler.assert_called_once_with(['a', 'b', 'c', 'd'])
+        assert batcher.report()["batches"] == 1
+        assert batcher.report()["requests"] == 3
+        assert batcher.report()["last_fill_ratio"] == 0.5
+
+    def test_split_when_batch_is_full(self):
+        handler = MagicMock(side_effect=lambda sentences: [f"vec_{s}" for s in sentences])
+        batcher = MicroBatcher(handler, max_size=2, max_wait_ms=50)
+
+        results = asyncio.run(self.submit_all(batcher, [['a'], ['b'], ['c', 'd'], ['e']]))
+
+        assert results == [['vec_a'], ['vec_b'], ['vec_c', 'vec_d'], ['vec_e']]
+        assert [call.args[0] for call in handler.call_args_list] == [['a', 'b'], ['c', 'd'], ['e']]
+        assert batcher.report()["avg_fill_ratio"] == pytest.approx(5 / 6)
+
+    def test_handler_error_is_propagated(self):
+        batcher = MicroBatcher(MagicMock(side_effect=RuntimeError("model error")), max_wait_ms=1)
+
+        async def submit_twice():
+            with pytest.raises(RuntimeError):
+                await batcher.submit(['a'])
+            batcher.handler = MagicMock(return_value=['vec_b'])
+            return await batcher.submit(['b'])
+
+        assert asyncio.run(submit_twice()) == ['vec_b']
+
+
+    def test_requests_queue_while_inference_is_busy(self):
+        def slow_handler(sentences):
+            time.sleep(0.2)
+            return [f"vec_{s}" for s in sentences]
+        handler = MagicMock(side_effect=slow_handler)
+        batcher = MicroBatcher(handler, max_size=8, max_wait_ms=1)
+
+        async def submit_during_inference():
+            first = asyncio.ensure_future(batcher.submit(['a']))
+            await asyncio.sleep(0.05)
+            rest = await self.submit_all(batcher, [['b'], ['c'], ['d']])
+            return [await first, *rest]
+
+        results = asyncio.run(submit_during_inference())
+
+        assert results == [['vec_a'], ['vec_b'], ['vec_c'], ['vec_d']]
+        assert [call.args[0] for call in handler.call_args_list] == [['a'], ['b', 'c', 'd']]
@@ -0,0 +1,203 @@
+import pytest
+from unittest.mock import patch, MagicMock
+from multiprocessing.shared_memory import SharedMemory
+import threading
+import queue
+import gc
+import os
+
+import numpy as np
+
+from controllers.inference_pool import InferencePool, InferenceProcess, SharedArray
+
+
+def mock_model():
+    model = MagicMock()
+    model.encode.side_effect = lambda sentences, return_type: {"dense_vecs": np.array([[float(len(s)), 1.0] for s in sentences], dtype=np.float32)}
+    model.count_tokenizer.side_effect = lambda sentences: [len(s) for s in sentences]
+    model.padding_report.return_value = {"padding_ratio": 0.5}
+    return model
+
+class MockProcess:
+    def __init__(self, target, args, name, daemon):
+        self.index, _, _, self.requests, self.responses = args
+        self.exitcode = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        self.responses.put((('ready', self.index), 'ok', 1000 + self.index))
+        InferenceProcess.loop(mock_model(), self.requests, self.responses)
+        self.exitcode = 0
+
+    def start(self):
+        self.thread.start()
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
+@pytest.fixture(scope='function')
+def mock_context():
+    context = MagicMock()
+    context.Queue.side_effect = queue.Queue
+    context.Process.side_effect = MockProcess
+    with patch('controllers.inference_pool.multiprocessing.get_context', return_value=context):
+        yield context
+
+@pytest.fixture(scope='function')
+def pool(mock_context, mock_logger_info):
+    pool = InferencePool(2, threads=3)
+    yield pool
+    pool.close()
+
+
+def test_shared_array_roundtrip():
+    array = np.arange(12, dtype=np.float32).reshape(3, 4)
+    name, shape, dtype = SharedArray.write(array)
+    result = SharedArray.read(name, shape, dtype)
+    assert np.array_equal(result, array)
+    # the segment is unlinked once it is mapped by the reader
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=name)
+    row = result[1]
+    del result
+    gc.collect()
+    assert row.tolist() == [4.0, 5.0, 6.0, 7.0]
+
+def test_shared_array_empty():
+    assert SharedArray.write(np.zeros((0, 4), dtype=np.float32)) == (None, (0, 4), '<f4')
+    assert SharedArray.read(None, (0, 4), '<f4').shape == (0, 4)
+
+def test_inference_process_loop():
+    requests, responses = queue.Queue(), queue.Queue()
+    model = mock_model()
+    model.timing_report.side_effect = ValueError("broken")
+    for message in [(1, 'encode', (['ab', 'c'],)), (2, 'count_tokenizer', (['abc'],)), (3, 'timing_report', ()), None]:
+        requests.put(message)
+    InferenceProcess.loop(model, requests, responses)
+
+    request_id, status, payload = responses.get_nowait()
+    assert (request_id, status) == (1, 'ok')
+    assert SharedArray.read(*payload).tolist() == [[2.0, 1.0], [1.0, 1.0]]
+    assert responses.get_nowait() == (2, 'ok', [3])
+    assert responses.get_nowait() == (3, 'error', 'ValueError: broken')
+
+def test_inference_process_serve_preloaded(settings):
+    seen = {}
+    class EmbeddingModel:
+        def __init__(self):
+            seen["preload_app"] = settings.preload_app
+    requests, responses = queue.Queue(), queue.Queue()
+    requests.put(None)
+    with patch.object(settings, 'preload_app', False), patch.object(settings, 'inference_processes', 0), \
+            patch.object(settings, 'ort_intra_op_threads', 0), patch.dict(os.environ, {}), patch('torch.set_num_threads'), \
+            patch('controllers.inference_pool.importlib.import_module', return_value=MagicMock(EmbeddingModel=EmbeddingModel)):
+        # the settings of a gunicorn worker, where preload_app is on
+        InferenceProcess.serve(0, {**settings.model_dump(), 'preload_app': True, 'inference_processes': 2}, 1, requests, responses)
+
+    # a spawned process is never forked, its model has to set itself up when it is built
+    assert seen == {"preload_app": False}
+    assert responses.get_nowait() == (('ready', 0), 'ok', os.getpid())
+
+@patch('controllers.inference_pool.SettingsManager.settings')
+def test_pin_threads(mock_settings):
+    with patch.dict(os.environ, {}):
+        InferenceProcess.pin_threads(2)
+        assert all(os.environ[name] == '2' for name in InferenceProcess.THREAD_VARIABLES)
+    assert mock_settings.ort_intra_op_threads == 2
+
+def test_pool_start(pool, mock_context, mock_logger_info):
+    assert mock_context.Process.call_count == 2
+    assert mock_context.Process.call_args.kwargs['name'] == 'inference-1'
+    assert mock_context.Process.call_args.kwargs['args'][2] == 3
+    mock_logger_info.assert_called_with('[InferencePool] process 1 ready with pid 1001 and 3 threads')
+
+def test_pool_encode(pool):
+    result = pool.encode(['abc', 'd'])
+    assert isinstance(result["dense_vecs"], np.ndarray)
+    assert result["dense_vecs"].tolist() == [[3.0, 1.0], [1.0, 1.0]]
+    assert pool.encode(['ab'], return_type='ls') == {"dense_vecs": [[2.0, 1.0]]}
+    assert pool.report() == {"requests": 2, "sentences": 3, "errors": 0, "restarts": 0, "processes": 2, "threads_per_process": 3, "in_flight": [0, 0], "ready": [0, 1]}
+
+def test_pool_encode_concurrent(pool):
+    sentences = [['a' * n] * (n % 3 + 1) for n in range(1, 20)]
+    results = [None] * len(sentences)
+    def encode(n):
+        results[n] = pool.encode(sentences[n])["dense_vecs"]
+    threads = [threading.Thread(target=encode, args=(n,)) for n in range(len(sentences))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for batch, result in zip(sentences, results):
+        assert result[:, 0].tolist() == [float(len(s)) for s in batch]
+
+def test_pool_reports(pool):
+    assert pool.count_tokenizer(['ab', 'c']) == [2, 1]
+    assert pool.padding_report() == [{"padding_ratio": 0.5}, {"padding_ratio": 0.5}]
+
+def stop(process, exitcode):
+    process.requests.put(None)
+    process.join()
+    process.exitcode = exitcode
+
+def wait_ready(pool, n):
+    for _ in range(100):
+        if n in pool.ready:
+            return
+        threading.Event().wait(0.01)
+
+def test_pool_process_error(pool, mock_context, mock_logger_error):
+    dead = pool.processes[0]
+    stop(dead, -9)
+    future = pool._register('lost')
+    with pytest.raises(RuntimeError, match='inference process 0 stopped responding, exit code -9'):
+        pool._wait('lost', future, 0, dead)
+    assert 'lost' not in pool.pending
+    # the dead process is started again and takes requests once it is ready
+    mock_logger_error.assert_called_once_with('[InferencePool] process 0 exited with code -9, starting it again')
+    wait_ready(pool, 0)
+    assert pool.processes[0] is not dead
+    assert mock_context.Process.call_count == 3
+    assert pool.report()["restarts"] == 1
+    assert pool.call('count_tokenizer', ['ab'], process=0) == [2]
+
+def test_pool_routes_around_dead_process(pool, mock_context, mock_logger_error):
+    dead = pool.processes[1]
+    stop(dead, 1)
+    pool.in_flight[0] = 5
+    # the idle process 1 would take the request, it is replaced and the request goes to process 0
+    assert pool.count_tokenizer(['abc']) == [3]
+    assert pool.report()["restarts"] == 1
+    wait_ready(pool, 1)
+    assert pool.processes[1] is not dead
+    pool.in_flight[0] = 0
+
+def test_pool_no_process_running(pool):
+    pool.ready.clear()
+    with pytest.raises(RuntimeError, match='no inference process is running'):
+        pool.count_tokenizer(['a'])
+
+def test_pool_reports_skip_restarting_process(pool):
+    pool.ready.discard(1)
+    assert pool.padding_report() == [{"padding_ratio": 0.5}, None]
+
+def test_pool_starts_after_fork_when_preloaded(mock_context, mock_logger_info, settings):
+    with patch.object(settings, 'preload_app', True):
+        pool = InferencePool(2)
+    mock_context.Process.assert_not_called()
+    pool.close()
+    pool.after_fork()
+    assert mock_context.Process.call_count == 2
+    assert pool.count_tokenizer(['ab']) == [2]
+    pool.close()
+
+def test_pool_after_fork(pool, mock_context):
+    pool.after_fork()
+    assert mock_context.Process.call_count == 2
+    pool.close()
+    pool.pid = -1
+    pool.after_fork()
+    assert mock_context.Process.call_count == 4
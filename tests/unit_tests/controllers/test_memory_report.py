@@ -0,0 +1,34 @@
+from unittest.mock import patch, MagicMock
+from types import SimpleNamespace
+import os
+
+from controllers.memory_report import MemoryReport
+
+
+def mock_process(pid, rss, uss, pss):
+    process = MagicMock(pid=pid)
+    process.memory_full_info.return_value = SimpleNamespace(rss=rss, uss=uss, pss=pss)
+    return process
+
+def test_process():
+    report = MemoryReport.process(mock_process(1, 100, 40, 70))
+    assert report == {"pid": 1, "rss_bytes": 100, "uss_bytes": 40, "pss_bytes": 70, "shared_bytes": 60}
+
+def test_process_current():
+    report = MemoryReport.process()
+    assert report["pid"] == os.getpid()
+    assert 0 < report["uss_bytes"] <= report["rss_bytes"]
+
+@patch('controllers.memory_report.psutil.Process')
+def test_tree(mock_psutil_process):
+    master = mock_process(1, 300, 200, 250)
+    master.children.return_value = [mock_process(2, 300, 10, 60), mock_process(3, 300, 20, 70)]
+    mock_psutil_process.return_value = master
+
+    report = MemoryReport.tree(1)
+    mock_psutil_process.assert_called_once_with(1)
+    assert report["master"]["pid"] == 1
+    assert [worker["uss_bytes"] for worker in report["workers"]] == [10, 20]
+    assert report["total_rss_bytes"] == 900
+    assert report["total_uss_bytes"] == 230
+    assert report["total_pss_bytes"] == 380
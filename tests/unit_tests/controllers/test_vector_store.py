@@ -0,0 +1,103 @@
+import pytest
+import fcntl
+
+import numpy as np
+
+from controllers.vector_store import VectorStore
+
+
+@pytest.fixture(scope="function")
+def store(tmp_path, mock_logger_info):
+    return VectorStore(str(tmp_path), "bge_m3/model", dim=4, max_bytes=1024)
+
+def make_key(n):
+    return bytes([n]) * 16
+
+
+class TestVectorStore:
+    def test_empty_store(self, store):
+        assert store.get(make_key(1)) is None
+        assert store.report()["entries"] == 0
+        assert store.report()["misses"] == 1
+
+    def test_put_and_get(self, store):
+        written = store.put_many([make_key(1), make_key(2)], [[1, 2, 3, 4], [5, 6, 7, 8]])
+        assert written == 2
+
+        vector = store.get(make_key(2))
+        assert isinstance(vector, np.memmap)
+        assert vector.tolist() == [5, 6, 7, 8]
+        assert store.report()["rows"] == 2
+        assert store.report()["hits"] == 1
+
+    def test_skip_existing_keys(self, store):
+        store.put_many([make_key(1)], [[1, 2, 3, 4]])
+        assert store.put_many([make_key(1), make_key(1)], [[0, 0, 0, 0], [0, 0, 0, 0]]) == 0
+        assert store.get(make_key(1)).tolist() == [1, 2, 3, 4]
+
+    def test_reopen_after_restart(self, store, tmp_path):
+        store.put_many([make_key(1), make_key(2)], [[1, 2, 3, 4], [5, 6, 7, 8]])
+
+        reopened = VectorStore(str(tmp_path), "bge_m3/model", dim=4, max_bytes=1024)
+        assert reopened.report()["entries"] == 2
+        assert reopened.get(make_key(1)).tolist() == [1, 2, 3, 4]
+
+    def test_see_writes_from_other_worker(self, store, tmp_path):
+        other_worker = VectorStore(str(tmp_path), "bge_m3/model", dim=4, max_bytes=1024)
+        other_worker.put_many([make_key(3)], [[9, 9, 9, 9]])
+
+        assert store.get(make_key(3)).tolist() == [9, 9, 9, 9]
+
+    def test_lookup_skips_reload_while_writer_holds_lock(self, store, tmp_path):
+        other_worker = VectorStore(str(tmp_path), "bge_m3/model", dim=4, max_bytes=1024)
+        other_worker.put_many([make_key(3)], [[9, 9, 9, 9]])
+
+        # the lock of a writer in another process, get misses instead of waiting for it
+        with open(store.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            assert store.get(make_key(3)) is None
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        assert store.get(make_key(3)).tolist() == [9, 9, 9, 9]
+
+    def test_size_cap(self, store, mock_logger_warning):
+        keys = [make_key(n) for n in range(64)]
+        assert store.put_many(keys, np.zeros((64, 4))) == 64
+        assert store.put_many([make_key(100)], [[1, 1, 1, 1]]) == 0
+        assert store.report()["skipped_writes"] == 1
+        mock_logger_warning.assert_called_once()
+
+    def test_compact_makes_room_below_cap(self, store, mock_logger_warning):
+        assert store.put_many([make_key(n) for n in range(64)], np.zeros((64, 4))) == 64
+        assert store.put_many([make_key(100)], [[1, 1, 1, 1]]) == 0
+
+        result = store.compact()
+
+        # the default compaction keeps three quarters of the cap, the oldest rows are dropped
+        assert result == {"entries_before": 64, "entries": 48, "bytes": 768}
+        assert store.get(make_key(15)) is None
+        assert store.get(make_key(16)) is not None
+        assert store.put_many([make_key(100)], [[1, 1, 1, 1]]) == 1
+
+    def test_lookup_pairs_index_with_its_matrix(self, store, tmp_path):
+        store.put_many([make_key(1)], [[1, 2, 3, 4]])
+        index, vectors = store.mapped
+        other_worker = VectorStore(str(tmp_path), "bge_m3/model", dim=4, max_bytes=1024)
+        other_worker.put_many([make_key(2)], [[5, 6, 7, 8]])
+        store.refresh()
+
+        # a lookup that took the previous matrix skips a row appended after it
+        store.mapped = (store.mapped[0], vectors)
+        assert store.lookup(make_key(2)) is None
+        assert store.lookup(make_key(1)).tolist() == [1, 2, 3, 4]
+
+    def test_compact(self, store, tmp_path):
+        store.put_many([make_key(n) for n in range(10)], np.arange(40).reshape(10, 4))
+        reader = VectorStore(str(tmp_path), "bge_m3/model", dim=4, max_bytes=1024)
+
+        result = store.compact(max_bytes=4 * 4 * 3)
+
+        assert result == {"entries_before": 10, "entries": 3, "bytes": 48}
+        assert store.get(make_key(0)) is None
+        assert store.get(make_key(9)).tolist() == [36, 37, 38, 39]
+        assert reader.get(make_key(8)).tolist() == [32, 33, 34, 35]
+        assert reader.report()["entries"] == 3
@@ -1,7 +1,11 @@
 import pytest
 from unittest.mock import patch
+import threading
 
 import torch
+import numpy as np
+
+from huggingface_hub.utils import LocalEntryNotFoundError
 
 from model_ai.base_encoder import BaseEncoder
 
@@ -88,4 +92,212 @@ def testconvert_pt_type_large_tensor():
     assert (result == large_tensor.cpu().numpy()).all()
     
     result = encoder.convert_pt_type(large_tensor, 'ls')
-    assert result == large_tensor.cpu().numpy().tolist()
\ No newline at end of file
+    assert result == large_tensor.cpu().numpy().tolist()
+
+@pytest.mark.parametrize(
+    "lengths, batch_size, max_tokens_per_batch, expected_batches",
+    [
+        ([3, 6, 5], 2, 100, [[1, 2], [0]]),
+        ([3, 6, 5], 8, 12, [[1, 2], [0]]),
+        ([3, 6, 5], 8, 18, [[1, 2, 0]]),
+        ([8, 8, 8, 8], 8, 20, [[0, 1], [2, 3]]),
+        ([50, 2, 2], 8, 10, [[0], [1, 2]]),
+        ([], 8, 10, []),
+    ]
+)
+def test_plan_batches(lengths, batch_size, max_tokens_per_batch, expected_batches):
+    assert BaseEncoder.plan_batches(lengths, batch_size, max_tokens_per_batch) == expected_batches
+
+
+
+def test_timing_report():
+    encoder = BaseEncoder()
+    encoder.timings = {"tokenize": 1.0, "forward": 3.0, "postprocess": 0.0}
+    report = encoder.timing_report()
+    assert report["forward_seconds"] == 3.0
+    assert report["forward_share"] == 0.75
+    assert report["postprocess_share"] == 0.0
+
+def test_resolve_snapshot_local_path(tmp_path):
+    with patch('model_ai.base_encoder.snapshot_download') as mock_snapshot_download:
+        assert BaseEncoder.resolve_snapshot(str(tmp_path)) == str(tmp_path)
+    mock_snapshot_download.assert_not_called()
+
+def test_resolve_snapshot_cached(mock_settings_manager):
+    mock_settings_manager.model_revision = 'abc123'
+    with patch('model_ai.base_encoder.snapshot_download', return_value='snapshot_path') as mock_snapshot_download:
+        assert BaseEncoder.resolve_snapshot('BAAI/bge-m3') == 'snapshot_path'
+    mock_snapshot_download.assert_called_once()
+    assert mock_snapshot_download.call_args.kwargs['local_files_only'] is True
+    assert mock_snapshot_download.call_args.kwargs['revision'] == 'abc123'
+
+def test_resolve_snapshot_not_cached(mock_settings_manager, mock_logger_warning):
+    mock_settings_manager.model_revision = ''
+    with patch('model_ai.base_encoder.snapshot_download', side_effect=[LocalEntryNotFoundError('not cached'), 'snapshot_path']) as mock_snapshot_download:
+        assert BaseEncoder.resolve_snapshot('BAAI/bge-m3') == 'snapshot_path'
+    assert 'local_files_only' not in mock_snapshot_download.call_args.kwargs
+    assert mock_snapshot_download.call_args.kwargs['revision'] is None
+    mock_logger_warning.assert_called_once()
+
+def test_load_concurrently():
+    encoder = BaseEncoder()
+    tokenizer_started = threading.Event()
+    # the weights only finish once the tokenizer load has started on the other thread
+    load_weights = lambda: tokenizer_started.wait(5) and 'model'
+    load_tokenizer = lambda: tokenizer_started.set() or 'tokenizer'
+
+    assert encoder.load_concurrently(load_weights, load_tokenizer) == ('model', 'tokenizer')
+    assert set(encoder.startup_report()) == {'weights_seconds', 'tokenizer_seconds'}
+
+def test_log_startup(mock_logger_info):
+    encoder = BaseEncoder()
+    encoder.startup_timings = {'resolve': 0.5}
+    encoder.log_startup(0)
+    message = mock_logger_info.call_args.args[0]
+    assert message.startswith('[Startup] resolve=0.50s')
+    assert 'total=' in message
+
+
+def reference_lexical_weights(token_weights, input_ids, unused_tokens):
+    results = []
+    for row_weights, row_ids in zip(token_weights.tolist(), input_ids.tolist()):
+        result = {}
+        for w, idx in zip(row_weights, row_ids):
+            if idx not in unused_tokens and w > 0 and w > result.get(str(idx), 0):
+                result[str(idx)] = w
+        results.append(result)
+    return results
+
+def test_compute_lexical_weights():
+    encoder = BaseEncoder()
+    encoder.vocab_size = 100
+    torch.manual_seed(0)
+    token_weights = torch.relu(torch.randn(3, 12))
+    input_ids = torch.randint(0, 20, (3, 12))
+    input_ids[2] = 1
+    unused_tokens = [0, 1, 2, 3]
+
+    row_ids, token_ids, weights = encoder.compute_lexical_weights(token_weights, input_ids, unused_tokens)
+    result = encoder.lexical_weights_to_dict(row_ids, token_ids, weights, 3)
+
+    expected = reference_lexical_weights(token_weights, input_ids, unused_tokens)
+    assert result == expected
+    assert result[2] == {}
+
+def test_lexical_weights_to_sparse():
+    encoder = BaseEncoder()
+    encoder.vocab_size = 100
+    row_ids = torch.tensor([0, 0, 2])
+    token_ids = torch.tensor([5, 40, 7])
+    weights = torch.tensor([0.5, 0.25, 1.0])
+
+    result = encoder.lexical_weights_to_sparse(row_ids, token_ids, weights, 3)
+
+    assert len(result) == 3
+    assert all(tensor.is_coalesced() for tensor in result)
+    assert result[0].to_dense()[[5, 40]].tolist() == [0.5, 0.25]
+    assert result[1]._nnz() == 0
+    assert result[2].to_dense().sum().item() == 1.0
+
+def test_convert_pt_type_sparse():
+    encoder = BaseEncoder()
+    sparse = torch.sparse_coo_tensor(torch.tensor([[3, 9]]), torch.tensor([0.5, 0.75]), (100,))
+
+    assert encoder.convert_pt_type(sparse, 'pt') is sparse
+    result = encoder.convert_pt_type(sparse, 'np')
+    assert result["indices"].tolist() == [3, 9]
+    assert result["values"].tolist() == [0.5, 0.75]
+    assert result["shape"] == (100,)
+    assert encoder.convert_pt_type(sparse, 'ls') == {"indices": [3, 9], "values": [0.5, 0.75], "shape": [100]}
+
+def test_pack_token_vectors():
+    encoder = BaseEncoder()
+    token_vectors = torch.randn(2, 4, 8)
+    mask = torch.tensor([[1, 1, 0, 0], [1, 1, 1, 0]])
+
+    vectors, offsets = encoder.pack_token_vectors(token_vectors, mask)
+    rows = encoder.split_packed(vectors, offsets, 'np')
+
+    assert vectors.shape == (5, 8)
+    assert offsets.tolist() == [0, 2, 5]
+    for row, expected, count in zip(rows, token_vectors, [2, 3]):
+        assert np.allclose(row, torch.nn.functional.normalize(expected[:count], dim=-1).numpy(), atol=1e-6)
+    assert rows[0].base is rows[1].base
+    assert [len(row) for row in encoder.split_packed(vectors, offsets, 'ls')] == [2, 3]
+
+def test_pack_rows():
+    rows = [np.ones((2, 3), dtype=np.float32), np.zeros((1, 3), dtype=np.float32)]
+
+    result = BaseEncoder.pack_rows(rows, 'np')
+    assert result["vectors"].shape == (3, 3)
+    assert result["offsets"].tolist() == [0, 2, 3]
+
+    result = BaseEncoder.pack_rows([row.tolist() for row in rows], 'ls')
+    assert len(result["vectors"]) == 3
+    assert result["offsets"] == [0, 2, 3]
+
+def test_compute_lexical_weights_np():
+    encoder = BaseEncoder()
+    encoder.vocab_size = 100
+    torch.manual_seed(0)
+    token_weights = torch.relu(torch.randn(3, 12))
+    input_ids = torch.randint(0, 20, (3, 12))
+    unused_tokens = [0, 1, 2, 3]
+
+    row_ids, token_ids, weights = encoder.compute_lexical_weights_np(token_weights.numpy(), input_ids.numpy(), unused_tokens)
+    result = encoder.lexical_weights_to_dict(row_ids, token_ids, weights, 3)
+
+    assert result == reference_lexical_weights(token_weights, input_ids, unused_tokens)
+
+def test_lexical_weights_to_coo():
+    encoder = BaseEncoder()
+    encoder.vocab_size = 100
+    row_ids, token_ids, weights = np.array([0, 0, 2]), np.array([5, 40, 7]), np.array([0.5, 0.25, 1.0], dtype=np.float32)
+
+    result = encoder.lexical_weights_to_coo(row_ids, token_ids, weights, 3, 'ls')
+    assert result == [
+        {"indices": [5, 40], "values": [0.5, 0.25], "shape": [100]},
+        {"indices": [], "values": [], "shape": [100]},
+        {"indices": [7], "values": [1.0], "shape": [100]},
+    ]
+    result = encoder.lexical_weights_to_coo(row_ids, token_ids, weights, 3, 'pt')
+    assert result[0].to_dense()[[5, 40]].tolist() == [0.5, 0.25]
+
+def test_pack_token_vectors_np():
+    token_vectors = torch.randn(2, 4, 8)
+    mask = torch.tensor([[1, 1, 0, 0], [1, 1, 1, 0]])
+
+    expected_vectors, expected_offsets = BaseEncoder.pack_token_vectors(token_vectors, mask)
+    vectors, offsets = BaseEncoder.pack_token_vectors_np(token_vectors.numpy(), mask.numpy())
+
+    assert np.allclose(vectors, expected_vectors.numpy(), atol=1e-6)
+    assert offsets.tolist() == expected_offsets.tolist()
+
+def test_convert_np_type():
+    encoder = BaseEncoder()
+    array = np.array([[1.0, 2.0]], dtype=np.float32)
+
+    assert encoder.convert_np_type(array, 'np') is array
+    assert encoder.convert_np_type(array, 'ls') == [[1.0, 2.0]]
+    assert torch.equal(encoder.convert_np_type(array, 'pt'), torch.tensor([[1.0, 2.0]]))
+    with pytest.raises(TypeError):
+        encoder.convert_np_type([1.0], 'np')
+    with pytest.raises(ValueError):
+        encoder.convert_np_type(array, 'invalid')
+
+def test_convert_dtype():
+    encoder = BaseEncoder()
+    assert encoder.convert_np_type(np.array([[1.0, 2.0]], dtype=np.float32), 'np', 'float16').dtype == np.float16
+    assert encoder.convert_pt_type(torch.tensor([[1.0, 2.0]]), 'pt', 'float16').dtype == torch.float16
+    assert encoder.convert_pt_type(torch.tensor([[1.0, 2.0]]), 'ls', 'float16') == [[1.0, 2.0]]
+
+def test_truncate_np():
+    vectors = np.array([[3.0, 4.0, 12.0], [1.0, 0.0, 5.0]], dtype=np.float32)
+
+    assert BaseEncoder.truncate_np(vectors) is vectors
+    assert np.allclose(BaseEncoder.truncate_np(vectors, 2), [[0.6, 0.8], [1.0, 0.0]])
+    assert BaseEncoder.truncate_np(vectors, 2, normalize=False).tolist() == [[3.0, 4.0], [1.0, 0.0]]
+    assert BaseEncoder.truncate_np(vectors, 3, normalize=False).tolist() == vectors.tolist()
+    for dimensions in (0, 4):
+        with pytest.raises(ValueError, match='dimensions should be between 1 and 3'):
+            BaseEncoder.truncate_np(vectors, dimensions)
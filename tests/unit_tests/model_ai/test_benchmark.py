@@ -0,0 +1,55 @@
+import pytest
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+
+from configs.config import SettingsManager
+from model_ai.benchmark import ModelBenchmark
+
+def test_cosine_agreement():
+    baseline = np.array([[1.0, 0.0], [0.0, 2.0]])
+    candidate = np.array([[2.0, 0.0], [1.0, 1.0]])
+
+    result = ModelBenchmark.cosine_agreement(baseline, candidate)
+    assert result["min"] == pytest.approx(np.sqrt(0.5))
+    assert result["mean"] == pytest.approx((1 + np.sqrt(0.5)) / 2)
+
+def test_summarize_latency():
+    result = ModelBenchmark.summarize_latency([0.1, 0.2, 0.3])
+    assert result["mean_seconds"] == pytest.approx(0.2)
+    assert result["p50_seconds"] == pytest.approx(0.2)
+
+def test_apply_overrides():
+    SettingsManager.initialize()
+    settings = SettingsManager.settings.model_copy()
+    ModelBenchmark.apply_overrides(settings, {"ort_intra_op_threads": "4", "ort_arena_shrinkage": "true", "model_file_name": "bge_m3_onnx_o2_int8"})
+    assert settings.ort_intra_op_threads == 4
+    assert settings.ort_arena_shrinkage is True
+    assert settings.model_file_name == "bge_m3_onnx_o2_int8"
+
+def test_parse_overrides():
+    assert ModelBenchmark.parse_overrides(None) == {}
+    assert ModelBenchmark.parse_overrides(["model_file_name=a=b", "device=cpu"]) == {"model_file_name": "a=b", "device": "cpu"}
+
+def test_compare():
+    def run_variant(overrides, sentences, repeats, batch_size):
+        scale = 1.0 if overrides.get("model_file_name") == "fp32" else 2.0
+        return {
+            "overrides": overrides,
+            "vectors": np.ones((len(sentences), 4)) * scale,
+            "latency": {"p50_seconds": scale},
+            "rss_bytes": int(100 * scale),
+            "model_rss_bytes": int(10 * scale),
+        }
+
+    with patch('model_ai.benchmark.ProcessPoolExecutor') as mock_executor:
+        mock_executor.return_value.__enter__.return_value.submit.side_effect = lambda fn, *args: MagicMock(**{'result.return_value': run_variant(*args)})
+        report = ModelBenchmark.compare({"model_file_name": "fp32"}, {"model_file_name": "int8"}, sentences=["a", "b"])
+
+    assert report["sentences"] == 2
+    assert report["cosine"]["mean"] == pytest.approx(1.0)
+    assert report["delta"] == {"latency_p50_seconds": 1.0, "latency_ratio": 2.0, "throughput_ratio": 0.5, "rss_bytes": 100, "model_rss_bytes": 10}
+    assert "vectors" not in report["baseline"]
+    # neither variant loads the optimized graph saved for the served model
+    assert report["baseline"]["overrides"] == {"model_file_name": "fp32", "ort_optimized_model_path": ""}
+    assert report["candidate"]["overrides"] == {"model_file_name": "int8", "ort_optimized_model_path": ""}
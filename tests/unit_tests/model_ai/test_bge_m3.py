@@ -4,6 +4,7 @@ from unittest.mock import patch, MagicMock
 import torch
 import numpy as np
 
+from configs.config import SettingsManager
 from model_ai.bge_m3 import EmbeddingModel
 
 @pytest.fixture(scope='module')
@@ -24,7 +25,7 @@ def embedding_model_path_exist():
 
 @pytest.fixture(scope='module')
 def embedding_model_path_not_exist():
-    with patch('model_ai.bge_m3.snapshot_download') as MockSnapshotDownload, \
+    with patch('model_ai.base_encoder.snapshot_download') as MockSnapshotDownload, \
         patch('transformers.AutoModel.from_pretrained') as MockAutoModel, \
         patch('transformers.AutoTokenizer.from_pretrained') as MockAutoTokenizer, \
         patch('os.path.exists') as MockPathExists, \
@@ -45,14 +46,85 @@ class TestEmbeddingModel:
         model = EmbeddingModel()
         assert model.model is not None
         assert model.tokenizer is not None
+        assert model.pooler_loaded is False
+        assert mock_logger_info.call_args.args[0].startswith('[Startup] resolve=')
+        model.ensure_pooler()
         mock_logger_info.assert_called_with('loading existing colbert_linear and sparse_linear')
 
     def test_initialization_path_not_exist(self, embedding_model_path_not_exist, mock_logger_error):
         model = EmbeddingModel()
         assert model.model is not None
         assert model.tokenizer is not None
+        model.ensure_pooler()
         mock_logger_error.assert_called_once_with('The parameters of colbert_linear and sparse linear is new initialize. Make sure the model is loaded for training, not inferencing')
     
+    def test_ensure_pooler_loads_once(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        with patch.object(model, 'load_pooler') as mock_load_pooler:
+            model.ensure_pooler()
+            model.ensure_pooler()
+        mock_load_pooler.assert_called_once()
+        assert model.pooler_loaded is True
+
+    def test_ensure_pooler_disabled(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        with patch.object(SettingsManager.settings, 'pooler_heads_enabled', False), \
+            patch.object(model, 'load_pooler') as mock_load_pooler:
+            with pytest.raises(ValueError):
+                model._encode({}, return_dense=True, return_sparse=True, return_colbert=False)
+        mock_load_pooler.assert_not_called()
+
+    @pytest.mark.parametrize(
+        "precision, device, cpu_capability, expected",
+        [
+            ('fp32', 'cpu', 'AVX512', 'fp32'),
+            ('int8', 'cpu', 'AVX2', 'int8'),
+            ('int8', 'cuda', 'AVX512', 'fp32'),
+            ('bf16', 'cpu', 'AVX512', 'bf16'),
+            ('bf16', 'cpu', 'AVX2', 'fp32'),
+        ]
+    )
+    def test_apply_precision(self, precision, device, cpu_capability, expected, embedding_model_path_exist):
+        model = EmbeddingModel()
+        model.device = device
+        original_model = model.model
+        with patch('model_ai.bge_m3.torch.ao.quantization.quantize_dynamic') as mock_quantize, \
+            patch('model_ai.bge_m3.torch.backends.cpu.get_cpu_capability', return_value=cpu_capability):
+            assert model.apply_precision(precision) == expected
+
+        if expected == 'int8':
+            assert mock_quantize.call_args.args[0] is original_model
+            assert model.model is mock_quantize.return_value
+        else:
+            mock_quantize.assert_not_called()
+            assert model.model is original_model
+
+    def test_preload_applies_precision_after_fork(self, embedding_model_path_exist):
+        with patch.object(SettingsManager.settings, 'preload_app', True), \
+            patch.object(SettingsManager.settings, 'torch_cpu_precision', 'int8'), \
+            patch.object(EmbeddingModel, 'apply_precision', return_value='int8') as mock_apply_precision:
+            model = EmbeddingModel()
+            assert model.precision is None
+            mock_apply_precision.assert_not_called()
+
+            model.after_fork()
+            model.after_fork()
+        assert model.precision == 'int8'
+        mock_apply_precision.assert_called_once_with('int8')
+
+    def test_apply_precision_bf16_without_cpu_capability(self, embedding_model_path_exist, mock_logger_warning):
+        model = EmbeddingModel()
+        model.device = 'cpu'
+        # torch 2.0 has no torch.backends.cpu
+        with patch('model_ai.bge_m3.torch.backends.cpu', None):
+            assert model.apply_precision('bf16') == 'fp32'
+        assert 'cannot report the cpu capability' in mock_logger_warning.call_args.args[0]
+
+    def test_apply_precision_invalid(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        with pytest.raises(ValueError):
+            model.apply_precision('fp8')
+
     @pytest.mark.parametrize(
         "sentence_pooling_method, normlized, return_type",
         [
@@ -80,6 +152,20 @@ class TestEmbeddingModel:
         for r in result:
             assert len(r) == 1024
 
+    def test_dense_embedding_dimensions(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        mock_hidden_state = torch.randn(2, 5, 1024)
+        mock_mask = torch.ones(2, 5, dtype=torch.bool)
+
+        full = model.dense_embedding(mock_hidden_state, mock_mask, return_type='pt')
+        result = model.dense_embedding(mock_hidden_state, mock_mask, return_type='pt', dimensions=512, dtype='float16')
+
+        assert result.shape == (2, 512)
+        assert result.dtype == torch.float16
+        assert torch.allclose(result.float(), torch.nn.functional.normalize(full[:, :512], dim=-1), atol=1e-3)
+        with pytest.raises(ValueError):
+            model.dense_embedding(mock_hidden_state, mock_mask, dimensions=2048)
+
     @patch('os.path.exists', return_value=True)
     @pytest.mark.parametrize(
         "return_embedding",
@@ -90,6 +176,7 @@ class TestEmbeddingModel:
     )
     def test_sparse_embedding(self, mock_path_exists, return_embedding, embedding_model_path_exist):
         model = EmbeddingModel()
+        model.ensure_pooler()
         mock_hidden_state = torch.randn(2, 5, 1024).to(model.device)
         mock_input_ids = torch.tensor([[0, 1, 2, 10, 12], [3, 4, 5, 50, 3]]).to(model.device)
 
@@ -109,6 +196,31 @@ class TestEmbeddingModel:
             assert isinstance(result, list)
             assert len(result) == 2
 
+    @patch('os.path.exists', return_value=True)
+    def test_sparse_embedding_coo(self, mock_path_exists, embedding_model_path_exist):
+        model = EmbeddingModel()
+        model.ensure_pooler()
+        mock_hidden_state = torch.randn(2, 5, 1024).to(model.device)
+        mock_input_ids = torch.tensor([[0, 1, 2, 10, 12], [3, 4, 5, 50, 3]]).to(model.device)
+
+        with patch('torch.relu') as mock_torch_relu:
+            mock_torch_relu.return_value = torch.rand(2, 5, 1)
+            model.vocab_size = 100
+            model.tokenizer.cls_token_id = 0
+            model.tokenizer.eos_token_id = 1
+            model.tokenizer.pad_token_id = 2
+            model.tokenizer.unk_token_id = 3
+            dense = model.sparse_embedding(mock_hidden_state, mock_input_ids, return_type='pt')
+            coo = model.sparse_embedding(mock_hidden_state, mock_input_ids, return_type='pt', sparse_format='coo')
+            compact = model.sparse_embedding(mock_hidden_state, mock_input_ids, return_type='ls', sparse_format='coo')
+
+        assert len(coo) == 2
+        assert all(row.is_sparse and row.size() == (100,) for row in coo)
+        assert torch.equal(torch.stack([row.to_dense() for row in coo]), dense)
+        assert compact[0]["indices"] == [10, 12]
+        assert compact[1]["indices"] == [4, 5, 50]
+        assert compact[0]["shape"] == [100]
+
     def test_colbert_embedding(self, embedding_model_path_exist):
         model = EmbeddingModel()
         mock_last_hidden_state = torch.randn(2, 5, 1024) 
@@ -209,49 +321,24 @@ class TestEmbeddingModel:
             assert type(colbert_vecs) is expect_colbert
 
     @pytest.mark.parametrize(
-        "sentences, mock_tokenizer, mock_dense",
+        "sentences, lengths, expected_batches",
         [
-            (
-                ["fs", "asdd"],
-                [
-                    MagicMock(return_value={
-                        'input_ids': torch.zeros(2, 5, dtype=torch.long),
-                        'attention_mask': torch.ones(2, 5, dtype=torch.bool)
-                    })
-                ],
-                [torch.randn(2, 1024)],
-            ), 
-            (
-                ["fs", "asdd", "asd"],
-                [
-                    MagicMock(return_value={
-                        'input_ids': torch.zeros(2, 5, dtype=torch.long),
-                        'attention_mask': torch.ones(2, 5, dtype=torch.bool)
-                    }),
-                    MagicMock(return_value={
-                        'input_ids': torch.zeros(1, 5, dtype=torch.long),
-                        'attention_mask': torch.ones(1, 5, dtype=torch.bool)
-                    })
-                ],
-                [torch.randn(2, 1024), torch.randn(1, 1024)],
-            ), 
-            (
-                "asd",
-                [
-                    MagicMock(return_value={
-                        'input_ids': torch.zeros(1, 5, dtype=torch.long),
-                        'attention_mask': torch.ones(1, 5, dtype=torch.bool)
-                    })
-                ],
-                [torch.randn(1, 1024)],
-            )
+            (["fs", "asdd"], [3, 5], [[1, 0]]),
+            (["fs", "asdd", "asd"], [3, 6, 5], [[1, 2], [0]]),
+            (["fs", "asdd", "asd"], [5, 3, 5], [[0, 2], [1]]),
+            ("asd", [4], [[0]]),
         ]
     )
-    def test_encode(self, sentences, mock_tokenizer, mock_dense, embedding_model_path_exist):
+    def test_encode(self, sentences, lengths, expected_batches, embedding_model_path_exist):
         model = EmbeddingModel()
-        model.tokenizer.side_effect = mock_tokenizer
+        model.tokenizer = MagicMock()
+        model.tokenizer.return_value = {
+            'input_ids': [[n] * length for n, length in enumerate(lengths)],
+            'attention_mask': [[1] * length for length in lengths]
+        }
+        model.tokenizer.pad.side_effect = lambda features, **kwargs: MagicMock(**{'to.return_value': features})
         model._encode = MagicMock()
-        model._encode.side_effect = [(dense, dense, dense) for dense in mock_dense]
+        model._encode.side_effect = lambda token, **kwargs: ([ids[0] for ids in token['input_ids']],) * 3
         result = model.encode(
             sentences, 
             return_dense=True, 
@@ -260,18 +347,54 @@ class TestEmbeddingModel:
             return_type='pt',
             batch_size=2
         )
-        if isinstance(sentences, str):
-            assert type(result['dense_vecs']) is torch.Tensor
-        else:
-            assert type(result['dense_vecs']) is list
-        if isinstance(sentences, str):
-            assert type(result['lexical_weights']) is torch.Tensor
-        else:
-            assert type(result['lexical_weights']) is list
-        if isinstance(sentences, str):
-            assert type(result['colbert_vecs']) is torch.Tensor
-        else:
-            assert type(result['colbert_vecs']) is list
+
+        batches = [[ids[0] for ids in call.args[0]['input_ids']] for call in model._encode.call_args_list]
+        assert batches == expected_batches
+        expected = 0 if isinstance(sentences, str) else list(range(len(sentences)))
+        assert result['dense_vecs'] == expected
+        assert result['lexical_weights'] == expected
+        assert result['colbert_vecs'] == expected
+
+    def test_encode_padding_report(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        model.tokenizer = MagicMock()
+        model.tokenizer.return_value = {
+            'input_ids': [[1] * 3, [1] * 6, [1] * 5],
+            'attention_mask': [[1] * 3, [1] * 6, [1] * 5]
+        }
+        model._encode = MagicMock(return_value=([None] * 2, None, None))
+        model.encode(["fs", "asdd", "asd"], batch_size=2)
+
+        report = model.padding_report()
+        assert report["real_tokens"] == 14
+        assert report["padded_tokens"] == 15
+        assert report["unsorted_padded_tokens"] == 17
+        assert report["padding_ratio"] == pytest.approx(1 / 15)
+
+    def test_encode_colbert_packed(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        model.tokenizer = MagicMock()
+        model.tokenizer.return_value = {
+            'input_ids': [[0] * 3, [1] * 5],
+            'attention_mask': [[1] * 3, [1] * 5]
+        }
+        model.tokenizer.pad.side_effect = lambda features, **kwargs: MagicMock(**{'to.return_value': features})
+        model._encode = MagicMock()
+        model._encode.side_effect = lambda token, **kwargs: (None, None, [np.full((len(ids) - 2, 4), ids[0], dtype=np.float32) for ids in token['input_ids']])
+        result = model.encode(["fs", "asdd"], return_dense=False, return_colbert=True, return_type='np', colbert_format='packed')
+
+        packed = result['colbert_vecs']
+        assert packed['vectors'].shape == (4, 4)
+        assert packed['offsets'].tolist() == [0, 1, 4]
+        assert packed['vectors'][:1].tolist() == [[0.0] * 4]
+        assert (packed['vectors'][1:] == 1).all()
+
+    def test_encode_empty(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        model._encode = MagicMock()
+        result = model.encode([])
+        assert result == {"dense_vecs": [], "lexical_weights": None, "colbert_vecs": None}
+        model._encode.assert_not_called()
 
     def test_count_tokenizer(self, embedding_model_path_exist):
         model = EmbeddingModel()
@@ -1,58 +1,124 @@
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, mock_open
+from types import SimpleNamespace
+from contextlib import ExitStack
+import sys
 
 import torch
 import numpy as np
 
 from model_ai.bge_m3_onnx import EmbeddingModel
 
-@pytest.fixture(scope='module')
+HIDDEN_SIZE = 1024
+
+def mock_heads():
+    rng = np.random.default_rng(0)
+    return {
+        'colbert_weight': rng.standard_normal((HIDDEN_SIZE, HIDDEN_SIZE), dtype=np.float32),
+        'colbert_bias': rng.standard_normal(HIDDEN_SIZE, dtype=np.float32),
+        'sparse_weight': rng.standard_normal((HIDDEN_SIZE, 1), dtype=np.float32),
+        'sparse_bias': rng.standard_normal(1, dtype=np.float32),
+    }
+
+def mock_model_files(path_exists, output_names=('last_hidden_state',), metadata=None):
+    session = MagicMock()
+    session.get_inputs.return_value = [SimpleNamespace(name='input_ids'), SimpleNamespace(name='attention_mask')]
+    session.get_outputs.return_value = [SimpleNamespace(name=name) for name in output_names]
+    session.get_modelmeta.return_value.custom_metadata_map = metadata or {}
+    return patch('model_ai.base_encoder.snapshot_download', return_value='mocked_model_path'), \
+        patch('model_ai.bge_m3_onnx.ort.InferenceSession', return_value=session), \
+        patch('model_ai.bge_m3_onnx.FastTokenizer.from_pretrained', return_value=MagicMock()), \
+        patch('model_ai.bge_m3_onnx.OrtSessionProfile.find_model', return_value='model.onnx'), \
+        patch('model_ai.bge_m3_onnx.open', mock_open(read_data='{"vocab_size": 100, "hidden_size": 1024}'), create=True), \
+        patch('model_ai.bge_m3_onnx.os.path.exists', return_value=path_exists), \
+        patch('model_ai.bge_m3_onnx.np.load', return_value=mock_heads())
+
+@pytest.fixture(scope='function')
 def embedding_model_path_exist():
-    with patch('model_ai.bge_m3_onnx.snapshot_download') as MockSnapshotDownload, \
-        patch('optimum.onnxruntime.ORTModelForFeatureExtraction.from_pretrained') as MockAutoModel, \
-        patch('transformers.AutoTokenizer.from_pretrained') as MockAutoTokenizer, \
-        patch('os.path.exists') as MockPathExists, \
-        patch('torch.load') as MockTorchLoad, \
-        patch('torch.nn.Linear') as MockLinear:
-        
-        MockPathExists.return_value = True
-        MockTorchLoad.return_value = MagicMock()
-        MockSnapshotDownload = MagicMock()
-        MockSnapshotDownload.return_value = 'mocked_model_path'
-        MockAutoModel.return_value = MagicMock()
-        MockAutoTokenizer.return_value = MagicMock()
-        yield 
-
-@pytest.fixture(scope='module')
+    with ExitStack() as stack:
+        for p in mock_model_files(True):
+            stack.enter_context(p)
+        yield
+
+@pytest.fixture(scope='function')
 def embedding_model_path_not_exist():
-    with patch('model_ai.bge_m3_onnx.snapshot_download') as MockSnapshotDownload, \
-        patch('optimum.onnxruntime.ORTModelForFeatureExtraction.from_pretrained') as MockAutoModel, \
-        patch('transformers.AutoTokenizer.from_pretrained') as MockAutoTokenizer, \
-        patch('os.path.exists') as MockPathExists, \
-        patch('torch.load') as MockTorchLoad, \
-        patch('torch.nn.Linear') as MockLinear:
-        
-        MockPathExists.return_value = False
-        MockTorchLoad.return_value = MagicMock()
-        MockSnapshotDownload = MagicMock()
-        MockSnapshotDownload.return_value = 'mocked_model_path'
-        MockAutoModel.return_value = MagicMock()
-        MockAutoTokenizer.return_value = MagicMock()
-        yield 
+    with ExitStack() as stack:
+        for p in mock_model_files(False):
+            stack.enter_context(p)
+        yield
+
+@pytest.fixture(scope='function')
+def embedding_model_fused_heads():
+    with ExitStack() as stack:
+        for p in mock_model_files(True, EmbeddingModel.HEAD_OUTPUTS, {'sentence_pooling_method': 'cls', 'normlized': 'True'}):
+            stack.enter_context(p)
+        yield
 
 class TestEmbeddingModel:
     def test_initialization(self, embedding_model_path_exist, mock_logger_info):
         model = EmbeddingModel()
         assert model.model is not None
         assert model.tokenizer is not None
+        assert model.vocab_size == 100
+        assert model.input_names == ['input_ids', 'attention_mask']
+        assert not hasattr(model, 'colbert_weight')
+        model.ensure_pooler()
+        assert model.colbert_weight.shape == (HIDDEN_SIZE, HIDDEN_SIZE)
         mock_logger_info.assert_called_with('loading existing colbert_linear and sparse_linear')
-    
+
     def test_initialization_path_not_exist(self, embedding_model_path_not_exist, mock_logger_error):
         model = EmbeddingModel()
         assert model.model is not None
         assert model.tokenizer is not None
+        model.ensure_pooler()
         mock_logger_error.assert_called_once_with('The parameters of colbert_linear and sparse linear is new initialize. Make sure the model is loaded for training, not inferencing')
-    
+
+    def test_after_fork(self, embedding_model_path_exist, mock_logger_info):
+        model = EmbeddingModel()
+        parent_session = model.model
+        with patch('model_ai.bge_m3_onnx.ort.InferenceSession', return_value=MagicMock()) as mock_session:
+            model.after_fork()
+        assert model.model is mock_session.return_value
+        # the session of the master is never freed in the worker
+        assert model.parent_session is parent_session
+        mock_session.assert_called_once()
+        assert mock_session.call_args.args[0].endswith('model.onnx')
+
+    def test_preload_opens_session_after_fork(self, embedding_model_path_exist, mock_logger_info, settings):
+        with patch.object(settings, 'preload_app', True):
+            model = EmbeddingModel()
+        assert model.model is None
+        assert model.input_names == ['input_ids', 'attention_mask']
+        with patch('model_ai.bge_m3_onnx.ort.InferenceSession', return_value=MagicMock()) as mock_session:
+            model.after_fork()
+        assert model.model is mock_session.return_value
+        assert not hasattr(model, 'parent_session')
+
+    def test_initialization_fused_heads(self, embedding_model_fused_heads, mock_logger_info):
+        model = EmbeddingModel()
+        assert model.fused_heads is True
+        assert not hasattr(model, 'colbert_weight')
+        assert model.run_options.only_execute_path_to_fetches is True
+        mock_logger_info.assert_any_call('colbert_linear and sparse_linear are part of the ONNX graph')
+
+    def test_initialization_fused_heads_pooling_mismatch(self, embedding_model_fused_heads):
+        with pytest.raises(ValueError):
+            EmbeddingModel(sentence_pooling_method='mean')
+
+    def test_export_heads(self, tmp_path, mock_logger_warning):
+        colbert = torch.nn.Linear(8, 8)
+        sparse = torch.nn.Linear(8, 1)
+        torch.save(colbert.state_dict(), tmp_path / 'colbert_linear.pt')
+        torch.save(sparse.state_dict(), tmp_path / 'sparse_linear.pt')
+
+        heads = EmbeddingModel.export_heads(str(tmp_path), str(tmp_path / EmbeddingModel.HEADS_FILE))
+        hidden_state = torch.randn(3, 8)
+        with torch.no_grad():
+            assert np.allclose(hidden_state.numpy() @ heads['colbert_weight'] + heads['colbert_bias'], colbert(hidden_state).numpy(), atol=1e-6)
+            assert np.allclose(hidden_state.numpy() @ heads['sparse_weight'] + heads['sparse_bias'], sparse(hidden_state).numpy(), atol=1e-6)
+        saved = np.load(tmp_path / EmbeddingModel.HEADS_FILE)
+        assert sorted(saved.files) == ['colbert_bias', 'colbert_weight', 'sparse_bias', 'sparse_weight']
+
     @pytest.mark.parametrize(
         "sentence_pooling_method, normlized, return_type",
         [
@@ -66,11 +132,11 @@ class TestEmbeddingModel:
         model.sentence_pooling_method = sentence_pooling_method
         model.normlized = normlized
 
-        mock_hidden_state = torch.randn(2, 5, 1024) 
-        mock_mask = torch.ones(2, 5, dtype=torch.bool)
-    
+        mock_hidden_state = np.random.randn(2, 5, 1024).astype(np.float32)
+        mock_mask = np.ones((2, 5), dtype=np.int64)
+
         result = model.dense_embedding(mock_hidden_state, mock_mask, return_type=return_type)
-        
+
         if return_type == 'ls':
             assert isinstance(result, list)
         elif return_type == 'np':
@@ -80,6 +146,29 @@ class TestEmbeddingModel:
         for r in result:
             assert len(r) == 1024
 
+    def test_dense_embedding_dimensions(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        mock_hidden_state = np.random.randn(2, 5, 1024).astype(np.float32)
+
+        full = model.dense_embedding(mock_hidden_state, np.ones((2, 5), dtype=np.int64), return_type='np')
+        result = model.dense_embedding(mock_hidden_state, np.ones((2, 5), dtype=np.int64), return_type='np', dimensions=256, dtype='float16')
+
+        assert result.shape == (2, 256)
+        assert result.dtype == np.float16
+        assert np.allclose(np.linalg.norm(result.astype(np.float32), axis=-1), 1, atol=1e-3)
+        assert np.allclose(result, full[:, :256] / np.linalg.norm(full[:, :256], axis=-1, keepdims=True), atol=1e-3)
+
+    def test_dense_embedding_mean_ignores_padding(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        model.sentence_pooling_method = 'mean'
+        model.normlized = True
+        mock_hidden_state = np.random.randn(1, 4, 8).astype(np.float32)
+        mock_mask = np.array([[1, 1, 0, 0]])
+
+        result = model.dense_embedding(mock_hidden_state, mock_mask, return_type='np')
+        expected = mock_hidden_state[0, :2].mean(0)
+        assert np.allclose(result[0], expected / np.linalg.norm(expected), atol=1e-6)
+
     @pytest.mark.parametrize(
         "return_embedding",
         [
@@ -87,42 +176,60 @@ class TestEmbeddingModel:
             (False)
         ]
     )
-    @patch('os.path.exists', return_value=True)
-    def test_sparse_embedding(self, mock_path_exists, return_embedding, embedding_model_path_exist):
+    def test_sparse_embedding(self, return_embedding, embedding_model_path_exist):
         model = EmbeddingModel()
-        mock_hidden_state = torch.randn(2, 5, 1024).to(model.device)
-        mock_input_ids = torch.tensor([[0, 1, 2, 10, 12], [3, 4, 5, 50, 3]]).to(model.device)
-        
-        with patch('torch.relu') as mock_torch_relu:
-            mock_torch_relu.return_value = torch.randn(2, 5, 1)
-            model.vocab_size = 100
-            model.tokenizer.cls_token_id = 0
-            model.tokenizer.eos_token_id = 1
-            model.tokenizer.pad_token_id = 2
-            model.tokenizer.unk_token_id = 3
-            result = model.sparse_embedding(mock_hidden_state, mock_input_ids, return_embedding=return_embedding, return_type='pt')
-        
+        model.ensure_pooler()
+        mock_hidden_state = np.random.randn(2, 5, 1024).astype(np.float32)
+        mock_input_ids = np.array([[0, 1, 2, 10, 12], [3, 4, 5, 50, 3]])
+
+        model.vocab_size = 100
+        model.tokenizer.cls_token_id = 0
+        model.tokenizer.eos_token_id = 1
+        model.tokenizer.pad_token_id = 2
+        model.tokenizer.unk_token_id = 3
+        result = model.sparse_embedding(mock_hidden_state, mock_input_ids, return_embedding=return_embedding, return_type='np')
+
         if return_embedding:
-            assert isinstance(result, torch.Tensor)
-            assert result.size() == (2, 100)
+            assert isinstance(result, np.ndarray)
+            assert result.shape == (2, 100)
         else:
             assert isinstance(result, list)
             assert len(result) == 2
 
+    def test_sparse_embedding_coo(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        mock_hidden_state = np.random.randn(2, 5, 1024).astype(np.float32)
+        mock_input_ids = np.array([[0, 1, 2, 10, 12], [3, 4, 5, 50, 3]])
+        model.sparse_weight = np.zeros((1024, 1), dtype=np.float32)
+        model.sparse_bias = np.ones(1, dtype=np.float32)
+
+        model.vocab_size = 100
+        model.tokenizer.cls_token_id = 0
+        model.tokenizer.eos_token_id = 1
+        model.tokenizer.pad_token_id = 2
+        model.tokenizer.unk_token_id = 3
+        dense = model.sparse_embedding(mock_hidden_state, mock_input_ids, return_type='np')
+        coo = model.sparse_embedding(mock_hidden_state, mock_input_ids, return_type='pt', sparse_format='coo')
+        compact = model.sparse_embedding(mock_hidden_state, mock_input_ids, return_type='ls', sparse_format='coo')
+
+        assert len(coo) == 2
+        assert all(row.is_sparse and row.size() == (100,) for row in coo)
+        assert np.array_equal(torch.stack([row.to_dense() for row in coo]).numpy(), dense)
+        assert compact[0] == {"indices": [10, 12], "values": [1.0, 1.0], "shape": [100]}
+        assert compact[1]["indices"] == [4, 5, 50]
+
     def test_colbert_embedding(self, embedding_model_path_exist):
         model = EmbeddingModel()
-        mock_last_hidden_state = torch.randn(2, 5, 1024) 
-        mock_mask = torch.ones(2, 5, dtype=torch.bool)
+        model.ensure_pooler()
+        mock_last_hidden_state = np.random.randn(2, 5, 1024).astype(np.float32)
+        mock_mask = np.ones((2, 5), dtype=np.int64)
         mock_mask[0, 3:] = 0
-        model.colbert_linear = MagicMock()
-        model.colbert_linear.return_value = torch.randn(2, 4, 1024)
-        result = model.colbert_embedding(mock_last_hidden_state, mock_mask, return_type='pt')
-        
+        result = model.colbert_embedding(mock_last_hidden_state, mock_mask, return_type='np')
+
         assert isinstance(result, list)
-        assert len(result) == 2
-        for r in result:
-            assert isinstance(r, torch.Tensor)
-            assert r.size()[1] == 1024
+        assert [r.shape for r in result] == [(2, 1024), (4, 1024)]
+        expected = mock_last_hidden_state[0, 1:3] @ model.colbert_weight + model.colbert_bias
+        assert np.allclose(result[0], expected / np.linalg.norm(expected, axis=-1, keepdims=True), atol=1e-5)
 
     @pytest.mark.parametrize(
         "lexical_weights, expected_output",
@@ -190,15 +297,14 @@ class TestEmbeddingModel:
         model.dense_embedding = MagicMock()
         model.sparse_embedding = MagicMock()
         model.colbert_embedding = MagicMock()
-        model.model.return_value = MagicMock()
-        model.model.return_value.last_hidden_state = torch.randn(2, 5, 1024) 
+        model.model.run.return_value = [np.random.randn(2, 5, 1024).astype(np.float32)]
         mock_token = {
-            'input_ids': torch.zeros(2, 5, dtype=torch.long),
-            'attention_mask': torch.ones(2, 5, dtype=torch.bool)
+            'input_ids': np.zeros((2, 5), dtype=np.int64),
+            'attention_mask': np.ones((2, 5), dtype=np.int64)
         }
-        model.dense_embedding.return_value = [torch.randn(2, 1024)]
-        model.sparse_embedding.return_value = [torch.randn(2, 1024)]
-        model.colbert_embedding.return_value = [torch.randn(2, 1024)]
+        model.dense_embedding.return_value = [np.random.randn(2, 1024)]
+        model.sparse_embedding.return_value = [np.random.randn(2, 1024)]
+        model.colbert_embedding.return_value = [np.random.randn(2, 1024)]
 
         if not return_dense and not return_sparse and not return_colbert:
             assert pytest.raises(ValueError, model._encode, mock_token, return_dense=return_dense, return_sparse=return_sparse, return_colbert=return_colbert, return_type='ls')
@@ -208,50 +314,66 @@ class TestEmbeddingModel:
             assert type(sparse_vecs) is expect_sparse
             assert type(colbert_vecs) is expect_colbert
 
+    def test__encode_fused(self, embedding_model_fused_heads):
+        model = EmbeddingModel()
+        model.tokenizer.cls_token_id, model.tokenizer.eos_token_id, model.tokenizer.pad_token_id, model.tokenizer.unk_token_id = 0, 2, 1, 3
+        token = {
+            'input_ids': np.array([[0, 10, 12, 2], [0, 11, 2, 1]]),
+            'attention_mask': np.array([[1, 1, 1, 1], [1, 1, 1, 0]])
+        }
+        colbert_vecs = np.arange(5 * 4, dtype=np.float32).reshape(5, 4)
+        model.model.run.return_value = [np.array([[0.0, 0.5, 0.2, 0.0], [0.0, 0.7, 0.0, 0.0]], dtype=np.float32), colbert_vecs]
+
+        dense_vecs, sparse_vecs, result = model._encode(token, return_dense=False, return_sparse=True, return_colbert=True, return_sparse_embedding=False, return_type='np')
+
+        assert model.model.run.call_args.args[0] == ['sparse_weights', 'colbert_vecs']
+        assert dense_vecs is None
+        assert [dict(row) for row in sparse_vecs] == [{'10': pytest.approx(0.5), '12': pytest.approx(0.2)}, {'11': pytest.approx(0.7)}]
+        assert [row.tolist() for row in result] == [colbert_vecs[:3].tolist(), colbert_vecs[3:].tolist()]
+
+    def test__encode_fused_dimensions(self, embedding_model_fused_heads):
+        model = EmbeddingModel()
+        token = {'input_ids': np.array([[0, 10, 2]]), 'attention_mask': np.array([[1, 1, 1]])}
+        model.model.run.return_value = [np.array([[0.48, 0.64, 0.6]], dtype=np.float32)]
+
+        dense_vecs, _, _ = model._encode(token, return_dense=True, return_sparse=False, return_colbert=False, return_type='ls', dimensions=2)
+
+        assert dense_vecs == [pytest.approx([0.6, 0.8])]
+
+    def test_forward(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        model.input_names = ['input_ids', 'attention_mask', 'token_type_ids']
+        model.run_options = MagicMock()
+        model.model.run.return_value = [np.ones((1, 3, 4), dtype=np.float32)]
+        token = {'input_ids': np.array([[0, 5, 2]]), 'attention_mask': np.ones((1, 3), dtype=np.int64)}
+
+        result = model.forward(token)
+
+        assert result.shape == (1, 3, 4)
+        output_names, inputs, run_options = model.model.run.call_args.args
+        assert output_names == ['last_hidden_state']
+        assert inputs['token_type_ids'].tolist() == [[0, 0, 0]]
+        assert run_options is model.run_options
+
     @pytest.mark.parametrize(
-        "sentences, mock_tokenizer, mock_dense",
+        "sentences, lengths, expected_batches",
         [
-            (
-                ["fs", "asdd"],
-                [
-                    MagicMock(return_value={
-                        'input_ids': torch.zeros(2, 5, dtype=torch.long),
-                        'attention_mask': torch.ones(2, 5, dtype=torch.bool)
-                    })
-                ],
-                [torch.randn(2, 1024)]
-            ), 
-            (
-                ["fs", "asdd", "asd"],
-                [
-                    MagicMock(return_value={
-                        'input_ids': torch.zeros(2, 5, dtype=torch.long),
-                        'attention_mask': torch.ones(2, 5, dtype=torch.bool)
-                    }),
-                    MagicMock(return_value={
-                        'input_ids': torch.zeros(1, 5, dtype=torch.long),
-                        'attention_mask': torch.ones(1, 5, dtype=torch.bool)
-                    })
-                ],
-                [torch.randn(2, 1024), torch.randn(1, 1024)]
-            ), 
-            (
-                "asd",
-                [
-                    MagicMock(return_value={
-                        'input_ids': torch.zeros(1, 5, dtype=torch.long),
-                        'attention_mask': torch.ones(1, 5, dtype=torch.bool)
-                    })
-                ],
-                [torch.randn(1, 1024)]
-            )
+            (["fs", "asdd"], [3, 5], [[1, 0]]),
+            (["fs", "asdd", "asd"], [3, 6, 5], [[1, 2], [0]]),
+            (["fs", "asdd", "asd"], [5, 3, 5], [[0, 2], [1]]),
+            ("asd", [4], [[0]]),
         ]
     )
-    def test_encode(self, sentences, mock_tokenizer, mock_dense, embedding_model_path_exist):
+    def test_encode(self, sentences, lengths, expected_batches, embedding_model_path_exist):
         model = EmbeddingModel()
-        model.tokenizer.side_effect = mock_tokenizer
+        model.tokenizer = MagicMock()
+        model.tokenizer.return_value = {
+            'input_ids': [[n] * length for n, length in enumerate(lengths)],
+            'attention_mask': [[1] * length for length in lengths]
+        }
+        model.tokenizer.pad.side_effect = lambda features, **kwargs: features
         model._encode = MagicMock()
-        model._encode.side_effect = [(dense, dense, dense) for dense in mock_dense]
+        model._encode.side_effect = lambda token, **kwargs: ([ids[0] for ids in token['input_ids']],) * 3
         result = model.encode(
             sentences, 
             return_dense=True, 
@@ -260,27 +382,69 @@ class TestEmbeddingModel:
             return_type='pt',
             batch_size=2
         )
-        if isinstance(sentences, str):
-            assert type(result['dense_vecs']) is torch.Tensor
-        else:
-            assert type(result['dense_vecs']) is list
-        if isinstance(sentences, str):
-            assert type(result['lexical_weights']) is torch.Tensor
-        else:
-            assert type(result['lexical_weights']) is list
-        if isinstance(sentences, str):
-            assert type(result['colbert_vecs']) is torch.Tensor
-        else:
-            assert type(result['colbert_vecs']) is list
+
+        batches = [[ids[0] for ids in call.args[0]['input_ids']] for call in model._encode.call_args_list]
+        assert batches == expected_batches
+        expected = 0 if isinstance(sentences, str) else list(range(len(sentences)))
+        assert result['dense_vecs'] == expected
+        assert result['lexical_weights'] == expected
+        assert result['colbert_vecs'] == expected
+
+    def test_encode_padding_report(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        model.tokenizer = MagicMock()
+        model.tokenizer.return_value = {
+            'input_ids': [[1] * 3, [1] * 6, [1] * 5],
+            'attention_mask': [[1] * 3, [1] * 6, [1] * 5]
+        }
+        model._encode = MagicMock(return_value=([None] * 2, None, None))
+        model.encode(["fs", "asdd", "asd"], batch_size=2)
+
+        report = model.padding_report()
+        assert report["real_tokens"] == 14
+        assert report["padded_tokens"] == 15
+        assert report["unsorted_padded_tokens"] == 17
+        assert report["padding_ratio"] == pytest.approx(1 / 15)
+
+    def test_encode_colbert_packed(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        model.tokenizer = MagicMock()
+        model.tokenizer.return_value = {
+            'input_ids': [[0] * 3, [1] * 5],
+            'attention_mask': [[1] * 3, [1] * 5]
+        }
+        model.tokenizer.pad.side_effect = lambda features, **kwargs: features
+        model._encode = MagicMock()
+        model._encode.side_effect = lambda token, **kwargs: (None, None, [np.full((len(ids) - 2, 4), ids[0], dtype=np.float32) for ids in token['input_ids']])
+        result = model.encode(["fs", "asdd"], return_dense=False, return_colbert=True, return_type='np', colbert_format='packed')
+
+        packed = result['colbert_vecs']
+        assert packed['vectors'].shape == (4, 4)
+        assert packed['offsets'].tolist() == [0, 1, 4]
+        assert packed['vectors'][:1].tolist() == [[0.0] * 4]
+        assert (packed['vectors'][1:] == 1).all()
+
+    def test_encode_empty(self, embedding_model_path_exist):
+        model = EmbeddingModel()
+        model._encode = MagicMock()
+        result = model.encode([])
+        assert result == {"dense_vecs": [], "lexical_weights": None, "colbert_vecs": None}
+        model._encode.assert_not_called()
 
     def test_count_tokenizer(self, embedding_model_path_exist):
         model = EmbeddingModel()
         model.tokenizer = MagicMock()
         model.tokenizer.return_value = {
-            'input_ids': torch.tensor([[1, 2, 3], [4, 5, 6]])
+            'input_ids': [[1, 2, 3], [4, 5, 6]]
         }
         
         result = model.count_tokenizer(['sentence1', 'sentence2'])
         
         assert isinstance(result, list)
         assert result == [3,3]
+
+    def test_does_not_import_torch(self):
+        import subprocess
+        code = "import sys; import model_ai.bge_m3_onnx; print('torch' in sys.modules or 'transformers' in sys.modules)"
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == 'False'
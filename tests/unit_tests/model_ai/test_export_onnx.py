@@ -0,0 +1,56 @@
+import pytest
+from unittest.mock import patch, MagicMock
+
+from transformers import XLMRobertaConfig, XLMRobertaModel
+import numpy as np
+import torch
+import onnx
+
+from model_ai.export_onnx import OnnxExporter, M3HeadsModule
+from model_ai.bge_m3_onnx import EmbeddingModel
+
+HIDDEN_SIZE = 16
+
+@pytest.fixture(scope='function')
+def model_dir(tmp_path):
+    source = tmp_path / 'bge-m3'
+    config = XLMRobertaConfig(vocab_size=50, hidden_size=HIDDEN_SIZE, num_hidden_layers=1, num_attention_heads=2, intermediate_size=32, max_position_embeddings=40)
+    XLMRobertaModel(config, add_pooling_layer=False).save_pretrained(source)
+    torch.save(torch.nn.Linear(HIDDEN_SIZE, HIDDEN_SIZE).state_dict(), source / 'colbert_linear.pt')
+    torch.save(torch.nn.Linear(HIDDEN_SIZE, 1).state_dict(), source / 'sparse_linear.pt')
+    (source / 'tokenizer.json').write_text('{}')
+    return source
+
+@pytest.fixture(scope='function')
+def mock_tokenizer():
+    tokenizer = MagicMock(return_value={
+        'input_ids': np.array([[0, 5, 6, 7, 2], [0, 8, 2, 1, 1]]),
+        'attention_mask': np.array([[1, 1, 1, 1, 1], [1, 1, 1, 0, 0]])
+    })
+    with patch('model_ai.export_onnx.FastTokenizer.from_pretrained', return_value=tokenizer):
+        yield tokenizer
+
+def test_m3_heads_module_packs_colbert_tokens(model_dir):
+    model = XLMRobertaModel.from_pretrained(model_dir).eval()
+    module = M3HeadsModule(model, *OnnxExporter.load_heads(model_dir, HIDDEN_SIZE)).eval()
+    attention_mask = torch.tensor([[1, 1, 1, 1], [1, 1, 0, 0]])
+    with torch.no_grad():
+        dense_vecs, sparse_weights, colbert_vecs = module(torch.tensor([[0, 5, 6, 2], [0, 2, 1, 1]]), attention_mask)
+
+    assert dense_vecs.shape == (2, HIDDEN_SIZE)
+    assert torch.allclose(dense_vecs.norm(dim=-1), torch.ones(2))
+    assert sparse_weights.shape == (2, 4)
+    assert (sparse_weights >= 0).all()
+    assert colbert_vecs.shape == (4, HIDDEN_SIZE)
+
+@pytest.mark.parametrize("sentence_pooling_method", ['cls', 'mean'])
+def test_export(model_dir, tmp_path, mock_tokenizer, sentence_pooling_method):
+    output_dir = tmp_path / 'bge_m3_onnx_heads'
+    result = OnnxExporter.export(str(model_dir), output_dir, sentence_pooling_method=sentence_pooling_method)
+
+    assert result["output"] == str(output_dir / 'model.onnx')
+    assert result["max_abs_diff"] < 1e-4
+    graph = onnx.load(result["output"])
+    assert [output.name for output in graph.graph.output] == list(EmbeddingModel.HEAD_OUTPUTS)
+    assert {prop.key: prop.value for prop in graph.metadata_props} == {'sentence_pooling_method': sentence_pooling_method, 'normlized': 'True'}
+    assert sorted(f.name for f in output_dir.iterdir()) == ['config.json', 'model.onnx', 'tokenizer.json']
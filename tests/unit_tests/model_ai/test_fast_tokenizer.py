@@ -0,0 +1,44 @@
+import pytest
+
+import json
+import numpy as np
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+
+from model_ai.fast_tokenizer import FastTokenizer
+
+@pytest.fixture(scope='module')
+def tokenizer_dir(tmp_path_factory):
+    path = tmp_path_factory.mktemp('tokenizer')
+    vocab = {'<s>': 0, '<pad>': 1, '</s>': 2, '<unk>': 3, 'hello': 4, 'world': 5, 'foo': 6}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token='<unk>'))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(single='<s> $A </s>', special_tokens=[('<s>', 0), ('</s>', 2)])
+    tokenizer.save(str(path / 'tokenizer.json'))
+    special_tokens = {'cls_token': '<s>', 'eos_token': '</s>', 'pad_token': {'content': '<pad>'}, 'unk_token': '<unk>'}
+    (path / 'special_tokens_map.json').write_text(json.dumps(special_tokens))
+    return str(path)
+
+def test_special_tokens(tokenizer_dir):
+    tokenizer = FastTokenizer.from_pretrained(tokenizer_dir)
+    assert (tokenizer.cls_token_id, tokenizer.eos_token_id, tokenizer.pad_token_id, tokenizer.unk_token_id) == (0, 2, 1, 3)
+
+def test_call(tokenizer_dir):
+    tokenizer = FastTokenizer.from_pretrained(tokenizer_dir)
+    assert tokenizer(['hello world', 'bar'])['input_ids'] == [[0, 4, 5, 2], [0, 3, 2]]
+    assert tokenizer('hello')['input_ids'] == [0, 4, 2]
+    assert tokenizer(['hello world foo'], max_length=4, truncation=True)['input_ids'] == [[0, 4, 5, 2]]
+    assert tokenizer(['hello world foo'], max_length=4)['input_ids'] == [[0, 4, 5, 6, 2]]
+
+def test_pad(tokenizer_dir):
+    tokenizer = FastTokenizer.from_pretrained(tokenizer_dir)
+    batch = tokenizer.pad(tokenizer(['hello world', 'foo']), return_tensors='np')
+
+    assert batch['input_ids'].dtype == np.int64
+    assert batch['input_ids'].tolist() == [[0, 4, 5, 2], [0, 6, 2, 1]]
+    assert batch['attention_mask'].tolist() == [[1, 1, 1, 1], [1, 1, 1, 0]]
+    with pytest.raises(ValueError):
+        tokenizer.pad(tokenizer(['foo']), return_tensors='pt')
+
+def test_decode(tokenizer_dir):
+    tokenizer = FastTokenizer.from_pretrained(tokenizer_dir)
+    assert tokenizer.decode([4]) == 'hello'
@@ -0,0 +1,97 @@
+import pytest
+from unittest.mock import MagicMock
+
+import onnxruntime as ort
+
+from model_ai.ort_session import OrtSessionProfile
+
+@pytest.fixture(scope='function')
+def ort_settings(mock_settings_manager):
+    mock_settings_manager.ort_intra_op_threads = 4
+    mock_settings_manager.ort_inter_op_threads = 1
+    mock_settings_manager.ort_graph_optimization_level = 'extended'
+    mock_settings_manager.ort_execution_mode = 'sequential'
+    mock_settings_manager.ort_enable_mem_pattern = False
+    mock_settings_manager.ort_enable_cpu_mem_arena = True
+    mock_settings_manager.ort_arena_shrinkage = False
+    mock_settings_manager.ort_disable_prepacking = False
+    yield mock_settings_manager
+
+def test_session_options(ort_settings):
+    options = OrtSessionProfile.session_options()
+    assert options.intra_op_num_threads == 4
+    assert options.inter_op_num_threads == 1
+    assert options.graph_optimization_level == ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    assert options.execution_mode == ort.ExecutionMode.ORT_SEQUENTIAL
+    assert options.enable_mem_pattern is False
+    assert options.enable_cpu_mem_arena is True
+
+    options = OrtSessionProfile.session_options(optimization_level='disable')
+    assert options.graph_optimization_level == ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+
+def test_session_options_disable_prepacking(ort_settings):
+    ort_settings.ort_disable_prepacking = True
+    options = OrtSessionProfile.session_options()
+    assert options.get_session_config_entry('session.disable_prepacking') == '1'
+
+@pytest.mark.parametrize(
+    "setting, value",
+    [
+        ('ort_graph_optimization_level', 'fastest'),
+        ('ort_execution_mode', 'threaded'),
+    ]
+)
+def test_session_options_invalid(ort_settings, setting, value):
+    setattr(ort_settings, setting, value)
+    with pytest.raises(ValueError):
+        OrtSessionProfile.session_options()
+
+@pytest.mark.parametrize(
+    "arena_shrinkage, device, expected",
+    [
+        (False, 'cpu', None),
+        (True, 'cpu', 'cpu:0'),
+        (True, 'cuda', 'gpu:0'),
+        (True, 'cuda:1', 'gpu:1'),
+    ]
+)
+def test_run_options(ort_settings, arena_shrinkage, device, expected):
+    ort_settings.ort_arena_shrinkage = arena_shrinkage
+    options = OrtSessionProfile.run_options(device)
+    if expected is None:
+        assert options is None
+    else:
+        assert options.get_run_config_entry('memory.enable_memory_arena_shrinkage') == expected
+
+def test_run_options_only_fetches(ort_settings):
+    ort_settings.ort_arena_shrinkage = False
+    options = OrtSessionProfile.run_options('cpu', only_fetches=True)
+    assert options.only_execute_path_to_fetches is True
+
+def test_optimized_model_source(ort_settings, tmp_path):
+    model_path, optimized_model_path = tmp_path / 'model.onnx', tmp_path / 'model.opt.onnx'
+    model_path.write_bytes(b'graph')
+    assert not OrtSessionProfile.is_optimized_from(str(optimized_model_path), str(model_path), ['CPUExecutionProvider'])
+
+    optimized_model_path.write_bytes(b'optimized graph')
+    OrtSessionProfile.record_optimized_model(str(optimized_model_path), str(model_path), ['CPUExecutionProvider'])
+    assert OrtSessionProfile.is_optimized_from(str(optimized_model_path), str(model_path), ['CPUExecutionProvider'])
+    assert not OrtSessionProfile.is_optimized_from(str(optimized_model_path), str(model_path), ['CUDAExecutionProvider', 'CPUExecutionProvider'])
+
+    # a graph optimized from another model file or at another level is built again
+    other_model_path = tmp_path / 'other.onnx'
+    other_model_path.write_bytes(b'graph')
+    assert not OrtSessionProfile.is_optimized_from(str(optimized_model_path), str(other_model_path), ['CPUExecutionProvider'])
+    ort_settings.ort_graph_optimization_level = 'all'
+    assert not OrtSessionProfile.is_optimized_from(str(optimized_model_path), str(model_path), ['CPUExecutionProvider'])
+
+def test_log_session(ort_settings, mock_logger_info):
+    session = MagicMock()
+    session.get_providers.return_value = ['CPUExecutionProvider']
+    session.get_session_options.return_value = OrtSessionProfile.session_options()
+    OrtSessionProfile.log_session(session)
+
+    message = mock_logger_info.call_args.args[0]
+    assert "CPUExecutionProvider" in message
+    assert "intra_op_threads=4" in message
+    assert "arena_shrinkage=False" in message
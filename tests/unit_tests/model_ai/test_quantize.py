@@ -0,0 +1,35 @@
+import pytest
+from unittest.mock import patch
+
+from model_ai.quantize import OnnxQuantizer
+
+@pytest.fixture(scope='function')
+def model_dir(tmp_path):
+    source = tmp_path / 'bge_m3_onnx_o2'
+    source.mkdir()
+    (source / 'model.onnx').write_bytes(b'graph')
+    (source / 'config.json').write_text('{}')
+    (source / 'tokenizer.json').write_text('{}')
+    return source
+
+def test_quantize(model_dir, tmp_path):
+    output_dir = tmp_path / 'bge_m3_onnx_o2_int8'
+    with patch('model_ai.quantize.quantize_dynamic') as mock_quantize:
+        mock_quantize.side_effect = lambda model_input, model_output, **kwargs: model_output.write_bytes(b'int8')
+        result = OnnxQuantizer.quantize(model_dir, output_dir)
+
+    kwargs = mock_quantize.call_args.kwargs
+    assert mock_quantize.call_args.args == (model_dir / 'model.onnx', output_dir / 'model.onnx')
+    assert kwargs['per_channel'] is True
+    assert kwargs['use_external_data_format'] is False
+    assert sorted(f.name for f in output_dir.iterdir()) == ['config.json', 'model.onnx', 'tokenizer.json']
+    assert result == {"output": str(output_dir / 'model.onnx'), "bytes": 4, "source_bytes": 5}
+
+def test_quantize_external_data(model_dir):
+    (model_dir / 'model.onnx_data').write_bytes(b'weights')
+    assert OnnxQuantizer.uses_external_data(model_dir / 'model.onnx') is True
+
+def test_quantize_ambiguous_source(model_dir, tmp_path):
+    (model_dir / 'model_optimized.onnx').write_bytes(b'graph')
+    with pytest.raises(ValueError):
+        OnnxQuantizer.quantize(model_dir, tmp_path / 'output')
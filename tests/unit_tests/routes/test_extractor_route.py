@@ -1,13 +1,16 @@
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 from fastapi import FastAPI
 
 from bson import ObjectId
 import datetime
+import numpy as np
 
 from routes.extractor_route import extractor_route, get_token
+from controllers.extractor import SentenceExtractor
+from controllers.elasticsearch_controller import ESFuncs
 
 def mock_get_token():
     with patch("routes.extractor_route.get_token") as mock:
@@ -21,14 +24,20 @@ def mock_collection_extracted():
         yield mock.EXTRACTED
 
 @pytest.fixture(scope="function")
-def mock_search_es():
-    with patch('routes.extractor_route.ESFuncs.search_es') as mock:
+def mock_get_es():
+    with patch('routes.extractor_route.AsyncESFuncs.get_es') as mock:
+        yield mock
+
+@pytest.fixture(scope="function")
+def mock_mget_es():
+    with patch('routes.extractor_route.AsyncESFuncs.mget_es') as mock:
         yield mock
 
 @pytest.fixture(scope="function")
 def mock_extract():
     with patch('routes.extractor_route.SentenceExtractor') as mock:
-        yield mock.return_value.extract
+        mock.return_value.extract_async = AsyncMock()
+        yield mock.return_value.extract_async
 
 @pytest.fixture(scope="function")
 def mock_es_index():
@@ -37,7 +46,13 @@ def mock_es_index():
         yield mock
 
 @pytest.fixture(scope="function")
-def client():
+def mock_bulk_indexer():
+    # the indexer is off unless a test hands out one
+    with patch('routes.extractor_route.BulkIndexer.get', return_value=None) as mock:
+        yield mock
+
+@pytest.fixture(scope="function")
+def client(settings, mock_bulk_indexer):
     app = FastAPI()
     app.include_router(extractor_route)
     app.dependency_overrides[get_token] = mock_get_token
@@ -54,7 +69,7 @@ def test_embedding_model_success(mock_extract, client):
 
     assert response.status_code == 200
     assert response.json() == {"vector": [[4, 5, 6]]}
-    mock_extract.assert_called_once_with(["This is a test sentence"])
+    mock_extract.assert_called_once_with(["This is a test sentence"], dimensions=None, dtype='float32')
 
 def test_embedding_model_list_success(mock_extract, client):
     mock_extract.return_value = [[4, 5, 6], [7, 8, 9]]
@@ -66,46 +81,105 @@ def test_embedding_model_list_success(mock_extract, client):
 
     assert response.status_code == 200
     assert response.json() == {"vector": [[4, 5, 6], [7, 8, 9]]}
-    mock_extract.assert_called_once_with(["This is a test sentence", "This is another test sentence"])
+    mock_extract.assert_called_once_with(["This is a test sentence", "This is another test sentence"], dimensions=None, dtype='float32')
 
+def test_embedding_model_binary(mock_extract, client):
+    mock_extract.return_value = np.array([[4, 5, 6], [7, 8, 9]], dtype=np.float32)
+    body = {"sentences": ["This is a test sentence", "This is another test sentence"]}
+    response = client.post(
+        "/extractor/model?dtype=float16",
+        json=body,
+        headers={"Accept": "application/octet-stream"},
+    )
 
-def test_multiple_sentence_embedding_sentences(mock_search_es, mock_extract, mock_es_index, client):
-    mock_search_es.side_effect = [
-        {'hits': {'total': {'value': 1}, 
-                  'hits': [{'_source': {'sentence_vector': [0.1, 0.2, 0.3]}}]}},  # Existing
-        {'hits': {'total': {'value': 0}}},  # Non-existing
-        {'hits': {'total': {'value': 0}}},  # Non-existing
-        {'hits': {'total': {'value': 1}, 
-                  'hits': [{'_source': {'sentence_vector': [0.4, 0.5, 0.6]}}]}},  # Existing
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.headers["x-vector-shape"] == "2,3"
+    assert response.headers["x-vector-dtype"] == "float16"
+    assert np.frombuffer(response.content, dtype='<f2').reshape(2, 3).tolist() == [[4, 5, 6], [7, 8, 9]]
+    mock_extract.assert_called_once_with(["This is a test sentence", "This is another test sentence"], return_type='np', dimensions=None, dtype='float16')
+
+
+def test_embedding_model_dimensions(mock_extract, client):
+    mock_extract.return_value = [[0.6, 0.8]]
+    response = client.post("/extractor/model?dimensions=2&dtype=float16", json={"sentences": "This is a test sentence"})
+
+    assert response.status_code == 200
+    assert response.json() == {"vector": [[0.6, 0.8]]}
+    mock_extract.assert_called_once_with(["This is a test sentence"], dimensions=2, dtype='float16')
+
+def test_embedding_model_dimensions_invalid(mock_extract, client):
+    response = client.post("/extractor/model?dimensions=0", json={"sentences": "This is a test sentence"})
+    assert response.status_code == 422
+    mock_extract.assert_not_called()
+
+@pytest.mark.parametrize("route", ["/extractor/model", "/extractor/elasticsearch/multiple"])
+def test_dimensions_above_vector_size(route, mock_extract, mock_mget_es, settings, client):
+    with patch.object(settings, 'sentences_vector_size', 1024):
+        response = client.post(f"{route}?dimensions=2048", json={"sentences": ["This is a test sentence"]})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["query", "dimensions"]
+    assert response.json()["detail"][0]["msg"] == "Input should be less than or equal to 1024"
+    mock_extract.assert_not_called()
+    mock_mget_es.assert_not_called()
+
+
+def found(sentence, source):
+    return {'_id': ESFuncs.sentence_hash(sentence), 'found': True, '_source': source}
+
+
+def test_multiple_sentence_embedding_sentences(mock_mget_es, mock_extract, mock_es_index, client):
+    mock_mget_es.return_value = [
+        found('Existing sentence 1', {'sentence': 'Existing sentence 1', 'sentence_vector': [0.1, 0.2, 0.3]}),
+        {'_id': ESFuncs.sentence_hash('New sentence 1'), 'found': False},
+        {'_id': ESFuncs.sentence_hash('New sentence 2'), 'found': False},
+        found('Existing sentence 2', {'sentence': 'Existing sentence 2', 'sentence_vector': [0.4, 0.5, 0.6]}),
     ]
     mock_extract.return_value = [[1, 2, 3], [4, 5, 6]]
 
     body = {
-        "sentences": ["Existing sentence 1", "New sentence 1", "New sentence 2", "Existing sentence 2"]
+        "sentences": ["Existing sentence 1", "New sentence 1", "New sentence 2", "Existing sentence 2", "New sentence 1"]
     }
     response = client.post("/extractor/elasticsearch/multiple", json=body)
 
     assert response.status_code == 200
     data = response.json()
-    assert len(data['result']) == 4
-    assert data['result'] == [[0.1, 0.2, 0.3], [1, 2, 3], [4, 5, 6], [0.4, 0.5, 0.6]]
-
-
-def test_single_sentence_embedding_success(mock_search_es, mock_extract, mock_es_index, client):
-    mock_search_es.return_value = {
-        "hits": {
-            "total": {"value": 1},
-            "hits": [
-                {
-                    "_source": {
-                        "sentence_vector": [1, 2, 3],
-                        "id": 1,
-                        'counter': 1
-                    }
-                }
-            ]
-        }
-    }
+    assert len(data['result']) == 5
+    assert data['result'] == [[0.1, 0.2, 0.3], [1, 2, 3], [4, 5, 6], [0.4, 0.5, 0.6], [1, 2, 3]]
+    # one lookup for every sentence, and the misses are encoded in one batch
+    mock_mget_es.assert_awaited_once_with(
+        'mocked_extracted_index',
+        [ESFuncs.sentence_hash(s) for s in ["Existing sentence 1", "New sentence 1", "New sentence 2", "Existing sentence 2"]]
+    )
+    mock_extract.assert_called_once_with(["New sentence 1", "New sentence 2"], dimensions=None, dtype='float32')
+
+def test_multiple_sentence_embedding_all_exist(mock_mget_es, mock_extract, mock_es_index, client):
+    mock_mget_es.return_value = [found('Existing sentence', {'sentence': 'Existing sentence', 'sentence_vector': [0.1, 0.2]})]
+
+    response = client.post("/extractor/elasticsearch/multiple", json={"sentences": ["Existing sentence"]})
+
+    assert response.json() == {"result": [[0.1, 0.2]]}
+    mock_extract.assert_not_called()
+
+
+def test_multiple_sentence_embedding_dimensions(mock_mget_es, mock_es_index, client):
+    mock_mget_es.return_value = [found('Existing sentence', {'sentence': 'Existing sentence', 'sentence_vector': [3.0, 4.0, 1.0]})]
+    with patch('routes.extractor_route.SentenceExtractor') as mock:
+        mock.return_value.extract_async = AsyncMock(return_value=[[0.0, 2.0, 1.0]])
+        mock.reduce = SentenceExtractor.reduce
+        response = client.post("/extractor/elasticsearch/multiple?dimensions=2", json={"sentences": ["Existing sentence", "New sentence"]})
+
+    assert response.status_code == 200
+    assert response.json() == {"result": [pytest.approx([0.6, 0.8]), [0.0, 1.0]]}
+    mock.return_value.extract_async.assert_called_once_with(["New sentence"], dimensions=None, dtype='float32')
+
+
+def test_single_sentence_embedding_success(mock_get_es, mock_extract, mock_es_index, client):
+    mock_get_es.return_value = found("This is a test sentence", {
+        "sentence_vector": [1, 2, 3],
+        "id": 1,
+        'counter': 1
+    })
     body = {"sentence": "This is a test sentence"}
     response = client.post(
         "/extractor/elasticsearch/single",
@@ -119,13 +193,11 @@ def test_single_sentence_embedding_success(mock_search_es, mock_extract, mock_es
         'counter': 1
     }}
 
-    mock_search_es.assert_called_once()
+    mock_get_es.assert_awaited_once_with('mocked_extracted_index', ESFuncs.sentence_hash("This is a test sentence"))
     mock_extract.assert_not_called()
 
-def test_single_sentence_embedding_not_exist(mock_search_es, mock_extract, mock_es_index, client):
-    mock_search_es.return_value = {
-        "hits": {"total": {"value": 0}, "hits": []}
-    }
+def test_single_sentence_embedding_not_exist(mock_get_es, mock_extract, mock_es_index, client):
+    mock_get_es.return_value = None
     mock_extract.return_value = [[4, 5, 6]]
 
     body = {"sentence": "New sentence"}
@@ -137,11 +209,11 @@ def test_single_sentence_embedding_not_exist(mock_search_es, mock_extract, mock_
     assert response.status_code == 200
     assert response.json() == {"is_exist": False, "result": [4, 5, 6]}  # New sentence extracted
 
-    mock_search_es.assert_called_once()
-    mock_extract.assert_called_once_with(["New sentence"])
+    mock_get_es.assert_called_once()
+    mock_extract.assert_called_once_with(["New sentence"], dimensions=None, dtype='float32')
     
 
-@patch('routes.extractor_route.ESFuncs.update_counter')
+@patch('routes.extractor_route.AsyncESFuncs.update_counter')
 @patch('routes.extractor_route.single_sentence_embedding')
 def test_extractor_sentence_exists(mock_sentence_embedding, mock_es_funcs, mock_collection_extracted, mock_es_index, client):
     mock_collection_extracted.update_one = MagicMock()
@@ -167,12 +239,12 @@ def test_extractor_sentence_exists(mock_sentence_embedding, mock_es_funcs, mock_
         filter = {"_id": ObjectId('605c72f1537f2a001ddae54f')},
         update = {"$set": {"counter": 2}}
     )
-    mock_es_funcs.assert_called_once_with(
+    mock_es_funcs.assert_awaited_once_with(
         index_name = 'mocked_extracted_index', 
-        id = '605c72f1537f2a001ddae54f'
+        id = ESFuncs.sentence_hash("This is a test sentence")
     )
 
-@patch('routes.extractor_route.ESFuncs.insert_es')
+@patch('routes.extractor_route.AsyncESFuncs.insert_es')
 @patch('routes.extractor_route.single_sentence_embedding')
 def test_extractor_sentence_not_exists(mock_sentence_embedding, mock_es_funcs, mock_collection_extracted, mock_es_index, client):
     mock_collection_extracted.insert_one.return_value = MagicMock(inserted_id=ObjectId('605c72f1537f2a001ddae54f'))
@@ -197,9 +269,10 @@ def test_extractor_sentence_not_exists(mock_sentence_embedding, mock_es_funcs, m
             'sentence': 'This is a new sentence', 
             'created_at': datetime.datetime(2024, 9, 17, 13, 47, 4, 31272), 
             'counter': 1, 
+            'sentence_hash': ESFuncs.sentence_hash('This is a new sentence'),
         }
     )
-    mock_es_funcs.assert_called_once_with(
+    mock_es_funcs.assert_awaited_once_with(
         'mocked_extracted_index', 
         {
             'sentence': 'This is a new sentence', 
@@ -207,11 +280,68 @@ def test_extractor_sentence_not_exists(mock_sentence_embedding, mock_es_funcs, m
             "id": '605c72f1537f2a001ddae54f',
             'counter': 1, 
             'sentence_vector': [1, 2, 3], 
+            'sentence_hash': ESFuncs.sentence_hash("This is a new sentence"),
         },
-        id = '605c72f1537f2a001ddae54f'
+        id = ESFuncs.sentence_hash("This is a new sentence")
     )
 
 
+def bulk_indexer(document=None):
+    indexer = MagicMock()
+    indexer.lookup.return_value = document
+    indexer.submit = AsyncMock()
+    indexer.update_counter = AsyncMock()
+    indexer.wait = AsyncMock()
+    return indexer
+
+def test_single_sentence_embedding_buffered(mock_get_es, mock_extract, mock_es_index, mock_bulk_indexer, client):
+    mock_bulk_indexer.return_value = bulk_indexer({"sentence_vector": [1, 2, 3], "counter": 1})
+
+    response = client.post("/extractor/elasticsearch/single", json={"sentence": "This is a test sentence"})
+
+    assert response.json() == {"is_exist": True, "result": {"sentence_vector": [1, 2, 3], "counter": 1}}
+    mock_bulk_indexer.return_value.lookup.assert_called_once_with(ESFuncs.sentence_hash("This is a test sentence"))
+    mock_get_es.assert_not_called()
+    mock_extract.assert_not_called()
+
+@patch('routes.extractor_route.single_sentence_embedding')
+def test_extractor_sentence_exists_bulk(mock_sentence_embedding, mock_collection_extracted, mock_es_index, mock_bulk_indexer, client):
+    mock_bulk_indexer.return_value = bulk_indexer()
+    mock_sentence_embedding.return_value = {"is_exist": True, "result": {"id": '605c72f1537f2a001ddae54f', 'counter': 1}}
+
+    response = client.post("/extractor", json={"sentence": "This is a test sentence"})
+
+    assert response.json() == {"id": '605c72f1537f2a001ddae54f', 'counter': 2}
+    mock_bulk_indexer.return_value.update_counter.assert_awaited_once_with(ESFuncs.sentence_hash("This is a test sentence"))
+
+@pytest.mark.parametrize("durable", [False, True])
+@patch('routes.extractor_route.AsyncESFuncs.insert_es')
+@patch('routes.extractor_route.single_sentence_embedding')
+def test_extractor_sentence_not_exists_bulk(mock_sentence_embedding, mock_insert_es, durable, mock_collection_extracted, mock_es_index, mock_bulk_indexer, client):
+    mock_bulk_indexer.return_value = bulk_indexer()
+    mock_collection_extracted.insert_one.return_value = MagicMock(inserted_id=ObjectId('605c72f1537f2a001ddae54f'))
+    mock_sentence_embedding.return_value = {"is_exist": False, "result": [1, 2, 3]}
+    body = {"sentence": "This is a new sentence", 'created_at': '2024-09-17T13:47:04.031272'}
+
+    response = client.post("/extractor", json=body, params={"durable": durable})
+
+    assert response.status_code == 200
+    sentence_hash = ESFuncs.sentence_hash("This is a new sentence")
+    mock_bulk_indexer.return_value.submit.assert_awaited_once_with(
+        {
+            'sentence': 'This is a new sentence',
+            'created_at': datetime.datetime(2024, 9, 17, 13, 47, 4, 31272),
+            "id": '605c72f1537f2a001ddae54f',
+            'counter': 1,
+            'sentence_vector': [1, 2, 3],
+            'sentence_hash': sentence_hash,
+        },
+        sentence_hash,
+        wait=durable
+    )
+    mock_insert_es.assert_not_called()
+
+
 def test_embedded_model_warmup_success(mock_extract, client):
     mock_extract.return_value = None
     response = client.get("/extractor/model/warmup")
@@ -283,7 +413,7 @@ def test_get_one_extracted_not_found(mock_collection_extracted, client):
     assert response.json() == {"status": False, "detail": "Item not found."}
 
 
-@patch('routes.extractor_route.ESFuncs.delete_es')
+@patch('routes.extractor_route.AsyncESFuncs.delete_es')
 def test_delete_extractor_success(mock_delete_es, mock_es_index, mock_collection_extracted, client):
     mock_collection_extracted.find_one.return_value = {
         "_id": ObjectId('605c72f1537f2a001ddae54f'), 
@@ -308,12 +438,39 @@ def test_delete_extractor_success(mock_delete_es, mock_es_index, mock_collection
         {"_id": ObjectId('605c72f1537f2a001ddae54f')})
     mock_collection_extracted.delete_one.assert_called_once_with(
         filter={"_id": ObjectId('605c72f1537f2a001ddae54f')})
-    mock_delete_es.assert_called_once_with(
-        index_name="mocked_extracted_index", id="605c72f1537f2a001ddae54f")
+    mock_delete_es.assert_awaited_once_with(
+        index_name="mocked_extracted_index", id=ESFuncs.sentence_hash("test sentence"))
+
+@patch('routes.extractor_route.AsyncESFuncs.delete_es')
+def test_delete_extractor_waits_for_bulk(mock_delete_es, mock_es_index, mock_collection_extracted, mock_bulk_indexer, client):
+    mock_bulk_indexer.return_value = bulk_indexer()
+    mock_collection_extracted.find_one.return_value = {"_id": ObjectId('605c72f1537f2a001ddae54f'), "sentence": "test sentence", "counter": 1, "created_at": "2023-09-05"}
+
+    response = client.delete("/extractor/605c72f1537f2a001ddae54f")
+
+    assert response.json()["status"] == True
+    mock_bulk_indexer.return_value.wait.assert_awaited_once_with(ESFuncs.sentence_hash("test sentence"))
+    mock_delete_es.assert_awaited_once_with(index_name="mocked_extracted_index", id=ESFuncs.sentence_hash("test sentence"))
+
+
+@patch('routes.extractor_route.AsyncESFuncs.delete_by_query_es')
+@patch('routes.extractor_route.AsyncESFuncs.delete_es', return_value=None)
+def test_delete_extractor_document_not_keyed_by_hash(mock_delete_es, mock_delete_by_query_es, mock_es_index, mock_collection_extracted, client):
+    # the record was indexed under another model version, the hash it stored is used rather than a recomputed one
+    mock_collection_extracted.find_one.return_value = {"_id": ObjectId('605c72f1537f2a001ddae54f'), "sentence": "test sentence", "sentence_hash": "stored-hash", "counter": 1}
+
+    response = client.delete("/extractor/605c72f1537f2a001ddae54f")
+
+    assert response.status_code == 200
+    assert response.json()["status"] == True
+    mock_delete_es.assert_awaited_once_with(index_name="mocked_extracted_index", id="stored-hash")
+    mock_delete_by_query_es.assert_awaited_once_with(
+        index_name="mocked_extracted_index", body={"query": {"term": {"id.keyword": '605c72f1537f2a001ddae54f'}}})
+
 
 def test_delete_extractor_not_found(mock_collection_extracted, client):
     mock_collection_extracted.find_one.return_value = None
     response = client.delete("/extractor/605c72f1537f2a001ddae54f")
 
     assert response.status_code == 200
-    assert response.json() == {"status": False, "detail": "Item not found."}
\ No newline at end of file
+    assert response.json() == {"status": False, "detail": "Item not found."}
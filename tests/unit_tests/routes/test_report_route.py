@@ -20,7 +20,7 @@ def client():
 
 
 @patch("routes.report_route.ESIndex")
-@patch("routes.report_route.ESFuncs.aggregate_sentence_total_by_days")
+@patch("routes.report_route.AsyncESFuncs.aggregate_sentence_total_by_days")
 def test_extractor_report_success(mock_group_sentenece, mock_index, client):
     mock_index.EXTRACTED = "mocked_extracted_index"
     mock_group_sentenece.return_value = {"result": "mocked_response"}
@@ -32,7 +32,7 @@ def test_extractor_report_success(mock_group_sentenece, mock_index, client):
     response = client.get("/report/extractor", params=params)
     assert response.status_code == 200
     assert response.json() == {"result": "mocked_response"}
-    mock_group_sentenece.assert_called_once_with(
+    mock_group_sentenece.assert_awaited_once_with(
         "mocked_extracted_index",
         {
             "start_date": "2021-01-01T00:00:00",
@@ -57,4 +57,19 @@ def test_check_dependacy(mock_mg_connect, mock_es_connect, mock_apm_connect, moc
             "apm": "connected",
             "sentence_extractor": "started",
         }
-    }
\ No newline at end of file
+    }
+
+
+@patch("routes.report_route.BulkIndexer.report_all", return_value={"index": {"flushes": 2}})
+@patch("routes.report_route.SentenceExtractor.report", return_value={"batcher": {"batches": 1}})
+def test_performance_report(mock_report, mock_bulk_report, client):
+    response = client.get("/report/performance")
+    assert response.status_code == 200
+    assert response.json() == {"status": True, "data": {"batcher": {"batches": 1}, "bulk_indexer": {"index": {"flushes": 2}}}}
+
+
+@patch("routes.report_route.MemoryReport.process", return_value={"pid": 1, "uss_bytes": 2})
+def test_memory_report(mock_process, client):
+    response = client.get("/report/memory")
+    assert response.status_code == 200
+    assert response.json() == {"status": True, "data": {"pid": 1, "uss_bytes": 2}}
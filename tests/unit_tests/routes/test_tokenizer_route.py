@@ -1,6 +1,6 @@
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 from fastapi import FastAPI
 
@@ -21,7 +21,7 @@ def client():
 @patch("routes.tokenizer_route.SentenceExtractor")
 def test_tokenizer_counter_success(sentence_extrator, client):
     sentence_extrator._instance = MagicMock()
-    sentence_extrator().compute_token.return_value = 5
+    sentence_extrator().compute_token_async = AsyncMock(return_value=5)
     response = client.post(
         "/tokenizer/counter",
         json={"sentences": ["This is a test sentence"]},
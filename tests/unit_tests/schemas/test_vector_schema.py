@@ -0,0 +1,35 @@
+import pytest
+
+import io
+import numpy as np
+
+from schemas.vector_schema import binary_media_type, vector_response
+
+@pytest.mark.parametrize(
+    'accept, expected_result',
+    [
+        (None, None),
+        ('application/json', None),
+        ('application/octet-stream', 'application/octet-stream'),
+        ('application/json;q=0.5, application/x-npy', 'application/x-npy'),
+        ('Application/X-NPY; q=1', 'application/x-npy'),
+    ]
+)
+def test_binary_media_type(accept, expected_result):
+    assert binary_media_type(accept) == expected_result
+
+def test_vector_response_octet_stream():
+    vectors = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]], dtype=np.float32)
+    response = vector_response(vectors, 'application/octet-stream', 'float16')
+
+    assert response.media_type == 'application/octet-stream'
+    assert response.headers['X-Vector-Shape'] == '3,2'
+    assert response.headers['X-Vector-Dtype'] == 'float16'
+    assert np.frombuffer(response.body, dtype='<f2').reshape(3, 2).tolist() == vectors.tolist()
+
+def test_vector_response_npy():
+    vectors = np.array([[1.0, 2.0]], dtype=np.float32)
+    response = vector_response(vectors, 'application/x-npy')
+
+    assert response.headers['X-Vector-Dtype'] == 'float32'
+    assert np.load(io.BytesIO(response.body)).tolist() == vectors.tolist()